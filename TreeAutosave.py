@@ -0,0 +1,121 @@
+import threading
+import time
+import TreeJournal
+
+
+class Autosaver:
+    """:
+        Saves a notebook every few seconds on a worker thread, so saving never holds up the prompt.
+
+        The tree is only looked at while lock is held, which the CLI holds for the whole of every command. That part
+        is short: the records made since the last save are handed over, or the tree is pickled to bytes when the
+        journal needs compacting. Writing them, to a temporary file renamed over the snapshot for a compaction,
+        happens after the lock is released while the next commands already run. Paged trees are the exception,
+        their snapshot is written under the lock as the pager has to switch files with it.
+
+        Files are only written while write_lock is held, which is taken before lock is released, so saves reach the
+        file in the order they were taken. Hold write_lock to read the file while the worker may be writing it.
+        """
+
+    def __init__(self, lock, target):
+        """:
+            Args:
+                lock (RLock): Held while the tree is changed.
+                target (callable): Returns (top, filepath) of the notebook to save, None while there is no file to save to.
+            """
+        self.lock = lock
+        self.write_lock = threading.Lock()
+        self.target = target
+        self.interval = 0.0
+        self.thread = None
+        self.stopping = threading.Event()
+        self.saves = 0
+        self.last_time = None  # time.time() of the last save
+        self.last_held = 0.0  # Seconds the last save held lock
+        self.last_latency = 0.0  # Seconds from the start of the last save until it was on disk
+        self.error = None  # The error of the last save, None if it succeeded
+
+    def is_running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, interval: float) -> None:
+        """Saves every interval seconds from now on, an interval of 0 stops saving."""
+        self.stop(save=False)
+        self.interval = interval
+        if interval > 0:
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self.__run, name="autosave", daemon=True)
+            self.thread.start()
+
+    def stop(self, save: bool = True) -> None:
+        """Stops the worker thread, waiting for a save it is making, then saves what is left if save is True."""
+        if not self.is_running():
+            return
+        self.stopping.set()
+        self.thread.join()
+        self.thread = None
+        if save:
+            self.save()
+
+    def __run(self) -> None:
+        while not self.stopping.wait(self.interval):
+            try:
+                self.save()
+            except Exception as error:
+                self.error = error
+
+    def save(self) -> bool:
+        """:
+            Saves the edits made since the last save. Safe to call from the thread holding lock.
+
+            Returns:
+                bool: False if there was nothing to save.
+            """
+        start = time.perf_counter()
+        records = None
+        snapshot = None
+        self.lock.acquire()
+        try:
+            target = self.target()
+            if target is None:
+                return False
+            top, filepath = target
+            journal = top.notebook.journal
+            if journal is None or not journal.is_for(top, filepath):
+                journal = TreeJournal.Journal(top, filepath)
+                snapshot = journal.snapshot()
+            elif journal.needs_compaction():
+                snapshot = journal.snapshot()
+            elif len(journal.pending) != 0:
+                records = journal.take()
+            else:
+                return False
+            self.write_lock.acquire()
+        finally:
+            self.lock.release()
+        held = time.perf_counter() - start
+        try:
+            if records is not None:
+                journal.write(records)
+            else:
+                journal.write_snapshot(snapshot)
+        except Exception:
+            self.write_lock.release()
+            self.__drop(journal)
+            raise
+        self.write_lock.release()
+        self.saves += 1
+        self.last_time = time.time()
+        self.last_held = held
+        self.last_latency = time.perf_counter() - start
+        self.error = None
+        return True
+
+    def __drop(self, journal) -> None:
+        """Forgets a journal whose file failed to be written, the handed over records are only in a new snapshot."""
+        self.lock.acquire()
+        notebook = journal.top.notebook
+        if notebook.journal is journal:
+            notebook.remove_observer(journal)
+            notebook.journal = None
+        self.lock.release()
@@ -0,0 +1,295 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import TreeNote as tn
+import TreeWalk
+
+
+WORDS = ("alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel", "india", "juliet", "kilo", "lima",
+         "mike", "november", "oscar", "papa", "quebec", "romeo", "sierra", "tango", "uniform", "victor", "whiskey")
+DEFAULT_SIZES = ((2, 10), (3, 10), (4, 10))
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+CLI_PATH = os.path.join(REPO_DIR, "TreeNoteCLI.py")
+PROMPT = b"~: "
+
+
+def generate_notebook(depth: int, fan_out: int, description_length: int = 40, tag_count: int = 8,
+                      tag_ratio: float = 0.3, seed: int = 0) -> tn.Project:
+    """:
+        Builds a synthetic notebook where every branch above the last layer has the same number of subprojects.
+
+        Args:
+            depth (int): Number of layers below the top branch.
+            fan_out (int): Number of subprojects of every branch above the last layer.
+            description_length (int, optional): Length of the description of every branch, 0 for none. Defaults to 40.
+            tag_count (int, optional): Number of different tags in the notebook. Defaults to 8.
+            tag_ratio (float, optional): Share of the branches that get a tag. Defaults to 0.3.
+            seed (int, optional): Seed of the random titles, descriptions, tags and priorities. Defaults to 0.
+
+        Returns:
+            Project: The top branch of the notebook.
+        """
+    rng = random.Random(seed)
+    top = tn.Project("Notes", -1, None)
+    layer = [top]
+    for level in range(depth):
+        next_layer = list()
+        for parent in layer:
+            for i in range(fan_out):
+                prj = parent.def_subproject(rng.choice(WORDS) + " " + str(i))
+                if description_length != 0:
+                    description = str()
+                    while len(description) < description_length:
+                        description += rng.choice(WORDS) + " "
+                    prj.set_description(description[0: description_length])
+                if tag_count != 0 and rng.random() < tag_ratio:
+                    prj.set_tag("tag" + str(rng.randrange(tag_count)))
+                prj.set_priority(str(rng.randrange(7)))
+                next_layer.append(prj)
+        layer = next_layer
+    return top
+
+
+def branch_count(depth: int, fan_out: int) -> int:
+    return sum(fan_out ** level for level in range(depth + 1))
+
+
+# Every scenario takes a fresh notebook and a scratch directory and returns the function to time.
+def scenario_def_subproject(top, workdir):
+    branches = top.walk_tree(list())
+    return lambda: [prj.def_subproject("benchmark") for prj in branches]
+
+
+def scenario_walk_tree(top, workdir):
+    return lambda: top.walk_tree(list())
+
+
+def scenario_do_recursive(top, workdir):
+    return lambda: top.do_recursive(lambda prj: prj.get_title())
+
+
+def scenario_str_tree(top, workdir):
+    return lambda: top.__str_tree__(tags=True, priority=True)
+
+
+def scenario_move_laterally(top, workdir):
+    branches = [prj for prj in top.walk_tree(list()) if prj.parent is not None]
+    return lambda: [prj.move_laterally(1) for prj in branches]
+
+
+def scenario_wide_branch(top, workdir):
+    # An inbox with as many subprojects as the notebook has branches: move each one down, then cut every other one.
+    inbox = top.def_subproject("inbox")
+    for prj in top.walk_tree(list()):
+        inbox.def_subproject("item")
+    items = list(inbox.subprojects)
+
+    def run():
+        for prj in items:
+            prj.move_laterally(1)
+        for prj in items[::2]:
+            prj.clear_project()
+    return run
+
+
+def scenario_clear_project(top, workdir):
+    leaves = [prj for prj in TreeWalk.pre_order(top) if len(prj.subprojects) == 0]
+    return lambda: [prj.clear_project() for prj in leaves]
+
+
+def scenario_save(top, workdir):
+    path = os.path.join(workdir, "save.pkl")
+    return lambda: tn.save(top, path)
+
+
+def scenario_save_edit(top, workdir):
+    path = os.path.join(workdir, "save_edit.pkl")
+    tn.save(top, path)
+    prj = top.subprojects[0]
+
+    def run():
+        prj.set_description("one edit")
+        tn.save(top, path)
+    return run
+
+
+def scenario_load(top, workdir):
+    path = os.path.join(workdir, "load.pkl")
+    tn.save(top, path)
+    return lambda: tn.load(path)
+
+
+SCENARIOS = {
+    "def_subproject": scenario_def_subproject,
+    "walk_tree": scenario_walk_tree,
+    "do_recursive": scenario_do_recursive,
+    "__str_tree__": scenario_str_tree,
+    "move_laterally": scenario_move_laterally,
+    "wide_branch": scenario_wide_branch,
+    "clear_project": scenario_clear_project,
+    "save": scenario_save,
+    "save_edit": scenario_save_edit,
+    "load": scenario_load,
+}
+
+
+def measure(name: str, depth: int, fan_out: int, repeat: int = 3, **generate_kwargs) -> dict:
+    """:
+        Times a scenario on a fresh notebook, then runs it once more under tracemalloc for its peak memory.
+
+        Returns:
+            dict: The scenario, the notebook size, the best time in seconds and the peak memory in bytes.
+        """
+    workdir = tempfile.mkdtemp(prefix="treebench")
+    try:
+        best = None
+        for i in range(repeat):
+            run = SCENARIOS[name](generate_notebook(depth, fan_out, **generate_kwargs), workdir)
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        run = SCENARIOS[name](generate_notebook(depth, fan_out, **generate_kwargs), workdir)
+        tracemalloc.start()
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    finally:
+        shutil.rmtree(workdir)
+    return {
+        "scenario": name,
+        "depth": depth,
+        "fan_out": fan_out,
+        "branches": branch_count(depth, fan_out),
+        "seconds": best,
+        "peak_bytes": peak
+    }
+
+
+def run_suite(sizes=DEFAULT_SIZES, scenarios=None, repeat: int = 3, report=print, **generate_kwargs) -> list:
+    """:
+        Runs every scenario on notebooks of every size and reports one line per measurement.
+
+        Args:
+            sizes (tuple, optional): (depth, fan_out) pairs. Defaults to DEFAULT_SIZES.
+            scenarios (list, optional): Names of the scenarios to run, None for all. Defaults to None.
+            repeat (int, optional): Number of timed runs, the best one counts. Defaults to 3.
+            report (function, optional): Called with each line of the report. Defaults to print.
+
+        Returns:
+            list: The measurements, see measure().
+        """
+    results = list()
+    report("{:<16}{:>10}{:>12}{:>14}".format("scenario", "branches", "ms", "peak KiB"))
+    for name in scenarios or SCENARIOS:
+        for depth, fan_out in sizes:
+            result = measure(name, depth, fan_out, repeat, **generate_kwargs)
+            results.append(result)
+            report("{:<16}{:>10}{:>12.2f}{:>14}".format(
+                name, result["branches"], result["seconds"] * 1000, result["peak_bytes"] // 1024))
+    return results
+
+
+def time_to_prompt(command: list, workdir: str) -> float:
+    """Starts a command and returns the seconds until it printed the CLI's prompt, or until it exited without one."""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([REPO_DIR] + [path for path in [env.get("PYTHONPATH")] if path])
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=workdir, env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL)
+    output = bytes()
+    try:
+        while PROMPT not in output:
+            data = os.read(process.stdout.fileno(), 65536)
+            if len(data) == 0:
+                break
+            output += data
+        return time.perf_counter() - start
+    finally:
+        process.kill()
+        process.wait()
+        process.stdin.close()
+        process.stdout.close()
+
+
+def measure_startup(depth: int = 3, fan_out: int = 10, repeat: int = 5, **generate_kwargs) -> list:
+    """:
+        Times how long the CLI takes to show its first prompt: with no notebook, started as a script and as a module,
+        with a notebook of the given size opened from the command line, and with the same notebook preloaded in the
+        background. Python starting and exiting without doing anything is timed too, as the floor the others cannot
+        go below. A script is compiled on every start, a module is read from its cached bytecode.
+
+        Returns:
+            list: One dict per case, with its name, the notebook's branches and the best time in seconds.
+        """
+    workdir = tempfile.mkdtemp(prefix="treebench")
+    try:
+        path = os.path.join(workdir, "startup.pkl")
+        tn.save(generate_notebook(depth, fan_out, **generate_kwargs), path)
+        branches = branch_count(depth, fan_out)
+        module = [sys.executable, "-m", "TreeNoteCLI"]
+        cases = (
+            ("python", [sys.executable, "-c", "pass"], None, 0),
+            ("script", [sys.executable, CLI_PATH], None, 0),
+            ("module", module, None, 0),
+            ("open_notebook", module + [path], None, branches),
+            ("preload", module, {"preload": "on", "last_notebook": path}, branches),
+        )
+        results = list()
+        for name, command, config, count in cases:
+            config_path = os.path.join(workdir, "tree.conf")
+            if os.path.exists(config_path):
+                os.remove(config_path)
+            if config is not None:
+                file = open(config_path, "w")
+                json.dump(config, file)
+                file.close()
+            best = min(time_to_prompt(command, workdir) for i in range(repeat))
+            results.append({"scenario": "startup_" + name, "branches": count, "seconds": best})
+    finally:
+        shutil.rmtree(workdir)
+    return results
+
+
+def main(argv: list = None) -> None:
+    parser = argparse.ArgumentParser(description="Times the hot paths of TreeNote on synthetic notebooks.")
+    parser.add_argument("--size", action="append", metavar="DEPTHxFANOUT",
+                        help="notebook size, e.g. 3x10, may be repeated (default: 2x10 3x10 4x10)")
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS),
+                        help="scenario to run, may be repeated (default: all)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per measurement, the best counts")
+    parser.add_argument("--description-length", type=int, default=40)
+    parser.add_argument("--tag-count", type=int, default=8)
+    parser.add_argument("--json", metavar="FILE", help="also write the measurements to FILE, to compare versions")
+    parser.add_argument("--startup", action="store_true",
+                        help="time how long the CLI takes to show its first prompt instead, on a notebook of the first "
+                             "size (default: 3x10)")
+    args = parser.parse_args(argv)
+    sizes = DEFAULT_SIZES
+    if args.size:
+        sizes = [tuple(int(number) for number in size.lower().split("x")) for size in args.size]
+    if args.startup:
+        depth, fan_out = sizes[0] if args.size else (3, 10)
+        results = measure_startup(depth, fan_out, max(args.repeat, 5), description_length=args.description_length,
+                                  tag_count=args.tag_count)
+        print("{:<24}{:>10}{:>12}".format("scenario", "branches", "ms"))
+        for result in results:
+            print("{:<24}{:>10}{:>12.2f}".format(result["scenario"], result["branches"], result["seconds"] * 1000))
+    else:
+        results = run_suite(sizes, args.scenario, args.repeat,
+                            description_length=args.description_length, tag_count=args.tag_count)
+    if args.json:
+        file = open(args.json, "w")
+        json.dump(results, file, indent=2)
+        file.close()
+
+
+if __name__ == "__main__":
+    main()
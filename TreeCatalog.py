@@ -0,0 +1,114 @@
+import os
+import time
+import TreeLazy
+
+
+# Files with this extension are listed as notebooks.
+SUFFIX = ".pkl"
+
+
+class Catalog:
+    """:
+        The notebooks in a few directories, not below them, with what the headers of their snapshots tell about them.
+
+        A directory is only listed again when its modification time changed, which saving a notebook does, as the
+        new snapshot is renamed over the old one. A file's header is only read again when its size or modification
+        time changed. Edits appended to a notebook's journal since its last snapshot are not counted.
+        """
+
+    def __init__(self):
+        self.directories = dict()  # directory -> (st_mtime_ns, paths of the notebooks in it)
+        self.notebooks = dict()  # path -> dict, see describe()
+
+    def list(self, roots: list) -> list:
+        """:
+            Returns the notebooks in the root directories, each directory's sorted by name.
+
+            Returns:
+                list: One dict per notebook with its "path", "name", "size" in bytes, "mtime" in seconds since the
+                    epoch, "branches" and top branch "title". The last two are None for snapshots without a header.
+            """
+        found = list()
+        seen = set()
+        for root in roots:
+            directory = os.path.abspath(root)
+            if directory in seen:
+                continue
+            seen.add(directory)
+            found.extend(self.notebooks[path] for path in self.__scan(directory))
+        return found
+
+    def forget(self) -> None:
+        """Drops everything cached, the next listing reads every directory and header again."""
+        self.__init__()
+
+    def __scan(self, directory: str) -> list:
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            self.__drop(directory)
+            return list()
+        cached = self.directories.get(directory)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        paths = list()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if not entry.name.endswith(SUFFIX) or not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                    known = self.notebooks.get(entry.path)
+                    if known is None or known["size"] != stat.st_size or known["mtime"] != stat.st_mtime:
+                        self.notebooks[entry.path] = describe(entry.path, entry.name, stat.st_size, stat.st_mtime)
+                    paths.append(entry.path)
+        except OSError:
+            self.__drop(directory)
+            return list()
+        paths.sort(key=lambda path: os.path.basename(path).lower())
+        if cached is not None:
+            for path in set(cached[1]).difference(paths):
+                self.notebooks.pop(path, None)
+        self.directories[directory] = (mtime, paths)
+        return paths
+
+    def __drop(self, directory: str) -> None:
+        cached = self.directories.pop(directory, None)
+        if cached is not None:
+            for path in cached[1]:
+                self.notebooks.pop(path, None)
+
+
+def describe(path: str, name: str, size: int, mtime: float) -> dict:
+    """Returns what a catalog keeps about one notebook, reading only the header of its snapshot."""
+    branches = None
+    title = None
+    try:
+        file = open(path, "rb")
+        try:
+            header = TreeLazy.read_snapshot_header(file)
+        finally:
+            file.close()
+        if header is not None:
+            branches, title = header
+    except OSError:
+        pass
+    return {"path": path, "name": name, "size": size, "mtime": mtime, "branches": branches, "title": title}
+
+
+def format_notebook(notebook: dict, label: str = None) -> str:
+    """Returns one line about a notebook listed by a Catalog, starting with label or else its file name."""
+    text = notebook["name"] if label is None else label
+    if notebook["branches"] is not None:
+        text += "  " + str(notebook["branches"]) + " branches, " + notebook["title"]
+    text += "  " + format_size(notebook["size"])
+    text += "  " + time.strftime("%Y-%m-%d %H:%M", time.localtime(notebook["mtime"]))
+    return text
+
+
+def format_size(size: int) -> str:
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return str(size) + " " + unit if unit == "B" else "{:.1f} {}".format(size, unit)
+        size /= 1024
+    return "{:.1f} GiB".format(size)
@@ -0,0 +1,51 @@
+import datetime
+
+
+# Formats tried on the free text dates of notebooks saved before dates were parsed.
+LEGACY_FORMATS = ("%Y-%m-%d", "%m/%d/%Y", "%m/%d/%y", "%d.%m.%Y", "%Y/%m/%d")
+RELATIVE_DAYS = {"yesterday": -1, "today": 0, "tomorrow": 1}
+
+
+def parse_date(text: str) -> datetime.date:
+    """:
+        Parses the date of a branch.
+
+        Args:
+            text (str): YYYY-MM-DD, today, tomorrow, yesterday, or +N / -N days from today. Empty for no date.
+
+        Raises:
+            ValueError: The text is not a date.
+
+        Returns:
+            datetime.date: The date, None if the text is empty.
+        """
+    text = text.strip().lower()
+    if len(text) == 0:
+        return None
+    if text in RELATIVE_DAYS:
+        return datetime.date.today() + datetime.timedelta(days=RELATIVE_DAYS[text])
+    if text[0] in "+-" and text[1:].isdigit():
+        return datetime.date.today() + datetime.timedelta(days=int(text))
+    return datetime.date.fromisoformat(text)
+
+
+def as_date(value) -> datetime.date:
+    """:
+        Returns the date of a branch from whatever an older version stored, a date, None or free text.
+        Text that does not read as a date in any of the LEGACY_FORMATS is dropped.
+        """
+    if value is None or isinstance(value, datetime.date):
+        return value
+    for date_format in LEGACY_FORMATS:
+        try:
+            return datetime.datetime.strptime(value.strip(), date_format).date()
+        except ValueError:
+            pass
+    return None
+
+
+def format_date(date: datetime.date) -> str:
+    """Returns the text of a date as it is printed and exported, empty for no date."""
+    if date is None:
+        return str()
+    return date.isoformat()
@@ -0,0 +1,147 @@
+import json
+import os
+from xml.sax.saxutils import escape, quoteattr
+import TreeDate
+import TreeWalk
+
+
+# Lines are written to the file in batches of this many.
+WRITE_BATCH = 1024
+FORMATS = {".jsonl": "jsonl", ".md": "markdown", ".markdown": "markdown", ".opml": "opml", ".xml": "opml"}
+
+
+def guess_format(filepath: str) -> str:
+    """Returns the format to export to from the extension of a file, JSON Lines if it is not known."""
+    return FORMATS.get(os.path.splitext(filepath)[1].lower(), "jsonl")
+
+
+def branches(prj):
+    """:
+        Yields the branches to export below a branch with their depth, starting at 0.
+        The top branch of a notebook only holds the rest, it is left out and its subprojects are the first layer.
+        """
+    top_layer = prj.layer
+    if prj.parent is None:
+        top_layer += 1
+    for branch in TreeWalk.pre_order(prj):
+        if branch.parent is None:
+            continue
+        yield branch, branch.layer - top_layer
+
+
+def markers(prj, depth: int) -> str:
+    """:
+        Returns the inline markers of the tags, date and priority of a branch, as TreeImport reads them.
+        The priority is left out when the branch has the one it inherits on import.
+        """
+    parts = ["#" + tag for tag in sorted(prj.tags)]
+    if prj.date is not None:
+        parts.append("@" + TreeDate.format_date(prj.date))
+    inherited = "0" if depth == 0 else prj.parent.priority
+    if prj.priority != inherited:
+        parts.append("!" + prj.priority)
+    return " ".join(parts)
+
+
+def jsonl_lines(prj):
+    """:
+        Yields one JSON object per line for a branch and every branch below it, parents first.
+
+        Yields:
+            str: {"id", "parent", "layer", "title", "description", "priority", "tags", "date"}, ending with a newline.
+        """
+    for branch in TreeWalk.pre_order(prj):
+        yield json.dumps({
+            "id": branch.id,
+            "parent": None if branch.parent is None else branch.parent.id,
+            "layer": branch.layer,
+            "title": branch.title,
+            "description": branch.description.strip(),
+            "priority": branch.priority,
+            "tags": sorted(branch.tags),
+            "date": None if branch.date is None else TreeDate.format_date(branch.date)
+        }) + "\n"
+
+
+def markdown_lines(prj):
+    """:
+        Yields a Markdown list of the branches below a branch, nested by indentation.
+        Descriptions are a line of text below their branch, tags, date and priority are inline markers.
+        """
+    for branch, depth in branches(prj):
+        indent = "  " * depth
+        text = branch.title
+        branch_markers = markers(branch, depth)
+        if len(branch_markers) != 0:
+            text += " " + branch_markers
+        yield indent + "- " + text + "\n"
+        description = branch.description.strip()
+        if len(description) != 0:
+            yield indent + "  " + " ".join(description.split()) + "\n"
+
+
+def opml_lines(prj):
+    """:
+        Yields an OPML document of the branches below a branch, one outline element per branch.
+        Descriptions are the _note attribute, tags, date and priority are inline markers in the text.
+        """
+    yield '<?xml version="1.0" encoding="utf-8"?>\n'
+    yield '<opml version="2.0">\n'
+    yield "  <head><title>" + escape(prj.title) + "</title></head>\n"
+    yield "  <body>\n"
+    depth = -1
+    for branch, branch_depth in branches(prj):
+        # Close the outlines of the previous branch and of the layers left since.
+        if branch_depth <= depth:
+            yield "/>\n"
+        for closed in range(depth - 1, branch_depth - 1, -1):
+            yield "    " + "  " * closed + "</outline>\n"
+        if branch_depth > depth and depth != -1:
+            yield ">\n"
+        depth = branch_depth
+        text = branch.title
+        branch_markers = markers(branch, depth)
+        if len(branch_markers) != 0:
+            text += " " + branch_markers
+        element = "    " + "  " * depth + "<outline text=" + quoteattr(text)
+        description = branch.description.strip()
+        if len(description) != 0:
+            element += " _note=" + quoteattr(description)
+        yield element
+    if depth != -1:
+        yield "/>\n"
+    for closed in range(depth - 1, -1, -1):
+        yield "    " + "  " * closed + "</outline>\n"
+    yield "  </body>\n"
+    yield "</opml>\n"
+
+
+WRITERS = {"jsonl": jsonl_lines, "markdown": markdown_lines, "opml": opml_lines}
+
+
+def write_lines(lines, stream) -> None:
+    """Writes lines to a stream as they are made, WRITE_BATCH at a time."""
+    batch = list()
+    for line in lines:
+        batch.append(line)
+        if len(batch) == WRITE_BATCH:
+            stream.write(str().join(batch))
+            batch = list()
+    stream.write(str().join(batch))
+
+
+def export_file(prj, filepath: str, file_format: str = None) -> None:
+    """:
+        Exports a branch and every branch below it, walking the tree as the file is written.
+
+        Args:
+            prj (Project): The branch to export.
+            filepath (str): The file to write.
+            file_format (str, optional): "jsonl", "markdown" or "opml", guessed from the extension if None.
+        """
+    file_format = file_format or guess_format(filepath)
+    file = open(filepath, "w", encoding="utf-8")
+    try:
+        write_lines(WRITERS[file_format](prj), file)
+    finally:
+        file.close()
@@ -0,0 +1,218 @@
+import os
+import re
+from xml.etree import ElementTree
+import TreeDate
+
+
+# Inline markers of a line: #tag, @date and !priority, each a word of its own. Dates are read by TreeDate.parse_date.
+MARKERS = "#@!"
+LIST_ITEM = re.compile(r"([-*+]|\d+[.)])\s+(\[[ xX]\]\s+)?")
+HEADING = re.compile(r"(#{1,6})\s+")
+TAB_SIZE = 4
+# Imports of at least this many branches leave the indexes to be built again when next used, which is cheaper than
+# updating them one branch at a time.
+STALE_INDEX_MIN = 10000
+FORMATS = {".md": "markdown", ".markdown": "markdown", ".opml": "opml", ".xml": "opml"}
+
+
+def guess_format(filepath: str) -> str:
+    """Returns the format of an outline file from its extension, indented text if it is not known."""
+    return FORMATS.get(os.path.splitext(filepath)[1].lower(), "text")
+
+
+def indent_level(indents: list, indent: int) -> int:
+    """:
+        Returns the nesting level of a line from its indentation, whatever the width of one level in the file.
+
+        Args:
+            indents (list): Indentations of the enclosing lines, kept between calls.
+            indent (int): Indentation of the line, in columns.
+        """
+    while len(indents) != 0 and indents[-1] > indent:
+        indents.pop()
+    if len(indents) == 0 or indents[-1] < indent:
+        indents.append(indent)
+    return len(indents) - 1
+
+
+def text_lines(lines):
+    """:
+        Reads an outline where every line is a branch and the indentation gives its layer.
+
+        Yields:
+            tuple: (depth, text) of every branch.
+        """
+    indents = list()
+    for line in lines:
+        line = line.rstrip().expandtabs(TAB_SIZE)
+        text = line.lstrip()
+        if len(text) == 0:
+            continue
+        yield indent_level(indents, len(line) - len(text)), text
+
+
+def markdown_lines(lines):
+    """:
+        Reads a Markdown outline. Headings and list items are branches, nested by heading level and then by
+        indentation below the last heading. Any other text is the description of the branch before it.
+
+        Yields:
+            tuple: (depth, text) of every branch, (None, text) for a line of description.
+        """
+    indents = list()
+    heading_depth = -1
+    for line in lines:
+        line = line.rstrip().expandtabs(TAB_SIZE)
+        text = line.lstrip()
+        if len(text) == 0:
+            continue
+        heading = HEADING.match(line)
+        if heading is not None:
+            heading_depth = len(heading.group(1)) - 1
+            indents = list()
+            yield heading_depth, line[heading.end():]
+            continue
+        item = LIST_ITEM.match(text)
+        if item is None:
+            yield None, text
+            continue
+        yield heading_depth + 1 + indent_level(indents, len(line) - len(text)), text[item.end():]
+
+
+def opml_lines(file):
+    """:
+        Reads an OPML outline without building its document: every outline element is dropped as soon as it ends.
+        The text attribute is the branch, the _note attribute its description.
+
+        Yields:
+            tuple: (depth, text) of every branch, (None, text) for its description.
+        """
+    elements = list()  # The open elements, down to the current outline
+    depth = 0
+    for event, element in ElementTree.iterparse(file, events=("start", "end")):
+        if event == "start":
+            elements.append(element)
+            if element.tag == "outline":
+                yield depth, element.get("text", str())
+                note = element.get("_note")
+                if note:
+                    yield None, " ".join(note.split())
+                depth += 1
+            continue
+        elements.pop()
+        if element.tag == "outline":
+            depth -= 1
+            element.clear()
+            if len(elements) != 0:
+                elements[-1].remove(element)
+
+
+READERS = {"text": text_lines, "markdown": markdown_lines, "opml": opml_lines}
+
+
+def parse_markers(text: str) -> tuple:
+    """:
+        Takes the inline markers out of the text of a branch.
+
+        Returns:
+            tuple: (title, tags, date, priority), date and priority are None if the text has no such marker.
+        """
+    tags = set()
+    date = None
+    priority = None
+    if "#" not in text and "@" not in text and "!" not in text:
+        return text, tags, date, priority
+    title = list()
+    for word in text.split():
+        kind = word[0]
+        if kind not in MARKERS or len(word) == 1:
+            title.append(word)
+        elif kind == "#":
+            tags.add(word[1:])
+        elif kind == "@":
+            try:
+                date = TreeDate.parse_date(word[1:])
+            except ValueError:
+                title.append(word)
+        elif word[1:].isdigit():
+            priority = str(min(6, int(word[1:])))
+        else:
+            title.append(word)
+    return " ".join(title), tags, date, priority
+
+
+def graft(parent, lines) -> list:
+    """:
+        Builds the branches of an outline below a branch in a single pass, keeping only the path from the parent down
+        to the last branch in memory. Titles are kept as written. Observers are told once per top level branch,
+        as if it was pasted, instead of once per change.
+
+        Args:
+            parent (Project): The branch to graft the outline below.
+            lines (iterable): (depth, text) tuples from one of the READERS.
+
+        Returns:
+            list: The new top level branches.
+        """
+    roots = list()
+    path = [(-1, parent)]
+    last = None
+    count = 0
+    try:
+        for depth, text in lines:
+            if depth is None:
+                if last is not None:
+                    if len(last.description) == 0:
+                        last.description = last.get_layer_description_spacing() + text
+                    else:
+                        last.description += " " + text
+                continue
+            while path[-1][0] >= depth:
+                path.pop()
+            title, tags, date, priority = parse_markers(text)
+            last = path[-1][1]._new_subproject(title)
+            count += 1
+            if len(tags) != 0:
+                last.tags = tags
+            if date is not None:
+                last.date = date
+            if priority is not None:
+                last.priority = priority
+            if len(path) == 1:
+                roots.append(last)
+            path.append((depth, last))
+    except Exception:
+        # Nobody was told about the branches yet, a broken file leaves the tree as it was.
+        for root in roots:
+            root._detach()
+        raise
+    notebook = parent.notebook
+    if count >= STALE_INDEX_MIN:
+        notebook.stale_indexes.update(notebook.indexes)
+    for root in roots:
+        notebook.notify("paste_subproject", parent, root)
+    return roots
+
+
+def import_file(parent, filepath: str, file_format: str = None) -> list:
+    """:
+        Imports an outline file below a branch.
+
+        Args:
+            parent (Project): The branch to graft the outline below.
+            filepath (str): An indented text, Markdown or OPML file.
+            file_format (str, optional): "text", "markdown" or "opml", guessed from the extension if None.
+
+        Returns:
+            list: The new top level branches.
+        """
+    file_format = file_format or guess_format(filepath)
+    if file_format == "opml":
+        file = open(filepath, "rb")
+    else:
+        file = open(filepath, "r", encoding="utf-8")
+    try:
+        roots = graft(parent, READERS[file_format](file))
+    finally:
+        file.close()
+    return roots
@@ -0,0 +1,893 @@
+import bisect
+import math
+import re
+import sys
+import weakref
+import TreeLazy
+import TreeTags
+import TreeWalk
+
+
+class Observer:
+    """Base class for objects that follow the mutations of a notebook."""
+
+    keeps_branches = True  # False for an index that keeps only ids, see keep()
+    branch_of = None  # TreeStore.branch() of the store whose branches the index keeps by id, see keep()
+
+    def notify(self, event: str, prj, *args) -> None:
+        """:
+            Dispatches a mutation event to the matching on_<event> method, if the observer defines one.
+
+            Args:
+                event (str): Name of the Project method that mutated the tree, e.g. "set_tag".
+                prj (Project): The branch the method was called on.
+            """
+        handler = getattr(self, "on_" + event, None)
+        if handler is not None:
+            handler(prj, *args)
+
+    def build(self, top) -> None:
+        """Fills the index from an existing tree, subclasses that index something override it."""
+        pass
+
+    def keep(self, prj):
+        """:
+            Returns what an index keeps of a branch: the branch, a PagedRef to it if the tree is paged, or its id if
+            it is a branch of a TreeStore, whose branches are made from their id when they are asked for.
+            """
+        if prj.notebook.paged:
+            return PagedRef(prj)
+        if TreeLazy.is_store(prj):
+            self.branch_of = prj.store.branch
+            return prj.id
+        return prj
+
+    def kept(self, value):
+        """Returns the branch the index kept with keep(), None for None."""
+        if type(value) is int:
+            return self.branch_of(value)
+        return value() if type(value) is PagedRef else value
+
+
+def is_below(prj, scope) -> bool:
+    """Returns True if prj is scope or one of the branches below it. Costs one step per layer between them."""
+    while prj is not None:
+        if prj.id == scope.id:
+            return True
+        prj = prj.parent
+    return False
+
+
+class PagedRef(weakref.ref):
+    """:
+        What an index keeps of a branch of a paged tree: a weak reference, so the index does not keep the pager from
+        evicting the branch, that loads the branch again by its id once it was.
+        """
+
+    __slots__ = ("id", "notebook")
+
+    def __new__(cls, prj):
+        ref = weakref.ref.__new__(cls, prj)
+        ref.id = prj.id
+        ref.notebook = prj.notebook
+        return ref
+
+    def __init__(self, prj):
+        weakref.ref.__init__(self, prj)
+
+    def __call__(self):
+        prj = weakref.ref.__call__(self)
+        if prj is None:
+            prj = self.notebook.pager.branch(self.id)
+        return prj
+
+
+def parse_query(words: list) -> list:
+    """:
+        Parses the words of a tag query into groups that are OR-ed together.
+        Within a group every tag must be set, and every tag following "not" must not be set.
+        "work urgent or home not done" finds branches tagged work and urgent, or tagged home but not done.
+
+        Args:
+            words (list): The words of the query.
+
+        Returns:
+            list: Tuples of (tags that must be set, tags that must not be set).
+        """
+    groups = [(list(), list())]
+    negate = False
+    for word in words:
+        if len(word) == 0:
+            continue
+        if word.lower() == "or":
+            groups.append((list(), list()))
+        elif word.lower() == "not":
+            negate = True
+            continue
+        else:
+            groups[-1][1 if negate else 0].append(word)
+        negate = False
+    return [group for group in groups if len(group[0]) + len(group[1]) != 0]
+
+
+class TagIndex(Observer):
+    """:
+        Inverted index of tag id to the branches that carry it, and to the branches with a rule setting or unsetting
+        it for everything below them.
+        Kept up to date by the tree's mutations, so a query costs time in the number of branches found, not the
+        number of branches in the tree. A tag that is set by a rule is found by walking the branches below the rule.
+        """
+
+    def __init__(self):
+        self.tags = dict()  # tag id -> {branch id: branch} with the tag of its own
+        self.rules = dict()  # tag id -> {branch id: branch} with a rule for the tag
+
+    def build(self, top) -> None:
+        self.__init__()
+        self.__add_subtree(top)
+
+    def get_tags(self) -> list:
+        """Returns the ids of the tags some branch carries or has a rule for."""
+        return sorted(set(self.tags).union(self.rules))
+
+    def find(self, tag: int) -> list:
+        return [self.kept(value) for value in self.tags.get(tag, dict()).values()]
+
+    def find_rules(self, tag: int) -> list:
+        return [self.kept(value) for value in self.rules.get(tag, dict()).values()]
+
+    def query(self, words: list, scope) -> list:
+        """:
+            Returns the branches below scope matching a tag query, see parse_query() for the syntax.
+            A group made only of "not" tags has to look at every branch below scope.
+
+            Args:
+                words (list): The words of the query.
+                scope (Project): Only this branch and the branches below it are returned.
+
+            Returns:
+                list: The matching branches, oldest first.
+            """
+        table = scope.notebook.tag_table
+        found = dict()
+        for required, excluded in query_masks(parse_query(words), table):
+            if required != 0:
+                sizes = {tag: len(self.tags.get(tag, ())) + len(self.rules.get(tag, ())) for tag in TreeTags.bits(required)}
+                tag = min(sizes, key=sizes.get)
+                candidates = self.__carrying(tag)
+            else:
+                candidates = TreeWalk.pre_order(scope)
+            for prj in candidates:
+                if prj.id in found:
+                    continue
+                mask = prj.tag_mask
+                if mask & required != required or mask & excluded:
+                    continue
+                if required != 0 and not is_below(prj, scope):
+                    continue
+                found[prj.id] = prj
+        return [found[prj_id] for prj_id in sorted(found)]
+
+    def __carrying(self, tag: int):
+        """Yields every branch that may carry a tag: the ones that have it of their own and the ones below a rule."""
+        for value in self.tags.get(tag, dict()).values():
+            yield self.kept(value)
+        for prj in self.find_rules(tag):
+            if prj.tag_rules[tag][1]:
+                yield from TreeWalk.pre_order(prj)
+
+    def on_set_tag(self, prj, tag: int) -> None:
+        self.tags.setdefault(tag, dict())[prj.id] = self.keep(prj)
+
+    def on_unset_tag(self, prj, tag: int) -> None:
+        self.__remove(self.tags, prj, tag)
+
+    def on_set_tag_below(self, prj, tag: int) -> None:
+        self.rules.setdefault(tag, dict())[prj.id] = self.keep(prj)
+
+    def on_unset_tag_below(self, prj, tag: int) -> None:
+        self.rules.setdefault(tag, dict())[prj.id] = self.keep(prj)
+
+    def on_set_marks(self, prj, tags: int, priority: str, stamps: tuple) -> None:
+        for index in (self.tags, self.rules):
+            for tag in [tag for tag, branches in index.items() if prj.id in branches]:
+                self.__remove(index, prj, tag)
+        self.__add(prj)
+
+    def on_rename_tag(self, top, tag: int, old: str, name: str) -> None:
+        into = top.notebook.tag_table.lookup(name)
+        if into == tag:
+            return
+        # Merged into another tag.
+        for index in (self.tags, self.rules):
+            branches = index.pop(tag, None)
+            if branches is not None:
+                index.setdefault(into, dict()).update(branches)
+
+    def on_move_vertically(self, prj, direction: int) -> None:
+        # Moved up, the branches below it were given the marks they inherited from the branch it left.
+        if direction > 0:
+            for branch in TreeWalk.pre_order(prj):
+                self.on_set_marks(branch, branch.get_own_tags(), None, None)
+
+    def on_clear_project(self, prj, parent) -> None:
+        for branch in TreeWalk.pre_order(prj):
+            for tag in TreeTags.bits(branch.get_own_tags()):
+                self.__remove(self.tags, branch, tag)
+            for tag in branch.tag_rules or ():
+                self.__remove(self.rules, branch, tag)
+
+    def on_paste_subproject(self, prj, pasted) -> None:
+        self.__add_subtree(pasted)
+
+    @staticmethod
+    def __remove(index: dict, prj, tag: int) -> None:
+        branches = index.get(tag)
+        if branches is None:
+            return
+        branches.pop(prj.id, None)
+        if len(branches) == 0:
+            del index[tag]
+
+    def __add_subtree(self, prj) -> None:
+        for branch in TreeWalk.pre_order(prj):
+            self.__add(branch)
+
+    def __add(self, prj) -> None:
+        for tag in TreeTags.bits(prj.get_own_tags()):
+            self.on_set_tag(prj, tag)
+        for tag in prj.tag_rules or ():
+            self.on_set_tag_below(prj, tag)
+
+
+def query_masks(groups: list, table) -> list:
+    """:
+        Turns the groups of a parsed tag query, see parse_query(), into masks of the notebook's tag ids, for matches().
+        Groups requiring a tag no branch was ever given are left out, they match nothing.
+
+        Returns:
+            list: Tuples of (mask of the tags that must be set, mask of the tags that must not be set).
+        """
+    masks = list()
+    for required, excluded in groups:
+        if all(table.lookup(tag) is not None for tag in required):
+            masks.append((table.mask(required), table.mask(excluded)))
+    return masks
+
+
+def matches(prj, masks: list) -> bool:
+    """Returns True if the tags of a branch match any group of a tag query, as query_masks() returned it."""
+    mask = prj.tag_mask
+    for required, excluded in masks:
+        if mask & required == required and not mask & excluded:
+            return True
+    return False
+
+
+class PriorityIndex(Observer):
+    """:
+        The leaves of the tree, the branches without subprojects, bucketed by priority level.
+        The most urgent leaves are read from the highest bucket down, without looking at the rest of the tree.
+        """
+
+    LEVELS = ("6", "5", "4", "3", "2", "1", "0")
+
+    def __init__(self):
+        self.levels = {level: dict() for level in self.LEVELS}  # priority -> {branch id: branch}, oldest first
+        self.leaves = dict()  # branch id -> priority it is bucketed under
+
+    def build(self, top) -> None:
+        self.__init__()
+        self.__add_subtree(top)
+
+    def next(self, count: int, scope=None, words: list = None) -> list:
+        """:
+            Returns the most urgent leaves, highest priority first and, within a priority, the ones that got it first.
+
+            Args:
+                count (int): Number of leaves to return.
+                scope (Project, optional): Only leaves below this branch are returned. Defaults to None.
+                words (list, optional): A tag query the leaves must match, see parse_query(). Defaults to None.
+
+            Returns:
+                list: The leaves.
+            """
+        groups = parse_query(words or list())
+        masks = None
+        found = list()
+        for level in self.LEVELS:
+            for value in self.levels[level].values():
+                if len(found) == count:
+                    return found
+                prj = self.kept(value)
+                if len(groups) != 0:
+                    if masks is None:
+                        masks = query_masks(groups, prj.notebook.tag_table)
+                    if not matches(prj, masks):
+                        continue
+                if scope is not None and not is_below(prj, scope):
+                    continue
+                found.append(prj)
+        return found
+
+    def on_def_subproject(self, prj, sub_project) -> None:
+        self.__refresh(prj)
+        self.__refresh(sub_project)
+
+    def on_set_priority(self, prj, priority: str) -> None:
+        self.__refresh(prj)
+
+    def on_set_priority_below(self, prj, priority: str) -> None:
+        # The leaves below are bucketed under the priority they inherit.
+        self.__add_subtree(prj)
+
+    def on_set_marks(self, prj, tags: int, priority: str, stamps: tuple) -> None:
+        self.__add_subtree(prj)
+
+    def on_clear_project(self, prj, parent) -> None:
+        for branch in TreeWalk.pre_order(prj):
+            self.__remove(branch)
+        self.__refresh(parent)
+
+    def on_paste_subproject(self, prj, pasted) -> None:
+        self.__refresh(prj)
+        self.__add_subtree(pasted)
+
+    def on_move_vertically(self, prj, direction: int) -> None:
+        # The branch the moved one left is not known any more, finding it costs as much as a rebuild.
+        top = prj
+        while top.parent is not None:
+            top = top.parent
+        self.build(top)
+
+    def __add_subtree(self, prj) -> None:
+        for branch in TreeWalk.pre_order(prj):
+            self.__refresh(branch)
+
+    def __refresh(self, prj) -> None:
+        """Buckets a branch under its priority if it is a leaf, takes it out otherwise."""
+        if prj.parent is None or len(prj.subprojects) != 0:
+            self.__remove(prj)
+        elif self.leaves.get(prj.id) != prj.priority:
+            self.__remove(prj)
+            self.levels.setdefault(prj.priority, dict())[prj.id] = self.keep(prj)
+            self.leaves[prj.id] = prj.priority
+
+    def __remove(self, prj) -> None:
+        priority = self.leaves.pop(prj.id, None)
+        if priority is not None:
+            del self.levels[priority][prj.id]
+
+
+class DateIndex(Observer):
+    """:
+        The dated branches sorted by date, so the ones due in a range are found by bisection.
+        A query costs time in the log of the number of dated branches plus the number of branches found.
+        """
+
+    def __init__(self):
+        self.keys = list()  # Sorted (date, branch id)
+        self.branches = dict()  # branch id -> (branch, date it is indexed under)
+
+    def build(self, top) -> None:
+        self.__init__()
+        self.__add_subtree(top)
+
+    def between(self, start=None, end=None, scope=None) -> list:
+        """:
+            Returns the branches due from start up to but not including end, soonest first.
+
+            Args:
+                start (datetime.date, optional): First day of the range, None for no limit. Defaults to None.
+                end (datetime.date, optional): Day after the range, None for no limit. Defaults to None.
+                scope (Project, optional): Only this branch and the branches below it are returned. Defaults to None.
+
+            Returns:
+                list: The branches.
+            """
+        keys = self.keys
+        first = 0 if start is None else bisect.bisect_left(keys, (start, -1))
+        last = len(keys) if end is None else bisect.bisect_left(keys, (end, -1))
+        found = list()
+        for date, prj_id in keys[first: last]:
+            prj = self.kept(self.branches[prj_id][0])
+            if scope is None or is_below(prj, scope):
+                found.append(prj)
+        return found
+
+    def on_set_date(self, prj, date) -> None:
+        self.__remove(prj)
+        self.__add(prj)
+
+    def on_clear_project(self, prj, parent) -> None:
+        for branch in TreeWalk.pre_order(prj):
+            self.__remove(branch)
+
+    def on_paste_subproject(self, prj, pasted) -> None:
+        self.__add_subtree(pasted)
+
+    def __add_subtree(self, prj) -> None:
+        # The keys are appended and sorted once at the end, instead of one insort each. The sort is done here and not
+        # by the next query, queries may run at the same time and must not change the index.
+        added = False
+        for branch in TreeWalk.pre_order(prj):
+            if branch.date is not None:
+                self.keys.append((branch.date, branch.id))
+                self.branches[branch.id] = (self.keep(branch), branch.date)
+                added = True
+        if added:
+            self.keys.sort()
+
+    def __add(self, prj) -> None:
+        if prj.date is None:
+            return
+        bisect.insort(self.keys, (prj.date, prj.id))
+        self.branches[prj.id] = (self.keep(prj), prj.date)
+
+    def __remove(self, prj) -> None:
+        entry = self.branches.pop(prj.id, None)
+        if entry is None:
+            return
+        del self.keys[bisect.bisect_left(self.keys, (entry[1], prj.id))]
+
+
+def tokenize(text: str) -> list:
+    """Returns the lower case words of a text."""
+    return re.findall(r"\w+", text.lower())
+
+
+class TextIndex(Observer):
+    """:
+        Inverted index of the words in the titles and descriptions of the branches.
+        Query words match every indexed word they are a prefix of, hits are ranked by how often and where the words
+        appear, weighted by how rare they are in the notebook.
+        """
+
+    TITLE_WEIGHT = 3
+    PREFIX_WEIGHT = 0.5
+
+    def __init__(self):
+        self.words = dict()  # word -> (branch id, weight) if one branch has it, else {branch id: weight}
+        self.vocabulary = list()  # Sorted words, for prefix lookups
+        self.branches = dict()  # branch id -> (branch, then the words it is indexed under), one flat tuple
+
+    def __getstate__(self) -> dict:
+        # Pickled without the branches, which are given back by rebind().
+        state = self.__dict__.copy()
+        state["branches"] = {prj_id: entry[1:] for prj_id, entry in self.branches.items()}
+        return state
+
+    def rebind(self, branches: dict) -> None:
+        """Gives an unpickled index the branches of the tree again, branches is id -> branch."""
+        self.branches = {prj_id: (self.keep(branches[prj_id]),) + words for prj_id, words in self.branches.items()}
+
+    def build(self, top) -> None:
+        self.__init__()
+        self.__add_subtree(top)
+
+    def query(self, words: list, scope=None, limit: int = None) -> list:
+        """:
+            Returns the branches matching every word of a query, best match first.
+
+            Args:
+                words (list): The words of the query, each one matching the indexed words it is a prefix of.
+                scope (Project, optional): Only this branch and the branches below it are returned. Defaults to None.
+                limit (int, optional): Number of hits to return, None for all of them. Defaults to None.
+
+            Returns:
+                list: The matching branches.
+            """
+        scores = None
+        for query_word in tokenize(" ".join(words)):
+            word_scores = dict()
+            for word in self.__complete(query_word):
+                branches = self.words[word]
+                branches = branches.items() if type(branches) is dict else (branches,)
+                weight = math.log(1 + len(self.branches) / len(branches))
+                if word != query_word:
+                    weight *= self.PREFIX_WEIGHT
+                for prj_id, count in branches:
+                    word_scores[prj_id] = word_scores.get(prj_id, 0) + count * weight
+            if scores is None:
+                scores = word_scores
+            else:
+                scores = {prj_id: score + word_scores[prj_id] for prj_id, score in scores.items() if prj_id in word_scores}
+        if scores is None:
+            return list()
+        found = list()
+        for prj_id in sorted(scores, key=lambda prj_id: (-scores[prj_id], prj_id)):
+            prj = self.kept(self.branches[prj_id][0])
+            if scope is not None and not is_below(prj, scope):
+                continue
+            found.append(prj)
+            if limit is not None and len(found) == limit:
+                break
+        return found
+
+    def on_def_subproject(self, prj, sub_project) -> None:
+        self.__add(sub_project)
+
+    def on_set_description(self, prj, description: str) -> None:
+        self.__remove(prj)
+        self.__add(prj)
+
+    on_restore_description = on_set_description
+
+    def on_clear_project(self, prj, parent) -> None:
+        for branch in TreeWalk.pre_order(prj):
+            self.__remove(branch)
+
+    def on_paste_subproject(self, prj, pasted) -> None:
+        self.__add_subtree(pasted)
+
+    def __complete(self, prefix: str):
+        position = bisect.bisect_left(self.vocabulary, prefix)
+        while position < len(self.vocabulary) and self.vocabulary[position].startswith(prefix):
+            yield self.vocabulary[position]
+            position += 1
+
+    def __add_subtree(self, prj) -> None:
+        # New words are appended and the vocabulary sorted once at the end, instead of one insort each.
+        size = len(self.vocabulary)
+        for branch in TreeWalk.pre_order(prj):
+            self.__add(branch, True)
+        if len(self.vocabulary) != size:
+            self.vocabulary.sort()
+
+    def __add(self, prj, bulk: bool = False) -> None:
+        # Interned, so the index and the words of every branch share one string for each word.
+        weights = dict()
+        for word in tokenize(prj.title):
+            word = sys.intern(word)
+            weights[word] = weights.get(word, 0) + self.TITLE_WEIGHT
+        for word in tokenize(prj.description):
+            word = sys.intern(word)
+            weights[word] = weights.get(word, 0) + 1
+        for word, weight in weights.items():
+            branches = self.words.get(word)
+            if branches is None:
+                # Most words of a notebook are in one branch only, they get no dict.
+                self.words[word] = (prj.id, weight)
+                if bulk:
+                    self.vocabulary.append(word)
+                else:
+                    bisect.insort(self.vocabulary, word)
+            elif type(branches) is dict:
+                branches[prj.id] = weight
+            else:
+                self.words[word] = {branches[0]: branches[1], prj.id: weight}
+        self.branches[prj.id] = (self.keep(prj), *weights)
+
+    def __remove(self, prj) -> None:
+        entry = self.branches.pop(prj.id, None)
+        if entry is None:
+            return
+        for word in entry[1:]:
+            branches = self.words[word]
+            if type(branches) is not dict:
+                del self.words[word]
+                del self.vocabulary[bisect.bisect_left(self.vocabulary, word)]
+                continue
+            branches.pop(prj.id, None)
+            if len(branches) == 1:
+                self.words[word] = next(iter(branches.items()))
+
+
+class BranchIndex(Observer):
+    """:
+        The branches by id, and by the id of their parent and their title, so a branch is found from its id in O(1)
+        and from a path of titles in one lookup per layer.
+        """
+
+    def __init__(self):
+        self.branches = dict()  # branch id -> branch, see keep()
+        self.titles = dict()  # (parent id, lower case title) -> branch, or {branch id: branch} oldest first if several
+        self.keys = dict()  # branch id -> the key it is filed under in titles
+
+    def build(self, top) -> None:
+        self.__init__()
+        self.__add_subtree(top)
+
+    def find(self, prj_id: int):
+        """Returns the branch with an id, None if the tree has none."""
+        return self.kept(self.branches.get(prj_id))
+
+    def resolve(self, path: str, scope):
+        """:
+            Returns the branch at the end of a path of titles separated by "/", e.g. "Work/Reports/Monthly".
+            Titles are matched regardless of case, of branches with the same title the oldest one is taken.
+
+            Args:
+                path (str): The path.
+                scope (Project): The branch the path starts from, its subprojects hold the first title.
+
+            Returns:
+                Project: The branch, None if there is no branch at the path.
+            """
+        prj = scope
+        for title in path.split("/"):
+            title = title.strip()
+            if len(title) == 0:
+                continue
+            value = self.titles.get((prj.id, title.lower()))
+            if value is None:
+                return None
+            if type(value) is dict:
+                value = next(iter(value.values()))
+            prj = self.kept(value)
+        return prj
+
+    def path(self, prj) -> str:
+        """Returns the path of titles leading from the top branch to a branch."""
+        titles = list()
+        while prj.parent is not None:
+            titles.append(prj.title)
+            prj = prj.parent
+        return "/".join(reversed(titles))
+
+    def on_def_subproject(self, prj, sub_project) -> None:
+        self.__add(sub_project)
+
+    def on_clear_project(self, prj, parent) -> None:
+        for branch in TreeWalk.pre_order(prj):
+            self.__remove(branch)
+
+    def on_paste_subproject(self, prj, pasted) -> None:
+        self.__add_subtree(pasted)
+
+    def on_move_vertically(self, prj, direction: int) -> None:
+        # The branch was moved into a new blank branch, which was made without notifying.
+        self.__remove(prj)
+        if prj.parent.id not in self.branches:
+            self.__add(prj.parent)
+        self.__add(prj)
+
+    def __add_subtree(self, prj) -> None:
+        for branch in TreeWalk.pre_order(prj):
+            self.__add(branch)
+
+    def __add(self, prj) -> None:
+        value = self.branches[prj.id] = self.keep(prj)
+        if prj.parent is None:
+            return
+        key = (prj.parent.id, prj.title.lower())
+        other = self.titles.get(key)
+        if other is None:
+            self.titles[key] = value
+        else:
+            if type(other) is not dict:
+                # Most titles are unique among their siblings, only a clash needs a dict.
+                other_id = other if type(other) is int else other.id  # a PagedRef knows its id too
+                other = self.titles[key] = {other_id: other}
+            other[prj.id] = value
+        self.keys[prj.id] = key
+
+    def __remove(self, prj) -> None:
+        self.branches.pop(prj.id, None)
+        key = self.keys.pop(prj.id, None)
+        if key is None:
+            return
+        branches = self.titles[key]
+        if type(branches) is not dict:
+            del self.titles[key]
+            return
+        branches.pop(prj.id, None)
+        if len(branches) == 1:
+            self.titles[key] = next(iter(branches.values()))
+
+
+class Totals:
+    """Counts of the branches below one branch: how many there are, and how many have each priority, tag and date."""
+
+    __slots__ = ("count", "priorities", "tags", "dates", "earliest")
+
+    def __init__(self):
+        self.count = 0
+        self.priorities = [0] * len(PriorityIndex.LEVELS)  # priority -> number of branches
+        self.tags = dict()  # tag id -> number of branches
+        self.dates = dict()  # date -> number of branches
+        self.earliest = None
+
+    def max_priority(self) -> str:
+        for level in range(len(self.priorities) - 1, -1, -1):
+            if self.priorities[level] != 0:
+                return str(level)
+        return None
+
+    def min_priority(self) -> str:
+        for level in range(len(self.priorities)):
+            if self.priorities[level] != 0:
+                return str(level)
+        return None
+
+    def add(self, fields: tuple, sign: int = 1) -> None:
+        """Counts one branch, with the (priority, tag mask, date) of branch_fields(), or takes it out if sign is -1."""
+        priority, tags, date = fields
+        self.count += sign
+        self.priorities[int(priority)] += sign
+        for tag in TreeTags.bits(tags):
+            self.__count(self.tags, tag, sign)
+        if date is not None:
+            self.__count_date(date, sign)
+
+    def add_totals(self, other: 'Totals', sign: int = 1) -> None:
+        """Counts every branch counted by other, or takes them out if sign is -1."""
+        self.count += other.count * sign
+        for level in range(len(self.priorities)):
+            self.priorities[level] += other.priorities[level] * sign
+        for tag, count in other.tags.items():
+            self.__count(self.tags, tag, count * sign)
+        for date, count in other.dates.items():
+            self.__count_date(date, count * sign)
+
+    @staticmethod
+    def __count(counts: dict, key, delta: int) -> None:
+        count = counts.get(key, 0) + delta
+        if count == 0:
+            del counts[key]
+        else:
+            counts[key] = count
+
+    def __count_date(self, date, delta: int) -> None:
+        self.__count(self.dates, date, delta)
+        if delta > 0:
+            if self.earliest is None or date < self.earliest:
+                self.earliest = date
+        elif date == self.earliest and date not in self.dates:
+            # Only taking out the last branch due on the earliest date looks at the other dates.
+            self.earliest = min(self.dates) if len(self.dates) != 0 else None
+
+
+def branch_fields(prj) -> tuple:
+    """Returns what Totals counts of a branch."""
+    return prj.priority, prj.tag_mask, prj.date
+
+
+class TotalsIndex(Observer):
+    """:
+        The Totals of the branches below every branch. A change to one branch updates the Totals of the branches
+        above it, one step per layer, so reading how many branches a subtree holds, its highest priority, its tags
+        or its earliest date never walks the subtree. Most branches are leaves, they get no Totals of their own.
+        """
+
+    keeps_branches = False
+
+    def __init__(self):
+        self.totals = dict()  # id of a branch with subprojects -> Totals of the branches below it
+        self.fields = dict()  # branch id -> branch_fields() it is counted with in the Totals above it
+
+    def build(self, top) -> None:
+        self.__init__()
+        self.__add_subtree(top)
+
+    def get(self, prj) -> Totals:
+        """Returns the Totals of the branches below a branch, None if it is not in the tree."""
+        totals = self.totals.get(prj.id)
+        if totals is None and prj.id in self.fields:
+            totals = Totals()  # a leaf, nothing below it
+        return totals
+
+    def on_def_subproject(self, prj, sub_project) -> None:
+        fields = self.fields[sub_project.id] = branch_fields(sub_project)
+        self.__branch_out(prj)
+        for totals in self.__chain(prj):
+            totals.add(fields)
+
+    def on_clear_project(self, prj, parent) -> None:
+        fields = self.fields.get(prj.id)
+        if fields is None:
+            return
+        for totals in self.__chain(parent):
+            self.__count(totals, prj, -1)
+        if parent is not None and parent.id in self.totals and self.totals[parent.id].count == 0:
+            del self.totals[parent.id]  # the parent is a leaf again
+        for branch in TreeWalk.pre_order(prj):
+            self.totals.pop(branch.id, None)
+            self.fields.pop(branch.id, None)
+
+    def on_paste_subproject(self, prj, pasted) -> None:
+        self.__add_subtree(pasted)
+        self.__branch_out(prj)
+        for totals in self.__chain(prj):
+            self.__count(totals, pasted)
+
+    def on_set_priority(self, prj, priority: str) -> None:
+        self.__refresh(prj)
+
+    def on_set_tag(self, prj, tag: int) -> None:
+        self.__refresh(prj)
+
+    def on_unset_tag(self, prj, tag: int) -> None:
+        self.__refresh(prj)
+
+    def on_set_date(self, prj, date) -> None:
+        self.__refresh(prj)
+
+    def on_set_tag_below(self, prj, tag: int) -> None:
+        self.__rebuild(prj)
+
+    def on_unset_tag_below(self, prj, tag: int) -> None:
+        self.__rebuild(prj)
+
+    def on_set_priority_below(self, prj, priority: str) -> None:
+        self.__rebuild(prj)
+
+    def on_set_marks(self, prj, tags: int, priority: str, stamps: tuple) -> None:
+        self.__rebuild(prj)
+
+    def on_move_vertically(self, prj, direction: int) -> None:
+        # The branch the moved one left is not known any more, finding it costs as much as a rebuild.
+        top = prj
+        while top.parent is not None:
+            top = top.parent
+        self.build(top)
+
+    def on_rename_tag(self, top, tag: int, old: str, name: str) -> None:
+        # The counts are kept by tag id, a renamed tag keeps its id. A branch with both merged tags counts once.
+        if top.notebook.tag_table.lookup(name) != tag:
+            self.build(top)
+
+    def __rebuild(self, prj) -> None:
+        """Counts a subtree again after a rule on its top branch changed what every branch in it inherits."""
+        fields = self.fields.get(prj.id)
+        if fields is None:
+            return
+        below = self.totals.get(prj.id)
+        self.__add_subtree(prj)
+        for totals in self.__chain(prj.parent):
+            totals.add(fields, -1)
+            if below is not None:
+                totals.add_totals(below, -1)
+            self.__count(totals, prj)
+
+    def __branch_out(self, prj) -> None:
+        """Gives a leaf that is getting its first subproject an empty Totals to count it in."""
+        if prj is not None and prj.id not in self.totals and prj.id in self.fields:
+            self.totals[prj.id] = Totals()
+
+    def __count(self, totals: Totals, prj, sign: int = 1) -> None:
+        """Counts a branch and the branches below it in totals, or takes them out if sign is -1."""
+        totals.add(self.fields[prj.id], sign)
+        below = self.totals.get(prj.id)
+        if below is not None:
+            totals.add_totals(below, sign)
+
+    def __chain(self, prj):
+        """Yields the Totals of a branch and of every branch above it."""
+        while prj is not None:
+            totals = self.totals.get(prj.id)
+            if totals is not None:
+                yield totals
+            prj = prj.parent
+
+    def __refresh(self, prj) -> None:
+        old = self.fields.get(prj.id)
+        if old is None:
+            return
+        new = branch_fields(prj)
+        if new == old:
+            return
+        self.fields[prj.id] = new
+        for totals in self.__chain(prj.parent):
+            totals.add(old, -1)
+            totals.add(new)
+
+    def __add_subtree(self, prj) -> None:
+        for branch in TreeWalk.post_order(prj):
+            if len(branch.subprojects) != 0:
+                totals = self.totals[branch.id] = Totals()
+                for subproject in branch.subprojects:
+                    self.__count(totals, subproject)
+            self.fields[branch.id] = branch_fields(branch)
+
+
+def new_indexes() -> dict:
+    """Returns a new, empty set of the indexes every notebook keeps, by name."""
+    return {
+        "tags": TagIndex(),
+        "text": TextIndex(),
+        "priority": PriorityIndex(),
+        "dates": DateIndex(),
+        "ids": BranchIndex(),
+        "totals": TotalsIndex()
+    }
@@ -0,0 +1,305 @@
+import os
+import pickle
+import TreeDate
+import TreeLazy
+import TreeWalk
+
+
+# The journal is folded into a fresh snapshot once it is larger than both of these.
+COMPACT_MIN_BYTES = 256 * 1024
+COMPACT_RATIO = 0.5
+
+
+def journal_path(filepath: str) -> str:
+    """Returns the path of the journal that belongs to the snapshot at filepath."""
+    return os.path.splitext(filepath)[0] + ".journal"
+
+
+def flatten(prj) -> list:
+    """:
+        Returns a subtree as a flat, pre-ordered list of branch records that can be pickled without the rest of the tree.
+
+        Args:
+            prj (Project): The top branch of the subtree.
+
+        Returns:
+            list: Tuples of (id, parent id, title, description, own tag mask, date, own priority, stamps), see
+                Project.get_marks(). Journals written before rules existed have no stamps, and before tags were
+                interned a set of tag names.
+        """
+    records = list()
+    for branch in TreeWalk.pre_order(prj):
+        parent_id = branch.parent.id if branch is not prj else None
+        tags, priority, stamps = branch.get_marks()
+        records.append((branch.id, parent_id, branch.title, branch.description, tags, branch.date, priority, stamps))
+    return records
+
+
+def unflatten(parent, records: list):
+    """:
+        Rebuilds a subtree written by flatten() below parent, without notifying observers.
+
+        Args:
+            parent (Project): The branch the subtree is appended to.
+            records (list): Records returned by flatten().
+
+        Returns:
+            Project: The top branch of the rebuilt subtree.
+        """
+    return _unflatten({None: parent}, records)
+
+
+def _unflatten(built: dict, records: list):
+    """Rebuilds the branches of records below the branches in built, parent id -> branch, and adds them to it."""
+    top = None
+    for record in records:
+        prj_id, parent_id, title = record[0: 3]
+        branch = built[parent_id]._new_subproject(title, prj_id)
+        _restore(branch, record)
+        built[prj_id] = branch
+        if top is None:
+            top = branch
+    return top
+
+
+def _restore(branch, record: tuple) -> None:
+    """Gives a branch the fields of its flatten() record, besides its id and title."""
+    description, tags, date, priority = record[3: 7]
+    branch.description = description
+    branch.tags = tags
+    branch.date = TreeDate.as_date(date)
+    branch.priority = priority
+    # Also drops the priority stamp the branch copied from its parent when it has none of its own.
+    branch._load_stamps(record[7] if len(record) > 7 else None)
+
+
+class Snapshot:
+    """:
+        Pickles a tree as its notebook and the flatten() records and layers of its branches, pickle.load() returns the
+        top branch. Pickling the branches themselves recurses once per layer, a deep tree would exceed the recursion
+        limit.
+        """
+
+    def __init__(self, top):
+        self.top = top
+
+    def __reduce__(self) -> tuple:
+        top = self.top
+        notebook = top.notebook.__getstate__()
+        # The top branch is rebuilt. The indexes hold branches, only the text index, the one slowest to build, is kept
+        # and holds them by id until load_snapshot() gives them back; the others are built again when first used.
+        del notebook["top"], notebook["indexes"]
+        indexes = dict()
+        if "text" not in top.notebook.stale_indexes:
+            indexes["text"] = top.notebook.indexes["text"]
+        # The layers are kept as they are, a branch moved by Project.move_vertically() keeps its old one.
+        layers = [branch.layer for branch in TreeWalk.pre_order(top)]
+        return load_snapshot, (type(top), notebook, flatten(top), layers, indexes)
+
+
+def load_snapshot(project_class: type, notebook: dict, records: list, layers: list, indexes: dict = None):
+    """Rebuilds a tree pickled by Snapshot and returns its top branch."""
+    record = records[0]
+    top = project_class(record[2], layers[0], None, record[0])
+    top.notebook.__dict__.update(notebook)
+    _restore(top, record)
+    built = {top.id: top}
+    _unflatten(built, records[1:])
+    for branch, layer in zip(TreeWalk.pre_order(top), layers):
+        branch.layer = layer
+    indexes = indexes or dict()
+    for index in indexes.values():
+        index.rebind(built)
+    top.notebook.indexes.update(indexes)
+    top.notebook.stale_indexes = set(top.notebook.indexes) - set(indexes)
+    return top
+
+
+def index_tree(prj) -> dict:
+    """Returns a dict of id to branch for every branch in the tree."""
+    return {branch.id: branch for branch in TreeWalk.pre_order(prj)}
+
+
+class Journal:
+    """:
+        Append-only log of the mutations made to a tree since its snapshot was written.
+
+        The snapshot is a pickle that loads as the top branch, like the one save() has always written, but holds the
+        branches as flatten() records, see Snapshot. Every mutation is kept as a compact (event, id, args) record and
+        appended to the journal file on the next save, so a save costs as much as the edits it records. load() replays
+        the journal on top of the snapshot. Tags are recorded by their id, the intern_tag record of a new tag comes
+        before the first record that uses it.
+        """
+
+    def __init__(self, top, filepath: str):
+        self.top = top
+        self.filepath = filepath
+        self.path = journal_path(filepath)
+        self.pending = list()
+        self.journal_bytes = 0
+        self.snapshot_bytes = 0
+
+    def is_for(self, top, filepath: str) -> bool:
+        return self.top is top and self.filepath == filepath
+
+    def attach(self) -> None:
+        notebook = self.top.notebook
+        if notebook.journal is not None:
+            notebook.remove_observer(notebook.journal)
+        notebook.journal = self
+        notebook.add_observer(self)
+
+    def notify(self, event: str, prj, *args) -> None:
+        record = {
+            "def_subproject": lambda: (prj.id, (args[0].title, args[0].id)),
+            "paste_subproject": lambda: (prj.id, (flatten(args[0]), getattr(args[0], "position", None))),
+            "clear_project": lambda: (prj.id, ()),
+        }.get(event, lambda: (prj.id, args))()
+        self.pending.append((event,) + record)
+
+    def flush(self) -> None:
+        """Appends the pending records to the journal file, compacting it into the snapshot if it has grown too large."""
+        if len(self.pending) == 0:
+            return
+        self.write(self.take())
+        if self.needs_compaction():
+            self.compact()
+
+    def take(self) -> list:
+        """Hands over the pending records, the ones made from now on are kept for the next write."""
+        pending = self.pending
+        self.pending = list()
+        return pending
+
+    def write(self, records: list) -> None:
+        """Appends records handed over by take() to the journal file."""
+        if len(records) == 0:
+            return
+        file = open(self.path, "ab")
+        for record in records:
+            pickle.dump(record, file, pickle.HIGHEST_PROTOCOL)
+        self.journal_bytes = file.tell()
+        file.close()
+
+    def needs_compaction(self) -> bool:
+        return self.journal_bytes > max(COMPACT_MIN_BYTES, self.snapshot_bytes * COMPACT_RATIO)
+
+    def compact(self) -> None:
+        """Writes a full snapshot of the tree and starts an empty journal for it."""
+        self.write_snapshot(self.snapshot())
+
+    def snapshot(self) -> tuple:
+        """:
+            Takes the state of the tree a compaction writes, the only part of it that has to see the tree unchanged.
+            The pending records are dropped, the snapshot holds their edits. A paged tree is written right away,
+            its pager has to switch to the new file before the tree changes again.
+
+            Returns:
+                tuple: (token, header and pickled tree), the data is None if the snapshot was written already.
+            """
+        notebook = self.top.notebook
+        notebook.snapshot_token = os.urandom(16).hex()
+        self.pending = list()
+        self.attach()
+        if not TreeLazy.should_page(self.top):
+            tree = self.top if TreeLazy.is_store(self.top) else Snapshot(self.top)
+            data = TreeLazy.header(self.top) + pickle.dumps(tree, pickle.HIGHEST_PROTOCOL)
+            return notebook.snapshot_token, data
+        temp_path = self.filepath + ".tmp"
+        written = TreeLazy.write_tree(self.top, temp_path)
+        self.snapshot_bytes = os.path.getsize(temp_path)
+        os.replace(temp_path, self.filepath)
+        TreeLazy.Pager.reopen(self.top, self.filepath, written)
+        self.__start_journal(notebook.snapshot_token)
+        return notebook.snapshot_token, None
+
+    def write_snapshot(self, snapshot: tuple) -> None:
+        """Writes a snapshot taken by snapshot() to a temporary file, renames it over the old one and starts its journal."""
+        token, data = snapshot
+        if data is None:
+            return
+        temp_path = self.filepath + ".tmp"
+        file = open(temp_path, "wb")
+        file.write(data)
+        file.close()
+        self.snapshot_bytes = len(data)
+        os.replace(temp_path, self.filepath)
+        self.__start_journal(token)
+
+    def replay(self) -> None:
+        """Applies the journal records that belong to the loaded snapshot, then starts following the tree."""
+        self.snapshot_bytes = os.path.getsize(self.filepath)
+        token = getattr(self.top.notebook, "snapshot_token", str())
+        if token == str():
+            # Snapshot written before journals existed, rewrite it once so a journal can refer to it.
+            self.compact()
+            return
+        records = self.__read_records()
+        if len(records) != 0 and records[0] == ("journal", token):
+            pager = self.top.notebook.pager
+            branches = index_tree(self.top) if pager is None else pager.branches(self.top)
+            for record in records[1:]:
+                self.__apply(branches, *record)
+        else:
+            # Stale journal of an older snapshot, or none at all.
+            self.__start_journal(token)
+        self.attach()
+
+    def __start_journal(self, token: str) -> None:
+        file = open(self.path, "wb")
+        pickle.dump(("journal", token), file, pickle.HIGHEST_PROTOCOL)
+        self.journal_bytes = file.tell()
+        file.close()
+
+    def __read_records(self) -> list:
+        records = list()
+        try:
+            file = open(self.path, "rb")
+        except OSError:
+            return records
+        good_bytes = 0
+        while True:
+            try:
+                records.append(pickle.load(file))
+            except EOFError:
+                break
+            except Exception:
+                # A record cut short by a crash is dropped, new records are appended after the last good one.
+                file.close()
+                os.truncate(self.path, good_bytes)
+                break
+            good_bytes = file.tell()
+        file.close()
+        self.journal_bytes = good_bytes
+        return records
+
+    @staticmethod
+    def __apply(branches: dict, event: str, prj_id: int, args: tuple) -> None:
+        prj = branches.get(prj_id)
+        if prj is None:
+            return
+        if event == "def_subproject":
+            title, sub_id = args
+            branches[sub_id] = prj._new_subproject(title, sub_id)
+            prj.notebook.notify(event, prj, branches[sub_id])
+        elif event == "paste_subproject":
+            pasted = unflatten(prj, args[0])
+            if len(args) > 1 and args[1] is not None and args[1] != pasted._position():
+                # Pasted somewhere else than after the last subproject, only Project trees record where.
+                pasted._detach()
+                pasted._insert_into(prj, args[1])
+            branches.update(index_tree(pasted))
+            prj.notebook.notify(event, prj, pasted)
+        elif event == "move_vertically":
+            prj.move_vertically(*args)
+            branches[prj.parent.id] = prj.parent
+        elif event == "intern_tag":
+            # Interned again in the same order, the records after it refer to the tag by the same id.
+            prj.notebook.intern_tag(args[1])
+        elif event == "rename_tag":
+            prj.notebook.rename_tag(args[0], args[2])
+        elif event == "set_date":
+            # Journals written while dates were free text hold strings.
+            prj.set_date(TreeDate.as_date(args[0]))
+        else:
+            getattr(prj, event)(*args)
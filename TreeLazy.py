@@ -0,0 +1,374 @@
+import array
+import pickle
+import struct
+import weakref
+from collections import OrderedDict
+import TreeDate
+import TreeWalk
+
+
+MAGIC = b"TREENOTE PAGED 1\n"
+OFFSET = struct.Struct("<Q")
+# Every snapshot starts with a header of HEADER_SIZE bytes, in the paged format after MAGIC and the trailer offset,
+# telling what the notebook holds without unpickling it: HEADER_MAGIC, the number of branches and the length of the
+# top branch's title, then the title padded to TITLE_BYTES.
+HEADER_MAGIC = b"TREENOTE HEADER 1\n"
+HEADER = struct.Struct("<QH")
+TITLE_BYTES = 120
+HEADER_SIZE = len(HEADER_MAGIC) + HEADER.size + TITLE_BYTES
+# Trees with at least this many branches are saved in the paged format, once paged a notebook stays paged.
+PAGED_MIN_BRANCHES = 10000
+# Number of branches whose subprojects are kept in memory before the least recently loaded clean ones are evicted.
+MAX_RESIDENT = 4096
+
+
+class Unloaded:
+    """:
+        Stands in for the subprojects list of a branch whose subprojects are still on disk.
+        When the subprojects were evicted, the ones still referenced elsewhere are reused when they are loaded again.
+        """
+
+    __slots__ = ("offset", "survivors")
+
+    def __init__(self, offset: int, subprojects: list = None):
+        self.offset = offset
+        self.survivors = dict()
+        for prj in subprojects or list():
+            self.survivors[prj.id] = weakref.ref(prj)
+
+    def survivor(self, prj_id: int):
+        ref = self.survivors.get(prj_id)
+        if ref is None:
+            return None
+        return ref()
+
+
+def entry(prj, offset: int) -> tuple:
+    """:
+        Returns the record of one branch, offset is where its subprojects are written or -1 if it has none.
+        The tags are a mask of the notebook's tag ids, files written before tags were interned hold a tuple of names.
+        Stamps, see Project.get_marks(), come last and only for branches that have them.
+        """
+    tags, priority, stamps = prj.get_marks()
+    record = (prj.id, prj.title, prj.description, tags, prj.date, priority, prj.layer, offset)
+    if stamps is not None:
+        record += (stamps,)
+    return record
+
+
+def is_store(top) -> bool:
+    """Returns True for a branch of a TreeStore, which is compact already and stays pickled as it is."""
+    return not hasattr(top, "__dict__")
+
+
+def should_page(top) -> bool:
+    """Returns True if a tree is to be saved in the paged format."""
+    if is_store(top):
+        return False
+    if getattr(top.notebook, "paged", False):
+        return True
+    count = 0
+    for prj in TreeWalk.pre_order(top):
+        count += 1
+        if count == PAGED_MIN_BRANCHES:
+            return True
+    return False
+
+
+def count_branches(top) -> int:
+    """Returns the number of branches in a tree, read from its totals index unless that has to be built first."""
+    notebook = top.notebook
+    if "totals" in notebook.indexes and "totals" not in notebook.stale_indexes:
+        totals = notebook.indexes["totals"].get(top)
+        if totals is not None:
+            return totals.count + 1
+    return sum(1 for prj in TreeWalk.pre_order(top))
+
+
+def header(top, branches: int = None) -> bytes:
+    """Returns the header of a snapshot of a tree, branches is counted if not given."""
+    if branches is None:
+        branches = count_branches(top)
+    title = top.title.encode("utf-8")[0: TITLE_BYTES]
+    return HEADER_MAGIC + HEADER.pack(branches, len(title)) + title.ljust(TITLE_BYTES, b"\0")
+
+
+def read_header(file) -> tuple:
+    """:
+        Reads the header of a snapshot at the position of an open file, leaving the file after it. A file without
+        one, written before headers existed, is left where it was.
+
+        Returns:
+            tuple: (number of branches, title of the top branch), None if there is no header.
+        """
+    start = file.tell()
+    data = file.read(HEADER_SIZE)
+    if len(data) != HEADER_SIZE or not data.startswith(HEADER_MAGIC):
+        file.seek(start)
+        return None
+    branches, length = HEADER.unpack_from(data, len(HEADER_MAGIC))
+    title_start = HEADER_SIZE - TITLE_BYTES
+    # A title cut in the middle of a character loses that character.
+    return branches, data[title_start: title_start + length].decode("utf-8", "ignore")
+
+
+def read_snapshot_header(file) -> tuple:
+    """Reads the header of a snapshot file open at its start in either format, see read_header()."""
+    if is_paged(file):
+        file.seek(len(MAGIC) + OFFSET.size)
+    return read_header(file)
+
+
+def is_paged(file) -> bool:
+    """Returns True if an open snapshot file is in the paged format, leaving the file at its start."""
+    paged = file.read(len(MAGIC)) == MAGIC
+    file.seek(0)
+    return paged
+
+
+def write_tree(top, filepath: str) -> OrderedDict:
+    """:
+        Writes a tree in the paged format: after the header, the subprojects of every branch are one record, written
+        after the records of their own subprojects so each record can hold the offsets of the records below it. A trailer holds the
+        top branch, the notebook counters, the tag table and the parent id of every branch, for finding a branch by id.
+
+        Args:
+            top (Project): The top branch of the tree.
+            filepath (str): The file to write.
+
+        Returns:
+            OrderedDict: id -> (branch, record offset) of every branch with subprojects, for the pager of the new file.
+        """
+    notebook = top.notebook
+    pager = getattr(notebook, "pager", None)
+    if pager is not None:
+        pager.evicting = False
+    parents = array.array("i", [-1]) * notebook.next_id
+    offsets = dict()
+    written = OrderedDict()
+    file = open(filepath, "wb")
+    file.write(MAGIC)
+    file.write(OFFSET.pack(0))
+    # Written again once the branches are counted.
+    file.write(header(top, 0))
+    branches = 0
+    for branch in TreeWalk.post_order(top):
+        branches += 1
+        if branch is not top:
+            parents[branch.id] = branch.parent.id
+        if len(branch.subprojects) == 0:
+            continue
+        entries = [entry(prj, offsets.pop(prj.id, -1)) for prj in branch.subprojects]
+        offsets[branch.id] = file.tell()
+        pickle.dump(entries, file, pickle.HIGHEST_PROTOCOL)
+        written[branch.id] = (branch, offsets[branch.id])
+    trailer_offset = file.tell()
+    notebook.paged = True
+    pickle.dump({
+        "top": entry(top, offsets.pop(top.id, -1)),
+        "next_id": notebook.next_id,
+        "next_stamp": notebook.next_stamp,
+        "has_rules": notebook.has_rules,
+        "tag_table": notebook.tag_table,
+        "snapshot_token": notebook.snapshot_token,
+        "parents": parents
+    }, file, pickle.HIGHEST_PROTOCOL)
+    file.seek(len(MAGIC))
+    file.write(OFFSET.pack(trailer_offset))
+    file.write(header(top, branches))
+    file.close()
+    if pager is not None:
+        pager.evicting = True
+    return written
+
+
+def open_tree(file, project_class: type):
+    """:
+        Opens a tree in the paged format, loading only the top branch and its subprojects.
+        The file is kept open by the notebook's Pager, which loads the rest when it is first accessed.
+
+        Args:
+            file (file): The snapshot file, open for reading in binary mode.
+            project_class (type): The class of the branches, Project.
+
+        Returns:
+            Project: The top branch of the tree.
+        """
+    file.seek(len(MAGIC))
+    file.seek(OFFSET.unpack(file.read(OFFSET.size))[0])
+    trailer = pickle.load(file)
+    top = Pager.build(project_class, trailer["top"], None)
+    notebook = top.notebook
+    # Files written before tags were interned hold names, which are interned as their branches are loaded.
+    notebook.interned_tags = "tag_table" in trailer
+    if notebook.interned_tags:
+        notebook.tag_table = trailer["tag_table"]
+    notebook.next_id = trailer["next_id"]
+    # Rules may sit on branches that are not loaded yet, the stamps of files written before rules existed are all 0.
+    notebook.next_stamp = trailer.get("next_stamp", 1)
+    notebook.has_rules = trailer.get("has_rules", False)
+    notebook.snapshot_token = trailer["snapshot_token"]
+    notebook.paged = True
+    # The indexes refer to every branch, they are built again the first time one is used. They keep the branches by
+    # TreeIndex.PagedRef, so they do not keep the pager from evicting them.
+    notebook.stale_indexes = set(notebook.indexes)
+    notebook.pager = Pager(file, project_class, trailer["parents"])
+    notebook.pager.live[top.id] = top
+    top.get_subprojects()
+    return top
+
+
+class Pager:
+    """:
+        Loads the subprojects of a branch from a paged snapshot on first access and evicts cold ones.
+
+        Subprojects that were loaded longest ago are evicted once more than MAX_RESIDENT branches have theirs in memory,
+        unless something below them changed since the snapshot was written.
+        """
+
+    def __init__(self, file, project_class: type, parents: array.array = None):
+        self.file = file
+        self.project_class = project_class
+        self.parents = parents
+        self.resident = OrderedDict()  # id -> (branch, record offset), least recently loaded first
+        self.pinned = set()  # ids of branches with changes below them
+        self.evicting = True
+        self.live = weakref.WeakValueDictionary()  # id -> branch of the snapshot that is in memory
+
+    @staticmethod
+    def reopen(top, filepath: str, written: OrderedDict) -> None:
+        """Switches the notebook of a tree to the paged snapshot it was just written to."""
+        notebook = top.notebook
+        first = getattr(notebook, "pager", None) is None
+        if not first:
+            notebook.pager.close()
+        pager = Pager(open(filepath, "rb"), type(top), array.array("i", [-1]) * notebook.next_id)
+        pager.resident = written
+        pager.live[top.id] = top
+        for branch, offset in written.values():
+            for prj in branch.subprojects:
+                pager.parents[prj.id] = branch.id
+                pager.live[prj.id] = prj
+        if first:
+            # Built while the tree was in memory, they keep the branches themselves and would keep them from being evicted.
+            notebook.stale_indexes.update(name for name, index in notebook.indexes.items() if index.keeps_branches)
+        notebook.pager = pager
+        pager.evict()
+
+    def close(self) -> None:
+        self.file.close()
+
+    @staticmethod
+    def build(project_class: type, record: tuple, parent):
+        prj_id, title, description, tags, date, priority, layer, offset = record[0: 8]
+        prj = project_class(title, layer, parent, prj_id)
+        prj.description = description
+        prj.tags = tags
+        prj.date = TreeDate.as_date(date)
+        prj.priority = priority
+        prj.layer = layer
+        prj._load_stamps(record[8] if len(record) > 8 else None)
+        if offset != -1:
+            prj.__dict__["subprojects"] = Unloaded(offset)
+        return prj
+
+    def load_subprojects(self, prj) -> list:
+        """Reads the subprojects of a branch from the snapshot and puts them in place of its Unloaded marker."""
+        unloaded = prj.__dict__["subprojects"]
+        self.file.seek(unloaded.offset)
+        subprojects = list()
+        for record in pickle.load(self.file):
+            subproject = unloaded.survivor(record[0])
+            if subproject is None:
+                subproject = self.build(self.project_class, record, prj)
+            subprojects.append(subproject)
+            self.live[subproject.id] = subproject
+        # Before the branch is resident, it is never the one evicted, even when all the others are pinned.
+        self.evict()
+        prj.__dict__["subprojects"] = subprojects
+        self.resident[prj.id] = (prj, unloaded.offset)
+        return subprojects
+
+    def evict(self) -> None:
+        if not self.evicting:
+            return
+        checked = 0
+        while len(self.resident) > MAX_RESIDENT and checked < len(self.resident):
+            prj_id, (prj, offset) = self.resident.popitem(last=False)
+            if prj_id in self.pinned:
+                # Changed since the snapshot, it has to stay: move it to the back of the queue.
+                self.resident[prj_id] = (prj, offset)
+                checked += 1
+                continue
+            prj.__dict__["subprojects"] = Unloaded(offset, prj.__dict__["subprojects"])
+
+    def notify(self, event: str, prj, *args) -> None:
+        """Called by the notebook before the indexes hear of a change, which may load branches and so evict others."""
+        if event == "clear_project":
+            prj = args[0]
+        self.pin(prj)
+
+    def pin(self, prj) -> None:
+        """Keeps a changed branch and the branches above it in memory, their subprojects no longer match the snapshot."""
+        while prj is not None and prj.id not in self.pinned:
+            self.pinned.add(prj.id)
+            parent = prj.parent
+            if parent is not None and type(parent.__dict__["subprojects"]) is Unloaded:
+                # Evicted while the branch was held elsewhere: loaded again around it, or the change would be lost
+                # once nothing holds the branch any more.
+                parent.get_subprojects()
+            prj = parent
+
+    def find(self, prj_id: int, known: dict):
+        """:
+            Finds a branch of the snapshot by id, loading only the branches on the way down to it.
+
+            Args:
+                prj_id (int): Id of the branch.
+                known (dict): Branches already found, by id, the search starts from the nearest of them.
+
+            Returns:
+                Project: The branch, None if the snapshot has no such branch.
+            """
+        if self.parents is None or prj_id >= len(self.parents):
+            return None
+        path = list()
+        while prj_id not in known:
+            path.append(prj_id)
+            prj_id = self.parents[prj_id]
+            if prj_id == -1:
+                return None
+        prj = known[prj_id]
+        for prj_id in reversed(path):
+            for subproject in prj.subprojects:
+                if subproject.id == prj_id:
+                    prj = subproject
+                    break
+            else:
+                return None
+            known[prj_id] = prj
+        return prj
+
+    def branch(self, prj_id: int):
+        """Returns a branch of the tree by id, loading it again if it was evicted, None if the tree has no such branch."""
+        prj = self.live.get(prj_id)
+        if prj is None:
+            prj = self.find(prj_id, self.live)
+        return prj
+
+    def branches(self, top) -> 'PagedBranches':
+        return PagedBranches(self, top)
+
+
+class PagedBranches(dict):
+    """The id -> branch dict of a paged tree used to replay a journal, finding branches through the pager as needed."""
+
+    def __init__(self, pager: Pager, top):
+        dict.__init__(self, {top.id: top})
+        self.pager = pager
+
+    def get(self, prj_id: int, default=None):
+        if prj_id in self:
+            return self[prj_id]
+        prj = self.pager.find(prj_id, self)
+        return default if prj is None else prj
@@ -1,25 +1,320 @@
 import pickle
 import io
+import sys
+import functools
 from colorama import init
 from colorama import Fore, Back, Style
+import TreeDate
+import TreeIndex
+import TreeJournal
+import TreeLazy
+import TreeOrder
+import TreeTags
+import TreeUndo
+import TreeWalk
+
+
+PRIORITY_COLORS = {
+    "0": Fore.WHITE,  # Neutral priority
+    "1": Fore.MAGENTA,
+    "2": Fore.BLUE,
+    "3": Fore.CYAN,
+    "4": Fore.GREEN,
+    "5": Fore.YELLOW,
+    "6": Fore.RED
+}
+# Lines are written to the stream in batches of this many, the first one alone so it shows right away.
+RENDER_BATCH = 256
+# Inherited marks of the branches below every branch that has none, never changed.
+NO_MARKS = dict()
+
+
+@functools.lru_cache(maxsize=None)
+def layer_prefix(layer: int) -> str:
+    """Returns the arrow printed before the title of a branch, computed once per layer."""
+    correction = 1
+    if layer == 0:
+        correction = 0
+    return "-" * (layer * 4 - correction) + ">"
+
+
+class Notebook:
+    """Notebook-wide state shared by every branch of one tree: the id counter, the indexes and the mutation observers."""
+
+    # Attributes that only live for a session and are never pickled with the tree.
+    transient = ("observers", "journal", "pager", "orders", "history", "inherited")
+
+    def __init__(self):
+        self.next_id = 0
+        self.snapshot_token = str()
+        self.paged = False
+        self.top = None
+        self.indexes = TreeIndex.new_indexes()
+        self.stale_indexes = set()  # Names of indexes to build from the tree before they are used
+        self.typed_dates = True  # False for trees pickled while dates were free text
+        self.tag_table = TreeTags.TagTable()
+        self.interned_tags = True  # False for trees pickled while branches held sets of tag names
+        self.observers = list()
+        self.journal = None
+        self.pager = None
+        self.orders = dict()  # branch id -> TreeOrder.SiblingOrder of its subprojects, for wide branches
+        self.history = None
+        self.next_stamp = 1
+        self.has_rules = False  # True once a tag or priority was set for everything below a branch
+        self.inherited = dict()  # branch id -> marks it inherits, see inherited_marks()
+
+    def new_id(self) -> int:
+        new_id = self.next_id
+        self.next_id += 1
+        return new_id
+
+    def claim_id(self, prj_id: int) -> int:
+        """Reserves an id handed out by an earlier session, so that new ids never collide with it."""
+        if prj_id >= self.next_id:
+            self.next_id = prj_id + 1
+        return prj_id
+
+    def new_stamp(self) -> int:
+        """Returns a number higher than every stamp handed out before, telling which of two marks was set last."""
+        stamp = self.next_stamp
+        self.next_stamp += 1
+        return stamp
+
+    def claim_stamp(self, stamp: int) -> None:
+        if stamp >= self.next_stamp:
+            self.next_stamp = stamp + 1
+
+    def inherited_marks(self, prj: 'Project') -> dict:
+        """:
+            Returns the rules a branch is under, set by Project.set_tag_below and the like on the branch or above it.
+            Worked out once per branch and kept until a rule changes or a branch moves, see forget_inherited().
+
+            Returns:
+                dict: tag id -> (stamp, True if set, False if unset), and None -> (stamp, priority). Not to be changed.
+            """
+        if not self.has_rules:
+            return NO_MARKS
+        marks = self.inherited.get(prj.id)
+        if marks is not None:
+            return marks
+        # Up to the nearest branch whose marks are known, then down again adding the rules on the way.
+        path = list()
+        branch = prj
+        while branch is not None and branch.id not in self.inherited:
+            path.append(branch)
+            branch = branch.parent
+        marks = NO_MARKS if branch is None else self.inherited[branch.id]
+        for branch in reversed(path):
+            tag_rules = branch.tag_rules
+            priority_rule = branch.priority_rule
+            if tag_rules is not None or priority_rule is not None:
+                marks = dict(marks)
+                for tag, rule in (tag_rules or NO_MARKS).items():
+                    if tag not in marks or marks[tag][0] < rule[0]:
+                        marks[tag] = rule
+                if priority_rule is not None and (None not in marks or marks[None][0] < priority_rule[0]):
+                    marks[None] = priority_rule
+            self.inherited[branch.id] = marks
+        return marks
+
+    def forget_inherited(self) -> None:
+        """Called when a rule changed or a branch moved, the inherited marks are worked out again when next read."""
+        if len(self.inherited) != 0:
+            self.inherited = dict()
+
+    def intern_tag(self, tag) -> int:
+        """Returns the id of a tag name in the tag table, adding the name if it is new. An id is returned as it is."""
+        if type(tag) is int:
+            return tag
+        tag_id = self.tag_table.lookup(tag)
+        if tag_id is None:
+            tag_id = self.tag_table.add(tag)
+            if self.top is not None:
+                self.notify("intern_tag", self.top, tag_id, tag)
+        return tag_id
+
+    def tag_mask(self, tags) -> int:
+        """Returns the mask of a set of tag names, interning the new ones. A mask is returned as it is."""
+        if type(tags) is int:
+            return tags
+        mask = 0
+        for tag in tags:
+            mask |= 1 << self.intern_tag(tag)
+        return mask
+
+    def rename_tag(self, tag, name: str) -> None:
+        """:
+            Renames a tag on every branch at once, only its name in the tag table changes. Renaming it to a tag that
+            is in use merges the two: the branches and rules of the old tag move to the other one, which costs time in
+            the number of them.
+
+            Args:
+                tag (str or int): The name of the tag, or its id.
+                name (str): Its new name.
+
+            Raises:
+                ValueError: No branch was ever given the tag.
+            """
+        table = self.tag_table
+        tag_id = tag if type(tag) is int else table.lookup(tag)
+        if tag_id is None or tag_id >= len(table.names) or table.name(tag_id) is None:
+            raise ValueError("no tag " + str(tag))
+        old = table.name(tag_id)
+        if old == name:
+            return
+        into = table.lookup(name)
+        if into is None:
+            table.rename(tag_id, name)
+        else:
+            index = self.get_index("tags")
+            for prj in {prj.id: prj for prj in index.find(tag_id) + index.find_rules(tag_id)}.values():
+                prj._merge_tag(tag_id, into)
+            table.merge(tag_id, into)
+            self.forget_inherited()
+        self.notify("rename_tag", self.top, tag_id, old, name)
+
+    def add_observer(self, observer: TreeIndex.Observer) -> None:
+        if observer not in self.observers:
+            self.observers.append(observer)
+
+    def remove_observer(self, observer: TreeIndex.Observer) -> None:
+        if observer in self.observers:
+            self.observers.remove(observer)
+
+    def notify(self, event: str, prj: 'Project', *args) -> None:
+        if self.pager is not None:
+            self.pager.notify(event, prj, *args)
+        for name, index in self.indexes.items():
+            if name not in self.stale_indexes:
+                index.notify(event, prj, *args)
+        for observer in self.observers:
+            observer.notify(event, prj, *args)
+
+    def start_history(self) -> TreeUndo.History:
+        """Starts recording the edits made to the tree from now on, so they can be undone."""
+        if self.history is None:
+            self.history = TreeUndo.History()
+            self.add_observer(self.history)
+        return self.history
+
+    def remember(self, prj: 'Project', position: int = None) -> None:
+        """Called by the setters and move_laterally before they change a branch, for the undo history."""
+        if self.history is not None:
+            self.history.remember(prj, position)
+
+    def remember_marks(self, prj: 'Project', inherited: dict) -> None:
+        """Called before Project._keep_marks() changes the marks of a subtree, for the undo history."""
+        if self.history is not None and len(inherited) != 0:
+            self.history.remember_marks(prj)
+
+    def sibling_order(self, prj: 'Project', build: bool = False) -> TreeOrder.SiblingOrder:
+        """:
+            Returns the SiblingOrder kept for the subprojects of a branch, dropping it if the list changed without it.
+
+            Args:
+                prj (Project): The branch.
+                build (bool, optional): Build one if none is kept. Defaults to False.
+
+            Returns:
+                TreeOrder.SiblingOrder: The order, None if none is kept and build is False.
+            """
+        order = self.orders.get(prj.id)
+        siblings = prj.subprojects
+        if order is not None and order.is_for(siblings):
+            return order
+        if not build:
+            if order is not None:
+                del self.orders[prj.id]
+            return None
+        order = TreeOrder.SiblingOrder(siblings)
+        self.orders[prj.id] = order
+        return order
+
+    def set_top(self, top: 'Project') -> None:
+        """Makes top the top branch of a new tree, the indexes that keep an entry for every branch start with it."""
+        self.top = top
+        for name, index in self.indexes.items():
+            if name not in self.stale_indexes:
+                index.build(top)
+
+    def get_index(self, name: str) -> 'TreeIndex.Observer':
+        index = self.indexes[name]
+        if name in self.stale_indexes:
+            index.build(self.top)
+            self.stale_indexes.discard(name)
+        return index
+
+    def update_indexes(self, top: 'Project') -> None:
+        """Builds the indexes a tree pickled by an older version does not have yet."""
+        self.top = top
+        indexes = getattr(self, "indexes", dict())
+        for name, index in TreeIndex.new_indexes().items():
+            if name not in indexes:
+                index.build(top)
+                indexes[name] = index
+        self.indexes = indexes
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        for key in self.transient:
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__()
+        self.typed_dates = False
+        self.interned_tags = False
+        self.__dict__.update(state)
 
 
 class Project:
-    """Contains titles, descriptions, due dates, tags, and subprojects or tasks."""
+    """:
+        Contains titles, descriptions, due dates, tags, and subprojects or tasks.
 
-    def __init__(self, title: str, layer: int, parent_project: 'Project'):
+        A tag or priority can be set on a branch alone, or for the branch and everything below it as a rule stored
+        once on the branch. The tags and priority attributes are what a branch ends up with: its own marks and
+        the rules it is under, where of two marks of the same tag the one set last counts. Stamps from
+        Notebook.new_stamp() tell which one that is; they are only kept once the notebook has rules. A rule marks the
+        branches that are below it when it is set, a branch added or pasted below it later keeps the marks it came
+        with, see _keep_marks().
+
+        Tags are kept as ids of the notebook's TreeTags.TagTable, the own tags of a branch as a mask of them.
+        """
+
+    # Last known index of the branch among its parent's subprojects, see _position().
+    position = 0
+    tag_stamps = None  # tag id -> stamp of the last set_tag or unset_tag of it, a tag not in the own tags was unset
+    tag_rules = None  # tag id -> (stamp, True if set, False if unset) for the branch and everything below it
+    priority_stamp = 0
+    priority_rule = None  # (stamp, priority) for the branch and everything below it
+
+    def __init__(self, title: str, layer: int, parent_project: 'Project', prj_id: int = None):
         self.title = title
         self.layer = layer
         self.parent = parent_project
         self.subprojects = list()
 
         self.description = str()
-        self.tags = set()
-        self.date = str()
+        self.date = None
         if self.parent is not None:
+            self.notebook = self.parent.notebook
             self.priority = self.parent.priority
+            if self.parent.priority_stamp != 0:
+                # Copied from the parent, it counts against the rules above as much as the parent's own one does.
+                self.priority_stamp = self.parent.priority_stamp
         else:
+            self.notebook = Notebook()
             self.priority = "0"
+        self.__dict__["tags"] = 0
+        if prj_id is None:
+            self.id = self.notebook.new_id()
+        else:
+            self.id = self.notebook.claim_id(prj_id)
+        if self.parent is None:
+            self.notebook.set_top(self)
+
+    def get_id(self) -> int:
+        return self.id
 
     def get_title(self) -> str:
         return self.title
@@ -36,14 +331,140 @@ class Project:
     def get_subprojects(self) -> list:
         return self.subprojects
 
+    @property
+    def subprojects(self) -> list:
+        """The subprojects of the branch, loaded from a paged snapshot on first access."""
+        subprojects = self.__dict__["subprojects"]
+        if type(subprojects) is not list:
+            subprojects = self.notebook.pager.load_subprojects(self)
+        return subprojects
+
+    @subprojects.setter
+    def subprojects(self, subprojects: list) -> None:
+        self.__dict__["subprojects"] = subprojects
+
+    @property
+    def tag_mask(self) -> int:
+        """The mask of the tags of the branch, its own ones and the ones it inherits."""
+        own = self.__dict__["tags"]
+        inherited = self.notebook.inherited_marks(self)
+        if len(inherited) == 0:
+            return own
+        stamps = self.tag_stamps or NO_MARKS
+        mask = own
+        for tag, rule in inherited.items():
+            if tag is None:
+                continue
+            bit = 1 << tag
+            if rule[0] > stamps.get(tag, 0 if own & bit else -1):
+                mask = mask | bit if rule[1] else mask & ~bit
+        return mask
+
+    @property
+    def tags(self) -> set:
+        """A new set of the names of the tags of the branch, see tag_mask. Change them with set_tag and the like."""
+        return self.notebook.tag_table.names_of(self.tag_mask)
+
+    @tags.setter
+    def tags(self, tags) -> None:
+        """Sets the own tags from a set of names, or from a mask."""
+        self.__dict__["tags"] = self.notebook.tag_mask(tags)
+
+    @property
+    def priority(self) -> str:
+        """The priority of the branch, its own one or the one it inherits, whichever was set last."""
+        own = self.__dict__["priority"]
+        if not self.notebook.has_rules:
+            return own
+        rule = self.notebook.inherited_marks(self).get(None)
+        if rule is not None and rule[0] > self.priority_stamp:
+            return rule[1]
+        return own
+
+    @priority.setter
+    def priority(self, priority: str) -> None:
+        self.__dict__["priority"] = priority
+
     def get_priority(self) -> str:
         return self.priority
 
     def get_tags(self) -> str:
-        return ", ".join(self.tags)
+        return self.notebook.tag_table.join(self.tag_mask)
+
+    def get_own_tags(self) -> int:
+        """Returns the mask of the tags set on the branch alone, including ones a rule above it may unset."""
+        return self.__dict__["tags"]
+
+    def get_stamps(self) -> tuple:
+        """:
+            Returns what it takes besides the own tags and priority to tell the marks of the branch, None if that is
+            nothing.
+
+            Returns:
+                tuple: (tag_stamps, tag_rules, priority_stamp, priority_rule), copies that can be kept.
+            """
+        if self.tag_stamps is None and self.tag_rules is None and self.priority_stamp == 0 and self.priority_rule is None:
+            return None
+        return (None if self.tag_stamps is None else dict(self.tag_stamps),
+                None if self.tag_rules is None else dict(self.tag_rules),
+                self.priority_stamp, self.priority_rule)
+
+    def _load_stamps(self, stamps: tuple) -> None:
+        """Restores what get_stamps() returned, without notifying observers. Older files key the stamps by tag name."""
+        notebook = self.notebook
+        if stamps is None:
+            stamps = (None, None, 0, None)
+        tag_stamps, tag_rules, priority_stamp, priority_rule = stamps
+        if tag_stamps is not None:
+            tag_stamps = {notebook.intern_tag(tag): stamp for tag, stamp in tag_stamps.items()}
+        if tag_rules is not None:
+            tag_rules = {notebook.intern_tag(tag): rule for tag, rule in tag_rules.items()}
+        for name, value, default in (("tag_stamps", tag_stamps, None), ("tag_rules", tag_rules, None),
+                                     ("priority_stamp", priority_stamp, 0), ("priority_rule", priority_rule, None)):
+            if value == default:
+                self.__dict__.pop(name, None)
+            else:
+                # New dicts, the stamps are changed in place later and the caller may keep what it passed.
+                self.__dict__[name] = value
+        for stamp in (tag_stamps or NO_MARKS).values():
+            notebook.claim_stamp(stamp)
+        for stamp, present in (tag_rules or NO_MARKS).values():
+            notebook.claim_stamp(stamp)
+        notebook.claim_stamp(priority_stamp)
+        if priority_rule is not None:
+            notebook.claim_stamp(priority_rule[0])
+        if tag_rules is not None or priority_rule is not None:
+            notebook.has_rules = True
+        notebook.forget_inherited()
+
+    def get_marks(self) -> tuple:
+        """Returns (own tag mask, own priority, get_stamps()) of the branch, copies that can be kept."""
+        return self.get_own_tags(), self.__dict__["priority"], self.get_stamps()
+
+    def set_marks(self, tags: int, priority: str, stamps: tuple) -> None:
+        """Restores the tags, priority and rules of a branch as get_marks() returned them."""
+        self.notebook.remember(self)
+        self.tags = tags
+        self.priority = priority
+        self._load_stamps(stamps)
+        self.notebook.notify("set_marks", self, tags, priority, stamps)
 
     def get_date(self) -> str:
-        return self.date
+        return TreeDate.format_date(self.date)
+
+    def get_totals(self) -> str:
+        """Returns a summary of the branches below this one, read from the notebook's totals index."""
+        totals = self.notebook.get_index("totals").get(self)
+        if totals is None or totals.count == 0:
+            return str()
+        summary = [str(totals.count) + " below", "priority " + totals.min_priority() + "-" + totals.max_priority()]
+        if totals.earliest is not None:
+            summary.append("first due " + TreeDate.format_date(totals.earliest))
+        if len(totals.tags) != 0:
+            names = self.notebook.tag_table.names
+            counts = sorted((names[tag_id], count) for tag_id, count in totals.tags.items())
+            summary.append("tags: " + ", ".join(tag + " " + str(count) for tag, count in counts))
+        return " (" + "; ".join(summary) + ")"
 
     def get_priority_text_color(self) -> str:
         """:
@@ -52,38 +473,103 @@ class Project:
             Returns:
                 str: ANSI code contained in Colorama.Fore() object, a string.
             """
-        return {
-            "0": Fore.WHITE,  # Neutral priority
-            "1": Fore.MAGENTA,
-            "2": Fore.BLUE,
-            "3": Fore.CYAN,
-            "4": Fore.GREEN,
-            "5": Fore.YELLOW,
-            "6": Fore.RED
-        }.get(self.priority)
+        return PRIORITY_COLORS.get(self.priority)
 
     def get_layer_prefix(self) -> str:
-        correction = 1
-        if self.layer == 0:
-            correction = 0
-        return str().join(["-"] * (self.layer * 4 - correction)) + ">"
+        return layer_prefix(self.layer)
 
     def get_layer_description_spacing(self) -> str:
         return str().join([" "] * (self.layer * 4))
 
     def set_description(self, description: str) -> None:
-        self.description = str().join(
-            [" "] * (self.layer * 4)) + description  # + "\n"
+        self.notebook.remember(self)
+        if len(description) == 0:
+            # No spacing either, or an empty line would be printed below the title.
+            self.description = description
+        else:
+            self.description = str().join(
+                [" "] * (self.layer * 4)) + description  # + "\n"
+        self.notebook.notify("set_description", self, description)
+
+    def restore_description(self, description: str) -> None:
+        """Sets the description as get_description() returned it, spaced for the layer it was set at."""
+        self.notebook.remember(self)
+        self.description = description
+        self.notebook.notify("restore_description", self, description)
+
+    def set_tag(self, tag) -> None:
+        """Sets a tag, by name or by id, on the branch alone."""
+        tag = self.notebook.intern_tag(tag)
+        self.notebook.remember(self)
+        self.__dict__["tags"] |= 1 << tag
+        self.__stamp_tag(tag)
+        self.notebook.notify("set_tag", self, tag)
+
+    def unset_tag(self, tag) -> None:
+        """Unsets a tag, by name or by id, on the branch alone."""
+        tag = self.notebook.tag_table.lookup(tag) if type(tag) is str else tag
+        if tag is not None and self.tag_mask >> tag & 1:
+            self.notebook.remember(self)
+            self.__dict__["tags"] &= ~(1 << tag)
+            self.__stamp_tag(tag)
+            self.notebook.notify("unset_tag", self, tag)
 
-    def set_tag(self, tag: str) -> None:
-        self.tags.add(tag)
+    def __stamp_tag(self, tag: int) -> None:
+        if self.notebook.has_rules:
+            if self.tag_stamps is None:
+                self.tag_stamps = dict()
+            self.tag_stamps[tag] = self.notebook.new_stamp()
 
-    def unset_tag(self, tag: str) -> None:
-        if tag in self.tags:
-            self.tags.remove(tag)
+    def set_tag_below(self, tag) -> None:
+        """Sets a tag on the branch and everything below it, storing it once on the branch."""
+        tag = self.notebook.intern_tag(tag)
+        self.notebook.remember(self)
+        self.__set_rule(tag, True)
+        self.notebook.notify("set_tag_below", self, tag)
 
-    def set_date(self, date: str) -> None: #TODO Need to make this a datetime instead of str
+    def unset_tag_below(self, tag) -> None:
+        """Unsets a tag on the branch and everything below it, storing it once on the branch."""
+        tag = self.notebook.intern_tag(tag)
+        self.notebook.remember(self)
+        self.__set_rule(tag, False)
+        self.notebook.notify("unset_tag_below", self, tag)
+
+    def _merge_tag(self, tag: int, into: int) -> None:
+        """Moves the marks of one tag to another one without notifying observers, see Notebook.rename_tag()."""
+        own = self.__dict__["tags"]
+        if own >> tag & 1:
+            self.__dict__["tags"] = own & ~(1 << tag) | 1 << into
+        # Of two stamps or rules, the one set last is kept.
+        for name in ("tag_stamps", "tag_rules"):
+            marks = self.__dict__.get(name)
+            if marks is not None and tag in marks:
+                mark = marks.pop(tag)
+                if into not in marks or marks[into] < mark:
+                    marks[into] = mark
+
+    def __set_rule(self, tag: int, present: bool) -> None:
+        notebook = self.notebook
+        if self.tag_rules is None:
+            self.tag_rules = dict()
+        notebook.has_rules = True
+        self.tag_rules[tag] = (notebook.new_stamp(), present)
+        notebook.forget_inherited()
+
+    def set_date(self, date) -> None:
+        """:
+            Sets the due date of a branch.
+
+            Args:
+                date (datetime.date or str): The date, a string is parsed with TreeDate.parse_date. None or "" unsets it.
+
+            Raises:
+                ValueError: The string is not a date.
+            """
+        if isinstance(date, str):
+            date = TreeDate.parse_date(date)
+        self.notebook.remember(self)
         self.date = date
+        self.notebook.notify("set_date", self, date)
 
     def set_priority(self, priority: str) -> None:
         """:
@@ -92,14 +578,22 @@ class Project:
             Args:
                 priority (str): A string of the integer indicating the priority.
             """
-        priority = str(priority)
-        lower = "0"
-        upper = "6"
-        if priority < lower:
-            priority = lower
-        if priority > upper:
-            priority = upper
+        priority = clamp_priority(priority)
+        self.notebook.remember(self)
         self.priority = priority
+        if self.notebook.has_rules:
+            self.priority_stamp = self.notebook.new_stamp()
+        self.notebook.notify("set_priority", self, priority)
+
+    def set_priority_below(self, priority: str) -> None:
+        """Sets the priority of the branch and everything below it, storing it once on the branch."""
+        priority = clamp_priority(priority)
+        notebook = self.notebook
+        notebook.remember(self)
+        notebook.has_rules = True
+        self.priority_rule = (notebook.new_stamp(), priority)
+        notebook.forget_inherited()
+        notebook.notify("set_priority_below", self, priority)
 
     def clear_project(self) -> 'Project':
         """:
@@ -109,9 +603,108 @@ class Project:
                 Project: The parent branch of the cleared branch.
             """
         parent_project = self.parent
-        self.parent.subprojects.remove(self)
+        inherited = self.notebook.inherited_marks(parent_project)
+        self.notebook.remember_marks(self, inherited)
+        self._detach()
+        self.notebook.forget_inherited()
+        self.notebook.notify("clear_project", self, parent_project)
+        # Copied once the indexes let go of the branch, they take its own tags as they are when it is pasted.
+        self._keep_marks(inherited)
         return parent_project
 
+    def _keep_marks(self, inherited: dict) -> None:
+        """:
+            Gives the branch and the branches below it the tags and priority they have now as their own marks, where
+            rules in inherited would change them. Called when a branch leaves the rules above it behind and when it
+            is pasted below other ones, so a branch keeps its marks wherever it goes as it did before there were
+            rules. A kept mark takes the stamp of the rule it stands against, so later marks still count over it.
+
+            Args:
+                inherited (dict): Notebook.inherited_marks() of the branch it was or is going to be below.
+            """
+        if len(inherited) == 0:
+            return
+        for branch in TreeWalk.pre_order(self):
+            branch._pin()
+            own = branch.__dict__["tags"]
+            mask = branch.tag_mask
+            stamps = branch.tag_stamps
+            for tag, rule in inherited.items():
+                if tag is None:
+                    if rule[0] > branch.priority_stamp:
+                        branch.priority = branch.priority
+                        branch.priority_stamp = rule[0]
+                    continue
+                bit = 1 << tag
+                if rule[0] > (stamps or NO_MARKS).get(tag, 0 if own & bit else -1):
+                    own = own & ~bit | mask & bit
+                    if stamps is None:
+                        stamps = branch.tag_stamps = dict()
+                    stamps[tag] = rule[0]
+            branch.__dict__["tags"] = own
+
+    def _position(self) -> int:
+        """:
+            Returns the index of the branch among its parent's subprojects.
+            The last known index is checked first. When removals of earlier siblings shifted it, the index is read from
+            the parent's SiblingOrder in O(log n) if the parent is wide, or else found by comparing the siblings by
+            identity, list.index would call __eq__ on every sibling.
+            """
+        siblings = self.parent.subprojects
+        position = self.position
+        if position < len(siblings) and siblings[position] is self:
+            return position
+        if len(siblings) >= TreeOrder.WIDE_BRANCH:
+            position = self.notebook.sibling_order(self.parent, True).position(self)
+        else:
+            position = 0
+            while siblings[position] is not self:
+                position += 1
+        self.position = position
+        return position
+
+    def _pin(self) -> None:
+        """Keeps a branch of a paged tree that is about to change in memory, see TreeLazy.Pager.pin()."""
+        pager = self.notebook.pager
+        if pager is not None:
+            pager.pin(self)
+
+    def _detach(self) -> int:
+        """Removes the branch from its parent's subprojects without notifying observers, returns its old position."""
+        self.parent._pin()
+        position = self._position()
+        order = self.notebook.sibling_order(self.parent)
+        # Found like above, the removal itself only moves the pointers of the later siblings up by one.
+        del self.parent.subprojects[position]
+        if order is not None:
+            order.remove(self)
+        return position
+
+    def _append_to(self, parent: 'Project') -> None:
+        parent._pin()
+        order = parent.notebook.sibling_order(parent)
+        self.position = len(parent.subprojects)
+        parent.subprojects.append(self)
+        if order is not None:
+            order.append(self)
+
+    def _insert_into(self, parent: 'Project', position: int) -> None:
+        parent._pin()
+        parent.subprojects.insert(position, self)
+        self.position = position
+
+    def _new_subproject(self, title: str, prj_id: int = None) -> 'Project':
+        """Creates and appends a subproject without notifying observers."""
+        sub_project = Project(title, self.layer + 1, self, prj_id)
+        sub_project._append_to(self)
+        if self.notebook.has_rules:
+            # Like every new branch it starts without tags, a rule above only tags the branches it was set on.
+            stamps = {tag: rule[0] for tag, rule in self.notebook.inherited_marks(self).items()
+                      if tag is not None and rule[1]}
+            if len(stamps) != 0:
+                sub_project.tag_stamps = stamps
+        return sub_project
+
     # found a workaround in vscode to hide doc_strings
     def def_subproject(self, title: str) -> 'Project':
         """:
@@ -123,44 +716,79 @@ class Project:
             Returns:
                 Project: New Project object, initialized with the entered title and layer = self.layer + 1
             """
-        sub_project = Project(title.title(), self.layer + 1, self)
-        self.subprojects.append(sub_project)
+        sub_project = self._new_subproject(title.title())
+        self.notebook.notify("def_subproject", self, sub_project)
         return sub_project
 
-    def paste_subproject(self, prj: 'Project') -> 'Project':  # Who knows about this
-        prj.parent_project = self
-        prj.layer = prj.parent_project.layer
-        #prj.layer = prj.parent_project.layer + 1
-        def __increment_layer(prj):
-            prj.layer = prj.layer + 1
-        prj.do_recursive(lambda prj: __increment_layer(prj))
-        self.subprojects.append(prj)
+    def paste_subproject(self, prj: 'Project', position: int = None) -> 'Project':  # Who knows about this
+        """:
+            Nests an existing branch, usually one removed with clear_project, below this branch.
+            Layers of the pasted subtree are shifted so it sits one layer lower than this branch.
+
+            Args:
+                prj (Project): The branch to paste.
+                position (int, optional): Index among the subprojects to paste it at, None for after the last one.
+
+            Returns:
+                Project: The pasted branch.
+            """
+        layer_shift = self.layer + 1 - prj.layer
+        foreign = prj.notebook is not self.notebook
+        merged = self.notebook.tag_table.merged
+        # Stamps of the other notebook come after the ones of this one, in the order they had.
+        base = self.notebook.next_stamp
+        # Detached from any rules while it is adopted, the marks it keeps are the ones it has of its own.
+        prj.parent = None
+
+        def __adopt(prj):
+            prj._pin()
+            prj.layer = prj.layer + layer_shift
+            if not foreign:
+                # Tags merged into others while the branch was cut.
+                for tag, into in merged.items():
+                    prj._merge_tag(tag, into)
+            else:
+                # Tags and stamps of the other notebook, they have to be interned and stamped again in this one.
+                tags = prj.notebook.tag_table.names_of(prj.get_own_tags())
+                stamps = _foreign_stamps(prj.get_stamps(), prj.notebook.tag_table, base)
+                prj.notebook = self.notebook
+                prj.id = self.notebook.new_id()
+                prj.tags = tags
+                prj._load_stamps(stamps)
+        prj.do_recursive(lambda prj: __adopt(prj))
+        inherited = self.notebook.inherited_marks(self)
+        if len(inherited) != 0:
+            self.notebook.forget_inherited()
+            self.notebook.remember_marks(prj, inherited)
+            prj._keep_marks(inherited)
+        prj.parent = self
+        if position is None:
+            prj._append_to(self)
+        else:
+            prj._insert_into(self, position)
+        self.notebook.forget_inherited()
+        self.notebook.notify("paste_subproject", self, prj)
         return prj
 
     def walk_tree(self, subproject_tree_list: list, top_layer: int = 0) -> list:
         """:
-            Returns a list of Project instances and PLACEHOLDER of all the subprojects located further down the tree.
-            \nPLACEHOLDER indicate a new subproject that is only nested in the top layer.
+            Returns a list of Project instances of all the subprojects located further down the tree, in print order.
 
             Args:
-                subproject_tree_list (list): pass empty list: list()
-                top_layer (int, optional): leave default, will be replaced by the top layer internally. Defaults to 0.
+                subproject_tree_list (list): pass empty list: list(), the branches are appended to it.
+                top_layer (int, optional): unused, kept for existing callers. Defaults to 0.
 
             Returns:
                 list: List of all Projects located down the tree
             """
-        if len(subproject_tree_list) == 0:
-            top_layer = self.layer
-        subproject_tree_list.append(self)
-        for subproject in self.subprojects:
-            subproject.walk_tree(subproject_tree_list, top_layer)
-        if self.layer == top_layer:
-            return subproject_tree_list
+        subproject_tree_list.extend(TreeWalk.pre_order(self))
+        return subproject_tree_list
 
     def move_laterally(self, direction: int) -> 'Project':
         """:
             Moves branches laterally. 
             Lateral movement is across the same layer. Branches are essentially just moved in the parent branch's subproject list index.
+            Moving between two siblings swaps the branch with its neighbour, without shifting the rest of the list.
 
             Returns:
                 Project: The parent of the branch that has been moved.
@@ -171,10 +799,24 @@ class Project:
         if self.parent is None:
             return
         parent = self.parent
-        current_pos = parent.subprojects.index(self)
+        siblings = parent.subprojects
+        current_pos = self._position()
+        self.notebook.remember(self, current_pos)
         next_pos = current_pos + direction
-        self.clear_project()
-        parent.subprojects.insert(next_pos, self)
+        if 0 <= next_pos < len(siblings):
+            neighbour = siblings[next_pos]
+            siblings[current_pos] = neighbour
+            siblings[next_pos] = self
+            neighbour.position = current_pos
+            self.position = next_pos
+            order = self.notebook.sibling_order(parent)
+            if order is not None:
+                order.swap(self, neighbour)
+        else:
+            # At either end the branch is taken out and inserted again, the first one moving up lands before the last.
+            self._detach()
+            siblings.insert(next_pos, self)
+        self.notebook.notify("move_laterally", self, direction)
         return parent
 
     def move_vertically(self, direction: int) -> None:
@@ -186,22 +828,25 @@ class Project:
         elif direction < 0 and self.parent is None:
             return
         parent = {1: self.parent.parent, -1: self.parent}.get(direction)
-        blank_branch = parent.def_subproject("")
-        self.clear_project()
-        blank_branch.subprojects.insert(0, self)
+        # Moved up it leaves the rules of its parent behind.
+        inherited = self.notebook.inherited_marks(self.parent) if direction > 0 else NO_MARKS
+        blank_branch = parent._new_subproject("")
+        self._detach()
+        self._append_to(blank_branch)
+        self.parent = blank_branch
+        self._keep_marks(inherited)
+        self.notebook.forget_inherited()
+        self.notebook.notify("move_vertically", self, direction)
 
     def do_recursive(self, doFunc=lambda x: x) -> None:
         """:
-            Takes a function as an arg and performs it recursively on all objects descended from the current one
+            Takes a function as an arg and performs it on this object and all objects descended from it, parents first.
 
             Args:
                 doFunc (function, optional): Function to perform, takes a Project object as an argument. Defaults to lambda x:x.
             """
-        doFunc(self)
-        if len(self.subprojects) == 0:
-            return
-        for subproject in self.subprojects:
-            subproject.do_recursive(doFunc)
+        for prj in TreeWalk.pre_order(self):
+            doFunc(prj)
 
     def __str_subprojects__(self) -> str:
         subproject_str = str()
@@ -211,14 +856,7 @@ class Project:
 
     def __str_tree__(self, **kwargs) -> str:
         """Prints the current project and each project of a lower layer."""
-        tree = self.walk_tree(list())
-        tree_str = str()
-        for subproject in tree:
-            if subproject.layer != self.layer:
-                tree_str += subproject.__str_f__(**kwargs) + "\n"
-            else:
-                tree_str += subproject.__str_f__(**kwargs) + "\n"
-        return tree_str
+        return str().join(render_tree(self, **kwargs))
 
     def __str_f__(self, **kwargs: bool) -> str:
         """:
@@ -230,38 +868,42 @@ class Project:
                 priority [bool]: If priority number is displayed (False)
                 tags [bool]: Display tags (False)
                 date [bool]: Display date (False)
+                ids [bool]: Display the id, which goto accepts (False)
+                totals [bool]: Display the number, priorities, earliest date and tags of the branches below (False)
 
             Returns:
                 str: [description]
             """
-        print_str = ""
-        print_str += self.get_layer_prefix()
+        print_str = [self.get_layer_prefix()]
 
         if kwargs.setdefault("highlight", False):
-            print_str += Back.MAGENTA
+            print_str.append(Back.MAGENTA)
 
-        print_str += self.get_priority_text_color()
-        print_str += self.get_title()
+        print_str.append(self.get_priority_text_color())
+        print_str.append(self.get_title())
 
         if kwargs.setdefault("priority", False):
-            print_str += " (priority: " + str(self.get_priority()) + ")"
+            print_str.append(" (priority: " + str(self.get_priority()) + ")")
         if kwargs.setdefault("tags", False):
-            print_str += " (tags: " + self.get_tags() + ")"
+            print_str.append(" (tags: " + self.get_tags() + ")")
         if kwargs.setdefault("date", False):
-            print_str += " (date: " + self.get_date() + ")"
+            print_str.append(" (date: " + self.get_date() + ")")
+        if kwargs.setdefault("ids", False):
+            print_str.append(" (id: " + str(self.get_id()) + ")")
+        if kwargs.setdefault("totals", False):
+            print_str.append(self.get_totals())
 
-        print_str += Style.RESET_ALL
+        print_str.append(Style.RESET_ALL)
 
-        if len(self.get_description()) == 0:
-            descr_string = ""
+        description = self.get_description()
+        if len(description) == 0:
+            pass
         elif kwargs.setdefault("ellipsis", False):
-            descr_string = "\n" + \
-                           self.get_description()[0: 10].rstrip() + "..."
+            print_str.append("\n" + description[0: 10].rstrip() + "...")
         else:
-            descr_string = "\n" + self.get_description()
+            print_str.append("\n" + description)
 
-        print_str += descr_string
-        return print_str
+        return str().join(print_str)
 
     def __str__(self):
         return self.__str_f__(ellpisis=True)
@@ -275,20 +917,148 @@ class Project:
         pass
 
 
+def clamp_priority(priority: str) -> str:
+    """Returns a priority as the string of an integer between 0 and 6, raises ValueError if it is no integer."""
+    lower = 0
+    upper = 6
+    try:
+        # Of a str, int() takes whole numbers only: "1.5" is rejected instead of stored next to the integers.
+        value = int(str(priority))
+    except ValueError:
+        raise ValueError("not a priority: " + str(priority)) from None
+    return str(min(max(value, lower), upper))
+
+
+def _foreign_stamps(stamps: tuple, table: TreeTags.TagTable, base: int) -> tuple:
+    """Returns the get_stamps() of a branch of another notebook by tag name, with base added to every stamp."""
+    if stamps is None:
+        return None
+    tag_stamps, tag_rules, priority_stamp, priority_rule = stamps
+    if tag_stamps is not None:
+        tag_stamps = {table.name(tag): stamp + base for tag, stamp in tag_stamps.items()}
+    if tag_rules is not None:
+        tag_rules = {table.name(tag): (stamp + base, present) for tag, (stamp, present) in tag_rules.items()}
+    if priority_stamp != 0:
+        priority_stamp += base
+    if priority_rule is not None:
+        priority_rule = (priority_rule[0] + base, priority_rule[1])
+    return tag_stamps, tag_rules, priority_stamp, priority_rule
+
+
+def render_tree(prj: Project, **kwargs):
+    """:
+        Lazily yields the printed lines of a branch and every branch below it, see Project.__str_f__ for the kwargs.
+
+        Yields:
+            str: The text of one branch, ending with a newline.
+        """
+    for branch in TreeWalk.pre_order(prj):
+        yield branch.__str_f__(**kwargs) + "\n"
+
+
+def write_tree(prj: Project, stream: io.TextIOBase = None, **kwargs) -> None:
+    """:
+        Writes the printed tree of a branch to a stream as it is rendered, without building the whole text first.
+
+        Args:
+            prj (Project): The branch to print from.
+            stream (io.TextIOBase, optional): Where to write, stdout if None. Defaults to None.
+        """
+    if stream is None:
+        stream = sys.stdout
+    lines = render_tree(prj, **kwargs)
+    for line in lines:
+        stream.write(line)
+        stream.flush()
+        break
+    batch = list()
+    for line in lines:
+        batch.append(line)
+        if len(batch) == RENDER_BATCH:
+            stream.write(str().join(batch))
+            batch = list()
+    stream.write(str().join(batch))
+    stream.flush()
+
+
 def main():
     init()
     return Project("Notes", -1, None)
 
 
 def save(Prj: Project, filepath: str) -> None:
-    file = open(filepath, "wb")
-    pickle.dump(Prj, file)
-    file.close()
+    """:
+        Saves a tree to filepath.
+        If the tree was loaded from or saved to the same file before, only the edits made since are appended to the
+        file's journal; the full snapshot is rewritten once the journal grows too large.
+
+        Args:
+            Prj (Project): The top branch of the tree.
+            filepath (str): The snapshot file.
+        """
+    journal = Prj.notebook.journal
+    if journal is not None and journal.is_for(Prj, filepath):
+        journal.flush()
+    else:
+        TreeJournal.Journal(Prj, filepath).compact()
 
 
 def load(filepath: str) -> Project:
+    """:
+        Loads a tree from the snapshot at filepath and replays the edits recorded in its journal.
+
+        Args:
+            filepath (str): The snapshot file.
+
+        Returns:
+            Project: The top branch of the tree.
+        """
     file = open(filepath, "rb")
-    return pickle.load(file)
+    if TreeLazy.is_paged(file):
+        prj = TreeLazy.open_tree(file, Project)
+    else:
+        TreeLazy.read_header(file)
+        prj = pickle.load(file)
+        file.close()
+    if not hasattr(prj, "notebook"):
+        _upgrade(prj)
+    if not prj.notebook.typed_dates:
+        for branch in TreeWalk.pre_order(prj):
+            branch.date = TreeDate.as_date(branch.date)
+        prj.notebook.typed_dates = True
+    interned = prj.notebook.interned_tags
+    if not interned:
+        _intern_tags(prj)
+    prj.notebook.update_indexes(prj)
+    journal = TreeJournal.Journal(prj, filepath)
+    journal.replay()
+    if not interned:
+        # Snapshot holding tag names, rewritten once so that it is not converted on every load.
+        journal.compact()
+    return prj
+
+
+def _upgrade(prj: Project) -> None:
+    """Gives the branches of a tree pickled before notebooks existed a shared notebook and ids."""
+    notebook = Notebook()
+    notebook.top = prj
+    notebook.indexes = dict()
+    notebook.typed_dates = False
+    notebook.interned_tags = False
+    for branch in TreeWalk.pre_order(prj):
+        branch.notebook = notebook
+        branch.id = notebook.new_id()
+
+
+def _intern_tags(prj: Project) -> None:
+    """Turns the sets of tag names of a tree saved before tags were interned into masks, always in the same order."""
+    notebook = prj.notebook
+    for branch in TreeWalk.pre_order(prj):
+        branch.tags = branch.get_own_tags()
+        branch._load_stamps(branch.get_stamps())
+    # Their entries are names.
+    notebook.stale_indexes.update(("tags", "totals"))
+    notebook.interned_tags = True
 
 
 if __name__ == "__main__":
@@ -301,7 +1071,7 @@ if __name__ == "__main__":
         test.set_tag("good")
         test.set_description(
             "Something to describe this test branch and test some features of __print_f__()")
-        test.date = "5/29/2021"
+        test.set_date("2021-05-29")
         print(test.__str_f__(date=True, highlight=True, ellipsis=True, tags=True))
 
     def do_recur_test():
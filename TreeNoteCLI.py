@@ -1,9 +1,29 @@
-from typing import IO
+# Modules only some commands need, TreeImport, TreeExport, TreeServer, cProfile and pstats, are imported by those
+# commands, so starting the prompt does not wait for them.
+import argparse
 import TreeNote as tn
+import TreeDate as td
+import TreeWalk as tw
+import TreeView as tv
+import TreeStats as ts
+import TreeUndo as tu
+import TreeAutosave as ta
+import TreeCatalog as tc
 import cmd
+import copy
+import datetime
+import io
+import json
 import os
-import sys
 import pickle
+import sys
+import threading
+import time
+
+# Stands in for typing.TYPE_CHECKING, importing typing would slow down starting the prompt.
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    import TreeServer as tsv
 
 
 def __get_platform_commands() -> dict:
@@ -20,29 +40,106 @@ def __get_platform_commands() -> dict:
     return command_dict
 
 
-PRJ_TOP = tn.main()
-CURRENT_PRJ = None
-CURRENT_PRJ = PRJ_TOP
 CONFIG_FILE_NAME = "tree.conf"
 DEFAULT_CONFIG = {
     "print_options": [],
-    "aliases": {}
+    "aliases": {},
+    "redraw": "full",
+    "autosave": 0,
+    "preload": "off",
+    "last_notebook": str(),
+    "notebook_dirs": []
 }
+REDRAW_MODES = ("full", "viewport")
+PRELOAD_MODES = ("on", "off")
 COMMANDS = __get_platform_commands()
+FIND_LIMIT = 20
+NEXT_COUNT = 10
+PROFILE_LINES = 25
+# Commands that only look at the tree, which clients of a notebook server may run at the same time.
+READ_COMMANDS = ("in", "out", "top", "goto", "print", "file", "export", "due", "search", "filter", "next", "find", "stats",
+                 "autosave", "config", "help", "quit")
+
+
+def load_config(filepath: str) -> dict:
+    """:
+        Reads a config written by save_config(), an empty one if there is no file or it cannot be read.
+        Configs written before were pickled, they are read as well and written as JSON on the next save.
+        """
+    try:
+        file = open(filepath, "rb")
+    except OSError:
+        return dict()
+    data = file.read()
+    file.close()
+    try:
+        if data.startswith(pickle.PROTO):
+            config = pickle.loads(data)
+        elif len(data.strip()) != 0:
+            config = json.loads(data)
+        else:
+            config = dict()
+    except (ValueError, EOFError, pickle.UnpicklingError):
+        return dict()
+    return config if isinstance(config, dict) else dict()
+
+
+def save_config(config: dict, filepath: str) -> None:
+    file = open(filepath, "w")
+    json.dump(config, file, indent=1)
+    file.close()
+
+
+class Preload:
+    """Loads a notebook on a thread of its own, so the prompt takes the first command while the notebook loads."""
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        self.top = None
+        self.error = None
+        self.thread = threading.Thread(target=self.__run, name="preload", daemon=True)
+        self.thread.start()
+
+    def __run(self) -> None:
+        try:
+            self.top = tn.load(self.filepath)
+        except Exception as error:
+            self.error = error
+
+    def result(self) -> tn.Project:
+        """Waits for the load, returns the top branch or None if it failed, see error."""
+        self.thread.join()
+        return self.top
+
+
+class BatchError(Exception):
+    """Raised when a command of a batch script cannot run without a person at the prompt."""
+    pass
+
 
 class PrjCmd(cmd.Cmd):
     # cmd instance vars here
     prompt = "~: "
 
-    def __init__(self):
+    def __init__(self, batch: bool = False, top: tn.Project = None):
         cmd.Cmd.__init__(self)
-        self.top = tn.main()
+        self.batch = batch
+        self.batch_save = None
+        self.top = tn.Project("Notes", -1, None) if top is None else top
+        self.top.notebook.start_history()
         self.prj = self.top
         self.buffer = None
         # TODO find a better way to handle the getcwd() jank
         self.path = os.getcwd().replace("\\", "/") + "/"
         self.file = str()
         self.config = dict()
+        self.view = tv.Viewport()
+        self.stats = ts.Stats()
+        # Held while a command runs, the autosave thread only looks at the tree in between.
+        self.lock = threading.RLock()
+        self.autosave = ta.Autosaver(self.lock, self.__autosave_target)
+        self.preload = None  # Preload of the last notebook, running while the prompt already takes a command
+        self.catalog = tc.Catalog()
         self.intro = (
             """
         ************************************************************************
@@ -54,36 +151,74 @@ class PrjCmd(cmd.Cmd):
         )
 
     def preloop(self) -> None:
-        try:
-            config = open(CONFIG_FILE_NAME, "rb")
-        except OSError:
-            config = open(CONFIG_FILE_NAME, "x")
-            config.close()
-            config = open(CONFIG_FILE_NAME, "rb")
-        try:
-            self.config = pickle.load(config)
-        except EOFError:
-            self.config = dict()
-        db = set(self.config.keys())
-        if set(self.config.keys()) != set(DEFAULT_CONFIG.keys()):
-            self.config.update(**{"print_options":[], "aliases":{}})
-        config.close()
-
+        self.config = load_config(CONFIG_FILE_NAME)
+        for key, value in DEFAULT_CONFIG.items():
+            if key not in self.config:
+                self.config[key] = copy.deepcopy(value)
+        if not self.batch:
+            self.autosave.start(self.config["autosave"])
+            last_notebook = self.config["last_notebook"]
+            if self.config["preload"] == "on" and len(self.file) == 0 and os.path.isfile(last_notebook):
+                if self.intro:
+                    # Written before the notebook starts loading, which would hold it up.
+                    self.stdout.write(str(self.intro) + "\n")
+                    self.intro = None
+                self.preload = Preload(last_notebook)
+        if len(self.file) != 0:
+            self.config["last_notebook"] = self.path + self.file
 
     def precmd(self, line: str) -> str:
+        line = self.resolve_alias(line)
+        command = self.parseline(line)[0]
+        if command:
+            self.stats.begin(command)
+            if self.preload is not None:
+                self.__finish_preload()
+            if command not in ("undo", "redo"):
+                # Everything one command changes is undone at once.
+                self.top.notebook.history.begin()
+        return line
+
+    def resolve_alias(self, line: str) -> str:
+        """Returns the command line with an alias set by 'config aliases' replaced by its command."""
         split_line = line.split(" ")
         if split_line[0] in self.config["aliases"]:
             cmd_name = self.config["aliases"][split_line[0]]
             cmd_str = f"do_{cmd_name}"
             if hasattr(self, cmd_str):
                 cmd_args = " ".join(split_line[1:])
-                return f"{cmd_name} {cmd_args}"
+                line = f"{cmd_name} {cmd_args}"
         return line
 
+    def onecmd(self, line: str) -> bool:
+        with self.lock:
+            return cmd.Cmd.onecmd(self, line)
+
+    def postcmd(self, stop: bool, line: str) -> bool:
+        self.stats.end()
+        self.top.notebook.history.end()
+        return stop
+
     def __save_config(self) -> None:
-        config = open(CONFIG_FILE_NAME, "wb")
-        pickle.dump(self.config,config)
-        config.close()
+        save_config(self.config, CONFIG_FILE_NAME)
+
+    def __finish_preload(self) -> None:
+        """Waits for the preload started by preloop and makes the notebook it loaded the current one."""
+        preload = self.preload
+        self.preload = None
+        with self.stats.timer("persistence"):
+            top = preload.result()
+        if top is None:
+            print("Could not load " + preload.filepath + ": " + str(preload.error))
+            return
+        # Under the lock, the autosave thread must not see the new file with the old tree.
+        with self.lock:
+            self.top = top
+            self.top.notebook.start_history()
+            self.prj = self.top
+            self.path = os.path.dirname(preload.filepath) + "/"
+            self.file = os.path.basename(preload.filepath)
+        print("Loaded from " + preload.filepath)
 
     @staticmethod
     def __arg_contains(arg_str: str, *contain_str: str) -> bool:
@@ -168,13 +303,23 @@ class PrjCmd(cmd.Cmd):
             Arguments:
             clear: bool (True) - clears the terminal when printing.
             overview: bool (False) - prints the entire tree instead of the tree starting from the current branch.
+            viewport: bool (True) - with the 'viewport' redraw mode, redraws only the part of the entire tree around the current branch.
+                False for an explicit print, which is also the only printing done in batch mode.
             """
-        if kwargs.setdefault("clear", True):
-            os.system(COMMANDS.get("clear"))
-        if kwargs.setdefault("overview", False):
-            print(self.top.__str_tree__(**kwargs))
-        else:
-            print(self.prj.__str_tree__(**kwargs))
+        if self.batch and kwargs.get("viewport", True):
+            return
+        with self.stats.timer("render"):
+            if kwargs.setdefault("viewport", True) and self.config.get("redraw") == "viewport" and sys.stdout.isatty():
+                self.view.draw(self.top, self.prj, **kwargs)
+                return
+            self.view.invalidate()
+            if kwargs.setdefault("clear", True) and not self.batch:
+                os.system(COMMANDS.get("clear"))
+            if kwargs.setdefault("overview", False):
+                tn.write_tree(self.top, sys.stdout, **kwargs)
+            else:
+                tn.write_tree(self.prj, sys.stdout, **kwargs)
+            print()
 
     def __is_file_set_and_arg_empty(self, arg: str) -> bool:
         """:
@@ -189,27 +334,47 @@ class PrjCmd(cmd.Cmd):
         return len(self.file) != 0 and (self.__is_empty_arg(arg))
 
     def __list_dir(self) -> list:
-        #DOCME
-        def filter_rule(x): return x.find(".pkl") != -1
-        file_list = list()
-        for (dirpath, dirname, filename) in os.walk(self.path):
-            file_list.extend(filename)
-        return list(filter(filter_rule, file_list))
+        """Returns the notebooks in the current file's directory and the ones set with 'config notebook_dirs'."""
+        return self.catalog.list([self.path] + self.config.get("notebook_dirs", list()))
+
+    def __notebook_label(self, notebook: dict) -> str:
+        """The file name of a notebook in the current file's directory, the full path of one elsewhere."""
+        if os.path.dirname(notebook["path"]) == os.path.abspath(self.path):
+            return notebook["name"]
+        return notebook["path"].replace("\\", "/")
 
     def __str_dir(self) -> str:
-        #DOCME
-        file_list = self.__list_dir()
         file_str = str()
-        for thing in filter(lambda x: x.find(".py") == -1, file_list):
-            file_str += thing + "\n"
+        for notebook in self.__list_dir():
+            file_str += tc.format_notebook(notebook, self.__notebook_label(notebook)) + "\n"
         return file_str
 
-    def __select_from_list(self, select_list: list):
-        #DOCME
+    def __select_from_list(self, select_list: list, choice: str = ""):
+        """:
+            Returns an item of a list, chosen by the user from a numbered list unless there is only one.
+
+            Args:
+                select_list (list): Items to choose from.
+                choice (str, optional): Number of the item, to choose without asking. Defaults to "".
+
+            Returns:
+                The chosen item, None if nothing was chosen.
+            """
         if len(select_list) == 0:
             return None
         elif len(select_list) == 1:
             return select_list[0]
+        choice = choice.strip()
+        if choice.isnumeric():
+            if int(choice) in range(1, len(select_list) + 1):
+                return select_list[int(choice) - 1]
+            return None
+        if self.batch:
+            # Listed so the number can be given next time, the list depends on the tree.
+            for i in range(0, len(select_list)):
+                print(i + 1, str(select_list[i]))
+            raise BatchError("there are " + str(len(select_list)) + " options to choose from, give the number of one")
+        self.view.invalidate()
         for i in range(0, len(select_list)):
             print(i + 1, str(select_list[i]))
         select_input = input("select: ")
@@ -257,7 +422,7 @@ class PrjCmd(cmd.Cmd):
     def do_in(self, arg):
         #DOCME
         subprojects = self.prj.get_subprojects()
-        down_choice = self.__select_from_list(subprojects)
+        down_choice = self.__select_from_list(subprojects, arg)
         if down_choice is None:
             return
         self.prj = down_choice
@@ -266,6 +431,7 @@ class PrjCmd(cmd.Cmd):
     def help_in(self):
         print("Move one layer into the tree."
               "\nIf multiple branches are available, a list will be presented to choose from."
+              "\nArgs: Number of the branch in that list, to choose it without the list."
               )
 
     def do_top(self, arg):
@@ -276,6 +442,33 @@ class PrjCmd(cmd.Cmd):
     def help_top(self):
         print("Go to the top of the tree.")
 
+    def do_goto(self, arg):
+        #DOCME
+        target = arg.strip()
+        index = self.top.notebook.get_index("ids")
+        if len(target) == 0:
+            print("id " + str(self.prj.get_id()) + ": /" + index.path(self.prj))
+            return
+        prj = None
+        if target.isdigit():
+            prj = index.find(int(target))
+        if prj is None:
+            prj = index.resolve(target, self.top)
+        if prj is None:
+            if self.batch:
+                raise BatchError("no branch " + target)
+            print("No branch " + target)
+            return
+        self.prj = prj
+        self.__print_tree()
+
+    def help_goto(self):
+        print("Go straight to a branch anywhere in the tree."
+              "\nArgs: The id of the branch, shown by \'print ids\', or the titles of the branches leading to it"
+              "\nfrom the top, separated by /, e.g. goto Work/Reports/Monthly."
+              "\nNone - displays the id and path of the current branch."
+              )
+
     def do_description(self, arg):
         #DOCME
         self.prj.set_description(arg)
@@ -285,8 +478,9 @@ class PrjCmd(cmd.Cmd):
         print("Enter a description for the current branch.")
 
     def do_print(self, arg):
+        self.view.invalidate()
         if self.__first_arg_is(arg, "here"):
-            self.__print_tree(**self.__arg_strip(arg + " ".join(self.config["print_options"]),"here"))
+            self.__print_tree(viewport=False, **self.__arg_strip(arg + " ".join(self.config["print_options"]),"here"))
         elif self.__first_arg_is(arg, "file"):
             print(self.file)
         elif self.__first_arg_is(arg, "dir"):
@@ -294,7 +488,7 @@ class PrjCmd(cmd.Cmd):
         elif self.__first_arg_is(arg, "config"):
             print(self.config)
         else:
-            self.__print_tree(**self.__arg_strip(arg + " overview " + " ".join(self.config["print_options"]),""))
+            self.__print_tree(viewport=False, **self.__arg_strip(arg + " overview " + " ".join(self.config["print_options"]),""))
 
     def help_print(self):
         print(
@@ -302,7 +496,8 @@ class PrjCmd(cmd.Cmd):
             "\nSee \'?config print\' for additional options."
             "\nArguments: \'here\' - displays the tree at the current branch and all lower branches."
             "\nfile - displays the current filename."
-            "\ndir - displays all of the current files in the directory."
+            "\ndir - displays the notebooks in the directory of the current file and the ones set with"
+            " 'config notebook_dirs', with their number of branches, top branch, size and time of the last save."
         )
 
     def do_clear(self, arg):
@@ -313,21 +508,64 @@ class PrjCmd(cmd.Cmd):
         print("Remove the current branch and all lower branches from the tree.")
 
     def do_reset(self, arg):
-        self.top = tn.main()
+        # Cleared one by one rather than replaced by a new tree, so the reset can be undone.
+        for prj in list(self.top.subprojects):
+            prj.clear_project()
         self.prj = self.top
         self.__print_tree()
 
     def help_reset(self):
         print("Removes all branches from the current tree.")
 
+    def do_undo(self, arg):
+        #DOCME
+        self.__replay_history(self.top.notebook.history.undo, "Nothing to undo.")
+
+    def help_undo(self):
+        print("Undoes the last command that changed the tree. The last " + str(tu.UNDO_STEPS) + " can be undone.")
+
+    def do_redo(self, arg):
+        #DOCME
+        self.__replay_history(self.top.notebook.history.redo, "Nothing to redo.")
+
+    def help_redo(self):
+        print("Makes the last undone change again. Any other change made since the undo discards it.")
+
+    def __replay_history(self, replay, nothing: str) -> None:
+        branch = replay()
+        if branch is None:
+            print(nothing)
+            return
+        # Go to the changed branch, or stay if the current one is still in the tree.
+        top = self.prj
+        while top.parent is not None:
+            top = top.parent
+        if top is not self.top:
+            self.prj = branch
+        self.__print_tree()
+
     def do_save(self, arg: str):
         file_name = str()
         if self.__is_file_set_and_arg_empty(arg):
-            tn.save(self.top, self.path + self.file)
             file_name = self.file
         else:
-            tn.save(self.top, self.path + arg)
-            file_name = arg
+            file_name = arg.strip()
+        if len(file_name) == 0:
+            if self.batch:
+                raise BatchError("no file to save to, give one to save or to the batch")
+            print("No file to save to, give one or set one with 'file'.")
+            return
+        if self.batch:
+            # A batch is saved once, when all of its commands ran.
+            self.batch_save = self.path + file_name
+            return
+        with self.stats.timer("persistence"):
+            if file_name == self.file:
+                # The autosave thread may be writing the same file, the save has to go after it.
+                self.autosave.save()
+            else:
+                tn.save(self.top, self.path + file_name)
+        self.config["last_notebook"] = self.path + file_name
         print("Saved to " + file_name)
 
     def help_save(self):
@@ -335,30 +573,57 @@ class PrjCmd(cmd.Cmd):
 
     def do_load(self, arg):
         #DOCME
-        del self.top
-        del self.prj
-        file_name = str()
         if self.__is_file_set_and_arg_empty(arg):
-            self.top = tn.load(self.path + self.file)
             file_name = self.file
         else:
-            self.top = tn.load(self.path + arg)
             file_name = arg
+        try:
+            with self.stats.timer("persistence"), self.autosave.write_lock:
+                top = tn.load(self.path + file_name)
+        except Exception as error:
+            # The tree that was open stays open.
+            if self.batch:
+                raise
+            print("Could not load " + file_name + ": " + (str(error) or type(error).__name__))
+            return
+        self.top = top
         print("Loaded from " + file_name)
+        self.config["last_notebook"] = self.path + file_name
+        self.top.notebook.start_history()
         self.prj = self.top
         self.__print_tree(overview=True)
 
     def help_load(self):
         print("Loads a tree from the file given as an argument or if no arg is given, from the current file shown by \'print file\'.")
 
+    def do_store(self, arg):
+        import TreeLazy as tl
+        import TreeStore as tst
+        if tl.is_store(self.top):
+            print("The tree is kept in a store already.")
+            return
+        with self.autosave.write_lock:
+            self.top = tst.from_project(self.top)
+        self.top.notebook.start_history()
+        self.prj = self.top
+        print("The tree is kept in a store now.")
+        self.__print_tree(overview=True)
+
+    def help_store(self):
+        print("Keeps the current tree in a compact store, which holds large trees in a fraction of the memory."
+              "\nSaves write the store and loading its file opens it again as a store. Undo does not go back past this.")
+
     def do_file(self, arg):
         #DOCME
-        file_name = str()
         if self.__is_empty_arg(arg):
-            select = self.__select_from_list(self.__list_dir())
+            notebooks = self.__list_dir()
+            labels = [tc.format_notebook(notebook, self.__notebook_label(notebook)) for notebook in notebooks]
+            select = self.__select_from_list(labels)
             if select is None:
                 return
-            self.file = select
+            filepath = notebooks[labels.index(select)]["path"].replace("\\", "/")
+            self.path = os.path.dirname(filepath) + "/"
+            self.file = os.path.basename(filepath)
         else:
             if arg.find(".pkl") == -1:
                 arg += ".pkl"
@@ -366,7 +631,55 @@ class PrjCmd(cmd.Cmd):
         print("file name set to " + self.file)
 
     def help_file(self):
-        print("Sets the current file to the name given as an argument. If no arg is given, a list of files in the current directory is shown to choose from.")
+        print("Sets the current file to the name given as an argument. If no arg is given, a list of the notebooks in the current directory"
+              "\nand the ones set with 'config notebook_dirs' is shown to choose from.")
+
+    def do_import(self, arg):
+        #DOCME
+        args = arg.split()
+        if len(args) == 0:
+            self.help_import()
+            return
+        import TreeImport as ti
+        file_format = None
+        if len(args) > 1 and args[-1] in ti.READERS:
+            file_format = args.pop()
+        file_name = " ".join(args)
+        with self.stats.timer("persistence"):
+            roots = ti.import_file(self.prj, self.path + file_name, file_format)
+        self.__print_tree()
+        print("Imported " + str(sum(1 for root in roots for prj in tw.pre_order(root))) + " branches from " + file_name)
+
+    def help_import(self):
+        print("Imports an outline file below the current branch."
+              "\nArgs: FILE [text|markdown|opml], the format is guessed from the extension if not given."
+              "\nText: one branch per line, nested by indentation."
+              "\nMarkdown: headings and list items, any other line is the description of the branch above it."
+              "\nOPML: outline elements, with their _note as the description."
+              "\nMarkers in a line: #tag, @date and !priority (0-6)."
+              )
+
+    def do_export(self, arg):
+        #DOCME
+        args = arg.split()
+        if len(args) == 0:
+            self.help_export()
+            return
+        import TreeExport as te
+        file_format = None
+        if len(args) > 1 and args[-1] in te.WRITERS:
+            file_format = args.pop()
+        file_name = " ".join(args)
+        with self.stats.timer("persistence"):
+            te.export_file(self.prj, self.path + file_name, file_format)
+        print("Exported to " + file_name)
+
+    def help_export(self):
+        print("Exports the current branch and every branch below it to a file other tools can read."
+              "\nArgs: FILE [jsonl|markdown|opml], the format is guessed from the extension if not given."
+              "\nJSON Lines: one branch per line with its id, parent, layer, title, description, priority, tags and date."
+              "\nMarkdown and OPML: outlines that import can read back."
+              )
 
     def do_priority(self, arg):
         #DOCME
@@ -379,17 +692,24 @@ class PrjCmd(cmd.Cmd):
                 tn.Fore.RED + "Critical" + tn.Style.RESET_ALL: "6"
             }
             priority_str = self.__select_from_list(list(priority_dict))
-            self.prj.do_recursive(lambda prj: prj.set_priority(priority_dict.setdefault(
-                priority_str, "0")))  # this is so cool that this works lol
+            priority = priority_dict.setdefault(priority_str, "0")
+            self.prj.set_priority_below(priority)
         else:
-            self.prj.set_priority(arg)
+            try:
+                self.prj.set_priority(arg)
+            except ValueError:
+                if self.batch:
+                    raise
+                print("Not a priority: " + arg)
+                return
         self.__print_tree()
 
     def help_priority(self):
         print("Sets the priority of the branch, giving it an integer value and a text color"
               "\nArgs:"
               "\n(int) 0-6"
-              "\nNone - a list will be presented with options to choose from."
+              "\nNone - a list will be presented with options to choose from, the priority is then set for every"
+              " branch below as well."
               )
 
     def do_move(self, arg): #TODO
@@ -409,31 +729,185 @@ class PrjCmd(cmd.Cmd):
               )
 
     def do_tag(self, arg):
-        if self.__arg_contains(arg, "remove"):
+        if self.__first_arg_is(arg, "rename"):
+            args = arg.split()
+            if len(args) != 3:
+                self.help_tag()
+                return
+            try:
+                self.top.notebook.rename_tag(args[1], args[2])
+            except ValueError:
+                if self.batch:
+                    raise
+                print("No such tag: " + args[1])
+                return
+        elif self.__arg_contains(arg, "remove"):
             remove_list = list(self.__arg_strip(arg, "remove").keys())
             for tag in remove_list:
-                self.prj.do_recursive(lambda prj: prj.unset_tag(tag))
+                self.prj.unset_tag_below(tag)
         else:
             tag_list = list(self.__arg_strip(arg, "").keys())
             for tag in tag_list:
-                self.prj.do_recursive(lambda prj: prj.set_tag(tag))
-                # self.prj.set_tag(arg)
+                self.prj.set_tag_below(tag)
         self.__print_tree(tags=True)
 
     def help_tag(self):
-        print("Set a tag to the current branch.")
+        print("Set a tag to the current branch and every branch below it."
+              "\nremove - unset the tags instead."
+              "\nrename OLD NEW - rename a tag on every branch, renaming it to a tag in use merges the two.")
+
+    def do_date(self, arg):
+        #DOCME
+        try:
+            self.prj.set_date(arg)
+        except ValueError:
+            if self.batch:
+                raise
+            print("Not a date: " + arg)
+            return
+        self.__print_tree(date=True)
 
-    def do_date(self, arg):#TODO
-        self.prj.set_date(arg)
+    def help_date(self):
+        print("Sets the due date of the current branch."
+              "\nArgs: YYYY-MM-DD, today, tomorrow, yesterday or +N days from today."
+              "\nNone - the date is removed."
+              )
 
-    def help_date(self):#TODO
-        print("Set a date to the current branch.")
+    def do_due(self, arg):
+        #DOCME
+        args = arg.split()
+        start = None
+        end = None
+        try:
+            if self.__first_arg_is(arg, "overdue"):
+                end = td.parse_date("today")
+            elif self.__first_arg_is(arg, "before") and len(args) == 2:
+                end = td.parse_date(args[1])
+            elif self.__first_arg_is(arg, "between") and len(args) == 3:
+                start = td.parse_date(args[1])
+                end = td.parse_date(args[2]) + datetime.timedelta(days=1)
+            elif len(args) != 0:
+                self.help_due()
+                return
+        except ValueError as error:
+            if self.batch:
+                raise
+            print("Not a date: " + str(error))
+            return
+        found = self.prj.notebook.get_index("dates").between(start, end, self.prj)
+        if len(found) == 0:
+            print("No branches found.")
+            return
+        for prj in found:
+            print(prj.__str_f__(date=True))
+
+    def help_due(self):
+        print("Displays the branches below the current branch that have a date, soonest first."
+              "\noverdue - only the ones due before today."
+              "\nbefore DATE - only the ones due before DATE."
+              "\nbetween DATE DATE - only the ones due from the first DATE to the second one, both included."
+              "\nSee \'?date\' for how dates are written."
+              )
 
-    def do_search(self, arg):#TODO #XXX
-        search_tags = self.__arg_strip(arg, "")
+    def do_search(self, arg):
+        #DOCME
+        found = self.top.notebook.get_index("tags").query(arg.split(), self.top)
+        if len(found) == 0:
+            print("No branches found.")
+            return
+        choice = self.__select_from_list(found)
+        if choice is None:
+            return
+        self.prj = choice
+        self.__print_tree(tags=True)
+
+    def help_search(self):
+        print("Searches the whole tree for branches by their tags and goes to the one chosen from the results."
+              "\nArgs: Tags that must all be set, 'not tag' for a tag that must not be set,"
+              "\n'or' between groups of tags of which any may match."
+              "\nExample: search work urgent or home not done"
+              )
 
     def do_filter(self, arg):
-        pass
+        #DOCME
+        found = self.prj.notebook.get_index("tags").query(arg.split(), self.prj)
+        if len(found) == 0:
+            print("No branches found.")
+            return
+        for prj in found:
+            print(prj.__str_f__(tags=True))
+
+    def help_filter(self):
+        print("Displays the branches below the current branch that match a tag query, see \'?search\' for the syntax.")
+
+    def do_next(self, arg):
+        #DOCME
+        words = arg.split()
+        count = NEXT_COUNT
+        if len(words) != 0 and words[0].isnumeric():
+            count = int(words.pop(0))
+        found = self.prj.notebook.get_index("priority").next(count, self.prj, words)
+        if len(found) == 0:
+            print("No branches found.")
+            return
+        for prj in found:
+            print(prj.__str_f__(priority=True, tags=True))
+
+    def help_next(self):
+        print("Displays the most urgent branches without subprojects below the current branch, highest priority first."
+              "\nArgs: [N] [tag query], N branches are displayed, " + str(NEXT_COUNT) + " if not given."
+              "\nThe tag query keeps only the matching branches, see \'?search\' for the syntax."
+              )
+
+    def do_find(self, arg):
+        #DOCME
+        found = self.top.notebook.get_index("text").query(arg.split(), self.top, FIND_LIMIT)
+        if len(found) == 0:
+            print("No branches found.")
+            return
+        choice = self.__select_from_list(found)
+        if choice is None:
+            return
+        self.prj = choice
+        self.__print_tree()
+
+    def help_find(self):
+        print("Finds branches by the words in their titles and descriptions and goes to the one chosen from the results."
+              "\nArgs: Words to look for, the beginning of a word is enough. Best matches are listed first."
+              )
+
+    def do_stats(self, arg):
+        #DOCME
+        if self.__first_arg_is(arg, "reset"):
+            self.stats.reset()
+        elif self.__first_arg_is(arg, "export"):
+            file_name = arg.replace("export", "", 1).strip()
+            if self.__is_empty_arg(file_name):
+                print("Please supply the name of the file to export to.")
+                return
+            self.stats.export(file_name)
+            print("Exported to " + file_name)
+        elif self.__first_arg_is(arg, "profile"):
+            import cProfile
+            import pstats
+            command = arg.replace("profile", "", 1).strip()
+            profile = cProfile.Profile()
+            profile.runcall(self.onecmd, command)
+            stream = io.StringIO()
+            pstats.Stats(profile, stream=stream).sort_stats("cumulative").print_stats(PROFILE_LINES)
+            self.view.invalidate()
+            print(stream.getvalue())
+        else:
+            self.view.invalidate()
+            print(self.stats)
+
+    def help_stats(self):
+        print("Displays how long commands took: count, median, 95th percentile and maximum of the recent runs"
+              "\nof every command, and of the time spent rendering, saving and loading, and working on the tree."
+              "\nreset - forgets all timings."
+              "\nexport 'file name' - writes the timings to a JSON file."
+              "\nprofile 'command' - runs one command under cProfile and displays where its time went."
+              )
 
     def do_config(self, arg):
         if self.__first_arg_is(arg, "print_options"):
@@ -441,12 +915,34 @@ class PrjCmd(cmd.Cmd):
         elif self.__first_arg_is(arg, "aliases"):
             argKeys = str(arg).replace("aliases","").strip().split(" ")
             self.config["aliases"][argKeys[0]] = argKeys[1]
+        elif self.__first_arg_is(arg, "redraw"):
+            mode = str(arg).replace("redraw", "").strip()
+            if mode in REDRAW_MODES:
+                self.config["redraw"] = mode
+            else:
+                print("Redraw mode must be one of: " + ", ".join(REDRAW_MODES))
+        elif self.__first_arg_is(arg, "autosave"):
+            seconds = str(arg).replace("autosave", "").strip()
+            if seconds.isdigit():
+                self.config["autosave"] = int(seconds)
+                self.autosave.start(int(seconds))
+            else:
+                print("Autosave must be a number of seconds, 0 to turn it off.")
+        elif self.__first_arg_is(arg, "notebook_dirs"):
+            directories = str(arg).replace("notebook_dirs", "", 1).strip().split(" ")
+            self.config["notebook_dirs"].extend(os.path.abspath(directory) for directory in directories if directory)
+        elif self.__first_arg_is(arg, "preload"):
+            mode = str(arg).replace("preload", "").strip()
+            if mode in PRELOAD_MODES:
+                self.config["preload"] = mode
+            else:
+                print("Preload must be one of: " + ", ".join(PRELOAD_MODES))
         elif self.__first_arg_is(arg, "clear"):
             if not self.__is_empty_arg(str(arg).replace("clear","")):
                 configs_to_clear = self.__arg_strip(arg, "clear")
                 for config_to_clear_key in configs_to_clear:
                     if config_to_clear_key in self.config:
-                        self.config[config_to_clear_key] = DEFAULT_CONFIG[config_to_clear_key]
+                        self.config[config_to_clear_key] = copy.deepcopy(DEFAULT_CONFIG[config_to_clear_key])
             else:
                 print("Please supply arguments of the configuration options you wish to be cleared.")
 
@@ -458,12 +954,46 @@ class PrjCmd(cmd.Cmd):
             \tChanging config keys varies in behavior depending on the key, the print_options key can accept multiple arguments.
             \tThe aliases key can only accept one, that is a key value pair.\n
             OPTIONS:
-            \t-> print_options : [tags,date,highlight]
+            \t-> print_options : [tags,date,ids,totals,highlight]
             \t-> aliases : 'alias name' 'operation'
+            \t-> redraw : [full,viewport]
+            \t\tfull clears the screen and prints the tree after every command,
+            \t\tviewport redraws only the rows of the entire tree around the current branch that fit the terminal.
+            \t-> autosave : 'seconds'
+            \t\thow often the current file is saved in the background, 0 turns it off.
+            \t-> notebook_dirs : 'directory' ...
+            \t\tdirectories whose notebooks 'file' and 'print dir' list besides the current one, not the ones below them.
+            \t-> preload : [on,off]
+            \t\ton loads the notebook last loaded or saved in the background when the prompt starts without one,
+            \t\tthe first command waits for it.
         """)
 
+    def do_autosave(self, arg):
+        #DOCME
+        if not self.autosave.is_running():
+            print("Autosave is off.")
+        elif len(self.file) == 0:
+            print("Autosave is on every " + str(self.autosave.interval) + " seconds, once a file is set.")
+        else:
+            print("Autosave is on every " + str(self.autosave.interval) + " seconds to " + self.file + ".")
+        if self.autosave.last_time is not None:
+            print("Last saved at " + time.strftime("%H:%M:%S", time.localtime(self.autosave.last_time))
+                  + ", the save took " + "{:.1f}".format(self.autosave.last_latency * 1000) + " ms"
+                  + " and held up commands for " + "{:.1f}".format(self.autosave.last_held * 1000) + " ms.")
+        if self.autosave.error is not None:
+            print("The last autosave failed: " + str(self.autosave.error))
+
+    def help_autosave(self):
+        print("Displays whether the current file is saved in the background, when it was last saved and how long that took."
+              "\nSet how often with 'config autosave seconds'."
+              )
+
     def do_quit(self, arg):
         #DOCME
+        self.autosave.stop()
+        if self.batch:
+            # A batch leaves the config of the user as it found it, 'config' changes only last for the batch.
+            return True
         self.__save_config()
         sys.exit()
 
@@ -474,6 +1004,246 @@ class PrjCmd(cmd.Cmd):
         #DOCME
         return
 
+    def default(self, line: str) -> None:
+        if self.batch:
+            raise BatchError("unknown command")
+        cmd.Cmd.default(self, line)
+
+    def __autosave_target(self):
+        if len(self.file) == 0:
+            return None
+        return self.top, self.path + self.file
+
+    def open_notebook(self, filepath: str) -> None:
+        """Makes filepath the current file, loading it if it exists."""
+        filepath = os.path.abspath(filepath).replace("\\", "/")
+        self.path = os.path.dirname(filepath) + "/"
+        self.file = os.path.basename(filepath)
+        if os.path.exists(filepath):
+            with self.stats.timer("persistence"):
+                self.top = tn.load(filepath)
+            self.top.notebook.start_history()
+            self.prj = self.top
+
+    def run_batch(self, lines) -> int:
+        """:
+            Runs commands without a prompt and without redrawing the tree, then saves once if the batch saved or
+            a file is set. Blank lines and lines starting with # are skipped. Stops at the first failing command.
+
+            Args:
+                lines (iterable): The command lines, e.g. an open script file or sys.stdin.
+
+            Returns:
+                int: Exit status, 0 if every command ran, 1 otherwise.
+            """
+        self.preloop()
+        if len(self.file) != 0:
+            self.batch_save = self.path + self.file
+        for number, line in enumerate(lines, 1):
+            line = line.strip()
+            if len(line) == 0 or line.startswith("#"):
+                continue
+            try:
+                line = self.precmd(line)
+                stop = self.postcmd(self.onecmd(line), line)
+            except Exception as error:
+                print("line " + str(number) + ": " + line + ": " + str(error), file=sys.stderr)
+                return 1
+            if stop:
+                break
+        if self.batch_save is not None:
+            try:
+                with self.stats.timer("persistence"):
+                    tn.save(self.top, self.batch_save)
+            except OSError as error:
+                print("saving " + self.batch_save + ": " + str(error), file=sys.stderr)
+                return 1
+        return 0
+
+
+class ServerSession(PrjCmd):
+    """:
+        The commands of one client of a notebook server, run without a prompt like a batch on the tree the server
+        shares. Every client has its own current branch, cut buffer and config; the undo history is the notebook's,
+        so undo reverses the last change whoever made it.
+        """
+
+    def __init__(self, server: 'tsv.NotebookServer', client: int):
+        PrjCmd.__init__(self, batch=True, top=server.top)
+        self.server = server
+        self.client = client
+        self.autosave = server.autosave
+        self.path = os.path.dirname(server.filepath).replace("\\", "/") + "/"
+        self.file = os.path.basename(server.filepath)
+        self.preloop()
+
+    def only_reads(self, line: str) -> bool:
+        """Returns True if a command line only looks at the tree. What stats profile runs decides for it."""
+        command, arg = self.parseline(self.resolve_alias(line))[0: 2]
+        if command == "stats" and arg.split(" ", 1)[0] == "profile":
+            return self.only_reads(arg.replace("profile", "", 1).strip())
+        return command in READ_COMMANDS
+
+    def run(self, line: str) -> bool:
+        """Runs one command line while holding the server's lock, returns True once the client quits."""
+        if self.only_reads(line):
+            lock = self.server.reading()
+        else:
+            lock = self.server.writing(self.client, line)
+        with lock:
+            # Another client may have cleared the current branch.
+            top = self.prj
+            while top.parent is not None:
+                top = top.parent
+            if top is not self.top:
+                self.prj = self.top
+            line = self.precmd(line)
+            stop = False
+            try:
+                stop = self.onecmd(line)
+            finally:
+                stop = self.postcmd(stop, line)
+        return stop
+
+    def onecmd(self, line: str) -> bool:
+        # The server's lock is taken by run().
+        return cmd.Cmd.onecmd(self, line)
+
+    def do_save(self, arg):
+        if len(arg.strip()) != 0:
+            print("The server only saves to " + self.file + ".")
+            return
+        with self.stats.timer("persistence"):
+            self.autosave.save()
+        print("Saved to " + self.file)
+
+    def do_load(self, arg):
+        print("The server keeps " + self.file + " loaded, start another server for another notebook.")
+
+    def do_store(self, arg):
+        print("The server keeps the tree of " + self.file + " as it was loaded.")
+
+    def do_file(self, arg):
+        print(self.file)
+
+    def do_config(self, arg):
+        if arg.strip().startswith("autosave"):
+            print("Autosave is set when the server starts.")
+            return
+        PrjCmd.do_config(self, arg)
+
+    def do_quit(self, arg):
+        return True
+
+
+class RemoteCmd(cmd.Cmd):
+    """Prompt that sends every command line to a notebook server and prints what it printed."""
+
+    prompt = PrjCmd.prompt
+
+    def __init__(self, socket_path: str):
+        import TreeServer as tsv
+        cmd.Cmd.__init__(self)
+        self.client = tsv.Client(socket_path, self.notify)
 
-CLI = PrjCmd()
-CLI.cmdloop()
+    def onecmd(self, line: str) -> bool:
+        if len(line.strip()) == 0:
+            return False
+        try:
+            response = self.client.run(line)
+        except ConnectionError as error:
+            print(str(error))
+            return True
+        print(response["output"], end="")
+        if response["error"] is not None:
+            print("Error: " + response["error"])
+        return response["stop"]
+
+    def notify(self, notification: dict) -> None:
+        print("\n* client " + str(notification["client"]) + " ran '" + notification["line"] + "', "
+              + str(notification["changes"]) + " changes\n" + self.prompt, end="", flush=True)
+
+    def postloop(self) -> None:
+        self.client.close()
+
+
+def run_remote_batch(socket_path: str, lines) -> int:
+    """:
+        Runs the commands of a batch script on a notebook server, like PrjCmd.run_batch does on a file.
+
+        Returns:
+            int: Exit status, 0 if every command ran, 1 otherwise.
+        """
+    import TreeServer as tsv
+    client = tsv.Client(socket_path)
+    try:
+        for number, line in enumerate(lines, 1):
+            line = line.strip()
+            if len(line) == 0 or line.startswith("#"):
+                continue
+            response = client.run(line)
+            print(response["output"], end="")
+            if response["error"] is not None:
+                print("line " + str(number) + ": " + line + ": " + response["error"], file=sys.stderr)
+                return 1
+            if response["stop"]:
+                break
+    finally:
+        client.close()
+    return 0
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Tree Note")
+    parser.add_argument("notebook", nargs="?", help="notebook file to open, and in batch mode to save to at the end")
+    parser.add_argument("--batch", metavar="SCRIPT",
+                        help="run the commands of SCRIPT ('-' for stdin) without a prompt or redrawing, then exit")
+    parser.add_argument("--serve", metavar="SOCKET",
+                        help="keep the notebook loaded and serve it to the clients connecting to the Unix socket SOCKET")
+    parser.add_argument("--connect", metavar="SOCKET",
+                        help="work on the notebook served at SOCKET, at the prompt or with --batch")
+    args = parser.parse_args(argv)
+    tn.init()
+    if args.serve is not None:
+        if args.notebook is None:
+            parser.error("--serve needs a notebook file")
+        import TreeServer as tsv
+        interval = load_config(CONFIG_FILE_NAME).get("autosave", DEFAULT_CONFIG["autosave"])
+        server = tsv.NotebookServer(args.serve, args.notebook, ServerSession, interval)
+        print("Serving " + server.filepath + " at " + args.serve)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+        return 0
+    if args.connect is not None:
+        if args.batch is None:
+            RemoteCmd(args.connect).cmdloop()
+            return 0
+        if args.batch == "-":
+            return run_remote_batch(args.connect, sys.stdin)
+        script = open(args.batch, "r")
+        status = run_remote_batch(args.connect, script)
+        script.close()
+        return status
+    if args.batch is None:
+        CLI = PrjCmd()
+        if args.notebook is not None:
+            CLI.open_notebook(args.notebook)
+        CLI.cmdloop()
+        return 0
+    CLI = PrjCmd(batch=True)
+    if args.notebook is not None:
+        CLI.open_notebook(args.notebook)
+    if args.batch == "-":
+        return CLI.run_batch(sys.stdin)
+    script = open(args.batch, "r")
+    status = CLI.run_batch(script)
+    script.close()
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,61 @@
+import array
+
+
+# Branches with at least this many subprojects get a SiblingOrder, narrower ones are searched directly.
+WIDE_BRANCH = 64
+
+
+class SiblingOrder:
+    """:
+        Order-statistic index over the subprojects list of one wide branch, giving the index of a subproject in
+        O(log n) after removals ahead of it shifted it.
+
+        Every subproject holds a slot, slots increase along the list. A Fenwick tree counts the slots still in use,
+        so the index of a subproject is the number of used slots before its own. Removing a subproject frees its slot,
+        appending one takes a new slot at the end and swapping two neighbours swaps their slots. Inserting anywhere
+        else cannot keep the slots in order: the branch's SiblingOrder is dropped and built again when next needed.
+        """
+
+    def __init__(self, siblings: list):
+        self.siblings = siblings  # The list this order was built for, a new list means a new order
+        self.slots = dict()  # branch id -> slot
+        self.tree = array.array("i", [0])  # Fenwick tree over the slots, 1-based
+        self.count = 0
+        for prj in siblings:
+            self.append(prj)
+
+    def is_for(self, siblings: list) -> bool:
+        return self.siblings is siblings and self.count == len(siblings)
+
+    def __prefix(self, slot: int) -> int:
+        """Returns the number of used slots up to and including slot."""
+        index = slot + 1
+        total = 0
+        while index > 0:
+            total += self.tree[index]
+            index -= index & -index
+        return total
+
+    def __add(self, slot: int, delta: int) -> None:
+        index = slot + 1
+        while index < len(self.tree):
+            self.tree[index] += delta
+            index += index & -index
+
+    def position(self, prj) -> int:
+        return self.__prefix(self.slots[prj.id]) - 1
+
+    def append(self, prj) -> None:
+        slot = len(self.tree) - 1
+        index = slot + 1
+        # The new node covers the slots (index - lowbit(index), index], only the new slot is used among the last one.
+        self.tree.append(1 + self.__prefix(slot - 1) - self.__prefix(index - (index & -index) - 1))
+        self.slots[prj.id] = slot
+        self.count += 1
+
+    def remove(self, prj) -> None:
+        self.__add(self.slots.pop(prj.id), -1)
+        self.count -= 1
+
+    def swap(self, prj, other) -> None:
+        self.slots[prj.id], self.slots[other.id] = self.slots[other.id], self.slots[prj.id]
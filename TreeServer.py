@@ -0,0 +1,368 @@
+import contextlib
+import io
+import json
+import os
+import queue
+import socket
+import socketserver
+import sys
+import threading
+import TreeAutosave
+import TreeIndex
+import TreeNote as tn
+
+
+# Number of changed branch ids sent along with a change notification, the count covers the rest.
+NOTIFY_BRANCHES = 20
+
+
+class SharedLock:
+    """:
+        Lock that many readers can hold at once, or one writer alone. A waiting writer keeps new readers out, so
+        a steady stream of readers cannot starve it.
+
+        acquire() and release() take it for writing, so it can stand in for the RLock of an Autosaver, and like an
+        RLock the writing thread may take it again. A thread holding it for writing may also take it for reading.
+        """
+
+    def __init__(self):
+        self.condition = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writer = None  # Ident of the thread holding it for writing
+        self.depth = 0  # Number of times the writer took it
+        self.waiting = 0  # Number of writers waiting for it
+
+    def acquire(self) -> bool:
+        me = threading.get_ident()
+        with self.condition:
+            if self.writer == me:
+                self.depth += 1
+                return True
+            self.waiting += 1
+            while self.writer is not None or self.readers != 0:
+                self.condition.wait()
+            self.waiting -= 1
+            self.writer = me
+            self.depth = 1
+        return True
+
+    def release(self) -> None:
+        with self.condition:
+            self.depth -= 1
+            if self.depth == 0:
+                self.writer = None
+                self.condition.notify_all()
+
+    def acquire_shared(self) -> None:
+        with self.condition:
+            if self.writer == threading.get_ident():
+                self.depth += 1
+                return
+            while self.writer is not None or self.waiting != 0:
+                self.condition.wait()
+            self.readers += 1
+
+    def release_shared(self) -> None:
+        if self.writer == threading.get_ident():
+            self.release()
+            return
+        with self.condition:
+            self.readers -= 1
+            if self.readers == 0:
+                self.condition.notify_all()
+
+    def __enter__(self) -> 'SharedLock':
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
+
+    @contextlib.contextmanager
+    def shared(self):
+        self.acquire_shared()
+        try:
+            yield self
+        finally:
+            self.release_shared()
+
+
+class SessionOutput(io.TextIOBase):
+    """Stands in for sys.stdout while serving: what a session prints goes to its own buffer, the rest to stdout."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def target(self):
+        buffer = getattr(self.local, "buffer", None)
+        return self.stream if buffer is None else buffer
+
+    def capture(self, buffer: io.StringIO) -> None:
+        """Sends what the calling thread prints to buffer, None sends it to stdout again."""
+        self.local.buffer = buffer
+
+    def write(self, text: str) -> int:
+        return self.target().write(text)
+
+    def flush(self) -> None:
+        self.target().flush()
+
+    def isatty(self) -> bool:
+        return self.target() is self.stream and self.stream.isatty()
+
+
+class ChangeLog(TreeIndex.Observer):
+    """Collects the ids of the branches one command changed, for the notification sent to the other clients."""
+
+    def __init__(self):
+        self.changes = list()
+
+    def notify(self, event: str, prj, *args) -> None:
+        self.changes.append(prj.id)
+
+    def take(self) -> list:
+        changes = self.changes
+        self.changes = list()
+        return changes
+
+
+class Connection(socketserver.StreamRequestHandler):
+    """:
+        One client of a NotebookServer. Every line it sends is a JSON request {"line": command line}, every request
+        gets one JSON response {"output": printed text, "error": message or null, "stop": true after quit}.
+        Notifications {"notify": {...}} about the changes other clients made may arrive between responses.
+        """
+
+    def setup(self) -> None:
+        socketserver.StreamRequestHandler.setup(self)
+        self.send_lock = threading.Lock()
+        self.client = None
+
+    def handle(self) -> None:
+        self.client = self.server.connect(self)
+        session = self.server.new_session(self.server, self.client)
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                command = request["line"]
+            except (ValueError, KeyError, TypeError):
+                self.send({"output": str(), "error": "not a request", "stop": False})
+                continue
+            output, error, stop = self.server.run(session, command)
+            self.send({"output": output, "error": error, "stop": stop})
+            if stop:
+                break
+
+    def finish(self) -> None:
+        self.server.disconnect(self.client)
+        socketserver.StreamRequestHandler.finish(self)
+
+    def send(self, message: dict) -> None:
+        data = (json.dumps(message) + "\n").encode("utf-8")
+        with self.send_lock:
+            self.wfile.write(data)
+            self.wfile.flush()
+
+
+class NotebookServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """:
+        Keeps one notebook in memory and serves it to any number of clients over a Unix domain socket, so the tree
+        is loaded once and every client sees the others' changes instead of overwriting them on save.
+
+        Every client runs its commands in its own session, made by new_session(server, client number), with its own
+        current branch. A session takes reading() for commands that only look at the tree, which any number of
+        sessions may run at once, and writing() for the ones that change it, which run one at a time. When a write
+        changed the tree, the other clients are notified. The notebook is saved in the background by an Autosaver.
+        """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, filepath: str, new_session, interval: float = 0):
+        """:
+            Args:
+                socket_path (str): Path of the Unix socket to listen on.
+                filepath (str): The notebook file, loaded if it exists and saved to.
+                new_session (callable): Takes the server and a client number, returns an object whose run(line)
+                    runs one command line and returns True once the client quits.
+                interval (float, optional): Seconds between autosaves, 0 to save only on close. Defaults to 0.
+            """
+        self.filepath = os.path.abspath(filepath)
+        if os.path.exists(self.filepath):
+            self.top = tn.load(self.filepath)
+            if not self.top.notebook.paged:
+                # Built now, so that queries only read them.
+                for name in list(self.top.notebook.stale_indexes):
+                    self.top.notebook.get_index(name)
+        else:
+            self.top = tn.Project("Notes", -1, None)
+        self.top.notebook.start_history()
+        self.new_session = new_session
+        self.lock = SharedLock()
+        self.change_log = ChangeLog()
+        self.top.notebook.add_observer(self.change_log)
+        self.autosave = TreeAutosave.Autosaver(self.lock, lambda: (self.top, self.filepath))
+        self.clients = dict()  # client number -> Connection
+        self.clients_lock = threading.Lock()
+        self.next_client = 1
+        self.socket_path = socket_path
+        remove_stale_socket(socket_path)
+        socketserver.UnixStreamServer.__init__(self, socket_path, Connection)
+        self.output = SessionOutput(sys.stdout)
+        sys.stdout = self.output
+        self.autosave.start(interval)
+
+    def close(self) -> None:
+        """Stops listening, saves the notebook and removes the socket."""
+        self.server_close()
+        self.autosave.stop(save=False)
+        self.autosave.save()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        if sys.stdout is self.output:
+            sys.stdout = self.output.stream
+
+    def connect(self, connection: Connection) -> int:
+        with self.clients_lock:
+            client = self.next_client
+            self.next_client += 1
+            self.clients[client] = connection
+        return client
+
+    def disconnect(self, client: int) -> None:
+        with self.clients_lock:
+            self.clients.pop(client, None)
+
+    def reading(self):
+        """:
+            Held while a session only looks at the tree. A paged tree loads branches as they are read and an index
+            still to be built is built by the first query, so then it is written.
+            """
+        notebook = self.top.notebook
+        if notebook.paged or len(notebook.stale_indexes) != 0:
+            return self.writing(None, None)
+        return self.lock.shared()
+
+    @contextlib.contextmanager
+    def writing(self, client: int, line: str):
+        """Held while a session may change the tree, then the other clients are told what changed."""
+        self.lock.acquire()
+        try:
+            yield self
+        finally:
+            changes = self.change_log.take()
+            self.lock.release()
+            if len(changes) != 0:
+                self.broadcast(client, line, changes)
+
+    def broadcast(self, client: int, line: str, changes: list) -> None:
+        notification = {"notify": {
+            "client": client,
+            "line": line,
+            "changes": len(changes),
+            "branches": list(dict.fromkeys(changes))[0: NOTIFY_BRANCHES]
+        }}
+        with self.clients_lock:
+            others = [connection for number, connection in self.clients.items() if number != client]
+        for connection in others:
+            try:
+                connection.send(notification)
+            except OSError:
+                # The client is going away, its handler disconnects it.
+                pass
+
+    def run(self, session, line: str) -> tuple:
+        """:
+            Runs one command line of a session, capturing what it prints.
+
+            Returns:
+                tuple: (printed text, error message or None, True if the client quit).
+            """
+        buffer = io.StringIO()
+        self.output.capture(buffer)
+        error = None
+        stop = False
+        try:
+            stop = bool(session.run(line))
+        except Exception as exception:
+            error = str(exception) or type(exception).__name__
+        finally:
+            self.output.capture(None)
+        return buffer.getvalue(), error, stop
+
+
+def remove_stale_socket(socket_path: str) -> None:
+    """Removes a socket file left behind by a server that is gone, raises OSError if a server still listens on it."""
+    if not os.path.exists(socket_path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except OSError:
+        os.unlink(socket_path)
+        return
+    finally:
+        probe.close()
+    raise OSError("a server is already running at " + socket_path)
+
+
+class Client:
+    """:
+        Connection to a NotebookServer. Responses are read on a thread of their own, so notifications about the
+        changes of other clients are handed to on_notify as soon as they arrive.
+        """
+
+    def __init__(self, socket_path: str, on_notify=None):
+        """:
+            Args:
+                socket_path (str): Path of the server's Unix socket.
+                on_notify (callable, optional): Called on the reading thread with every notification dict,
+                    see NotebookServer.broadcast(). Defaults to None.
+            """
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(socket_path)
+        self.rfile = self.socket.makefile("rb")
+        self.wfile = self.socket.makefile("wb")
+        self.on_notify = on_notify
+        self.responses = queue.Queue()
+        self.thread = threading.Thread(target=self.__read, name="client", daemon=True)
+        self.thread.start()
+
+    def run(self, line: str) -> dict:
+        """:
+            Runs a command line on the server.
+
+            Returns:
+                dict: The response, with the "output", "error" and "stop" of the command.
+
+            Raises:
+                ConnectionError: The server closed the connection.
+            """
+        self.wfile.write((json.dumps({"line": line}) + "\n").encode("utf-8"))
+        self.wfile.flush()
+        response = self.responses.get()
+        if response is None:
+            raise ConnectionError("the server closed the connection")
+        return response
+
+    def close(self) -> None:
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.wfile.close()
+        self.rfile.close()
+        self.socket.close()
+
+    def __read(self) -> None:
+        try:
+            for line in self.rfile:
+                message = json.loads(line)
+                if "notify" in message:
+                    if self.on_notify is not None:
+                        self.on_notify(message["notify"])
+                else:
+                    self.responses.put(message)
+        except (OSError, ValueError):
+            pass
+        self.responses.put(None)
@@ -0,0 +1,107 @@
+import json
+import time
+from collections import deque
+
+
+# Number of most recent samples kept per command and per part.
+WINDOW = 1000
+# Parts of a command that are timed on their own, whatever is left is time spent on the tree itself.
+PARTS = ("render", "persistence")
+
+
+def percentile(samples: list, fraction: float) -> float:
+    """Returns the sample below which the given fraction of the sorted samples lies."""
+    if len(samples) == 0:
+        return 0.0
+    return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+class Timer:
+    """Adds the time spent in a with-block to one part of the command being timed."""
+
+    def __init__(self, stats: 'Stats', part: str):
+        self.stats = stats
+        self.part = part
+        self.start = 0.0
+
+    def __enter__(self) -> 'Timer':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stats.add_part(self.part, time.perf_counter() - self.start)
+
+
+class Stats:
+    """:
+        Rolling latency samples of the CLI's commands, split into rendering, persistence and time spent on the tree.
+        Only the last WINDOW samples of each are kept, so memory stays bounded however long the session runs.
+        """
+
+    def __init__(self):
+        self.commands = dict()  # command name -> deque of seconds
+        self.parts = {part: deque(maxlen=WINDOW) for part in PARTS + ("tree",)}
+        self.command = None
+        self.start = 0.0
+        self.current_parts = dict()
+
+    def begin(self, command: str) -> None:
+        self.command = command
+        self.current_parts = dict()
+        self.start = time.perf_counter()
+
+    def end(self) -> None:
+        if self.command is None:
+            return
+        elapsed = time.perf_counter() - self.start
+        self.commands.setdefault(self.command, deque(maxlen=WINDOW)).append(elapsed)
+        for part in PARTS:
+            if part in self.current_parts:
+                self.parts[part].append(self.current_parts[part])
+        self.parts["tree"].append(max(0.0, elapsed - sum(self.current_parts.values())))
+        self.command = None
+
+    def timer(self, part: str) -> Timer:
+        return Timer(self, part)
+
+    def add_part(self, part: str, seconds: float) -> None:
+        self.current_parts[part] = self.current_parts.get(part, 0.0) + seconds
+
+    def reset(self) -> None:
+        self.__init__()
+
+    def summary(self) -> dict:
+        """:
+            Returns the count, median, 95th percentile and maximum in seconds of every command and every part.
+
+            Returns:
+                dict: {"commands": {name: {...}}, "parts": {name: {...}}}
+            """
+        def summarize(samples) -> dict:
+            ordered = sorted(samples)
+            return {
+                "count": len(ordered),
+                "p50": percentile(ordered, 0.5),
+                "p95": percentile(ordered, 0.95),
+                "max": ordered[-1] if len(ordered) != 0 else 0.0
+            }
+        return {
+            "commands": {name: summarize(samples) for name, samples in sorted(self.commands.items())},
+            "parts": {name: summarize(samples) for name, samples in self.parts.items() if len(samples) != 0}
+        }
+
+    def __str__(self) -> str:
+        summary = self.summary()
+        lines = ["{:<16}{:>8}{:>12}{:>12}{:>12}".format("", "count", "p50 ms", "p95 ms", "max ms")]
+        for title in ("commands", "parts"):
+            lines.append(title + ":")
+            for name, row in summary[title].items():
+                lines.append("{:<16}{:>8}{:>12.2f}{:>12.2f}{:>12.2f}".format(
+                    name, row["count"], row["p50"] * 1000, row["p95"] * 1000, row["max"] * 1000))
+        return "\n".join(lines)
+
+    def export(self, filepath: str) -> None:
+        """Writes the summary to a JSON file."""
+        file = open(filepath, "w")
+        json.dump(self.summary(), file, indent=2)
+        file.close()
@@ -0,0 +1,601 @@
+import array
+import copy
+import itertools
+import tracemalloc
+import datetime
+import weakref
+import TreeDate
+import TreeIndex
+import TreeNote as tn
+import TreeWalk
+
+
+NONE = -1
+# The priorities as strings, shared by every branch that is asked for its priority.
+PRIORITIES = tuple(str(priority) for priority in range(7))
+
+
+class TreeStore:
+    """:
+        Compact struct-of-arrays storage for a whole tree.
+
+        Branches are integer ids into array-backed columns holding the links and numbers of every branch, dates are
+        day ordinals (0 for none), titles and descriptions are ids into one string table and tags are masks of the
+        ids in the notebook's tag table.
+        StoredProject wraps an id in the Project interface, so the CLI can work on a store like on a Project tree.
+        The notebook's indexes keep the ids of a store's branches rather than StoredProjects, and a store builds each
+        of them only once it is queried.
+        """
+
+    def __init__(self):
+        self.parent = array.array("i")
+        self.first_child = array.array("i")
+        self.last_child = array.array("i")
+        self.next_sibling = array.array("i")
+        self.prev_sibling = array.array("i")
+        self.layer = array.array("i")
+        self.priority = array.array("b")
+        self.title = array.array("i")
+        self.description = array.array("i")
+        self.date = array.array("i")  # datetime.date.toordinal(), 0 for no date
+        self.ordinal_dates = True
+        self.strings = [str()]
+        self.free_strings = list()
+        self.node_tags = dict()  # Only tagged branches have an entry: id -> mask of tag ids
+        self.notebook = tn.Notebook()
+        self.notebook.stale_indexes.update(self.notebook.indexes)
+        self.branches = weakref.WeakValueDictionary()
+
+    def __len__(self) -> int:
+        return len(self.parent)
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state["branches"]
+        # The notebook's top is a StoredProject, which would be loaded as a copy the store does not know, tn.load() sets
+        # it. The indexes are not saved, they are built again when queried.
+        notebook = state["notebook"] = copy.copy(self.notebook)
+        notebook.indexes = TreeIndex.new_indexes()
+        notebook.top = None
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.branches = weakref.WeakValueDictionary()
+        self.notebook.stale_indexes.update(self.notebook.indexes)
+        if not state.get("ordinal_dates", False):
+            # Stores pickled while dates were strings hold string ids in the date column.
+            dates = list()
+            for string_id in self.date:
+                date = TreeDate.as_date(self.strings[string_id] or None)
+                dates.append(0 if date is None else date.toordinal())
+            self.date = array.array("i", dates)
+            self.ordinal_dates = True
+        if "tag_names" in state:
+            # Stores pickled before the notebook interned tags hold tuples of ids into a tag table of their own.
+            tag_names = state["tag_names"]
+            for node, tag_ids in self.node_tags.items():
+                self.node_tags[node] = self.notebook.tag_mask(tag_names[tag_id] for tag_id in tag_ids)
+            del self.tag_names, self.tag_ids
+            self.notebook.stale_indexes.update(("tags", "totals"))
+        self.notebook.interned_tags = True
+
+    def add_string(self, text: str) -> int:
+        """:
+            Adds a string to the string table and returns its id.
+            Only the empty string (id 0) is shared, a dict to find equal strings would cost more than it saves.
+            """
+        if len(text) == 0:
+            return 0
+        if len(self.free_strings) != 0:
+            string_id = self.free_strings.pop()
+            self.strings[string_id] = text
+            return string_id
+        self.strings.append(text)
+        return len(self.strings) - 1
+
+    def set_string(self, column: array.array, node: int, text: str) -> None:
+        """Sets the string of a branch in a string id column, reusing the branch's slot in the string table."""
+        string_id = column[node]
+        if string_id == 0:
+            column[node] = self.add_string(text)
+        elif len(text) == 0:
+            self.strings[string_id] = None
+            self.free_strings.append(string_id)
+            column[node] = 0
+        else:
+            self.strings[string_id] = text
+
+    def branch(self, node: int) -> 'StoredProject':
+        """Returns the StoredProject of a branch id, the same object as long as someone holds on to it."""
+        if node == NONE:
+            return None
+        branch = self.branches.get(node)
+        if branch is None:
+            branch = StoredProject(self, node)
+            self.branches[node] = branch
+        return branch
+
+    def new_node(self, parent: int, title: str, node: int = None) -> int:
+        """:
+            Adds a branch as the last subproject of parent. Its priority is inherited from the parent.
+
+            Args:
+                parent (int): Id of the parent branch, NONE for a top branch.
+                title (str): Title of the new branch.
+                node (int, optional): Id to give the branch, used when replaying a journal. Defaults to the next id.
+
+            Returns:
+                int: Id of the new branch.
+            """
+        if node is None:
+            node = len(self)
+        reused = node < len(self)
+        while len(self) <= node:
+            for column in (self.parent, self.first_child, self.last_child, self.next_sibling, self.prev_sibling):
+                column.append(NONE)
+            for column in (self.layer, self.priority, self.title, self.description, self.date):
+                column.append(0)
+        self.notebook.claim_id(node)
+        if reused:
+            # A branch that was cut, given its id again when a journal replays the paste: its old subtree is dropped.
+            self.first_child[node] = NONE
+            self.last_child[node] = NONE
+            self.set_string(self.title, node, title)
+        else:
+            self.title[node] = self.add_string(title)
+        if parent != NONE:
+            self.layer[node] = self.layer[parent] + 1
+            self.priority[node] = self.priority[parent]
+            self.link(parent, node, self.last_child[parent])
+        return node
+
+    def link(self, parent: int, node: int, after: int) -> None:
+        """Inserts a detached branch among the subprojects of parent, right after the sibling after (NONE: first)."""
+        self.parent[node] = parent
+        self.prev_sibling[node] = after
+        if after == NONE:
+            following = self.first_child[parent]
+            self.first_child[parent] = node
+        else:
+            following = self.next_sibling[after]
+            self.next_sibling[after] = node
+        self.next_sibling[node] = following
+        if following == NONE:
+            self.last_child[parent] = node
+        else:
+            self.prev_sibling[following] = node
+
+    def unlink(self, node: int) -> None:
+        """Removes a branch from its parent's subprojects, the branch keeps its own subtree."""
+        parent = self.parent[node]
+        previous = self.prev_sibling[node]
+        following = self.next_sibling[node]
+        if previous == NONE:
+            self.first_child[parent] = following
+        else:
+            self.next_sibling[previous] = following
+        if following == NONE:
+            self.last_child[parent] = previous
+        else:
+            self.prev_sibling[following] = previous
+        self.next_sibling[node] = NONE
+        self.prev_sibling[node] = NONE
+
+    def children(self, node: int):
+        child = self.first_child[node]
+        while child != NONE:
+            yield child
+            child = self.next_sibling[child]
+
+    def subtree(self, node: int):
+        """Yields the ids of a branch and every branch below it, parents first."""
+        stack = [node]
+        while len(stack) != 0:
+            node = stack.pop()
+            yield node
+            child = self.last_child[node]
+            while child != NONE:
+                stack.append(child)
+                child = self.prev_sibling[child]
+
+
+class StoredProject:
+    """A branch of a TreeStore, offering the same methods and attributes as a Project."""
+
+    __slots__ = ("store", "id", "position", "__weakref__")
+
+    def __init__(self, store: TreeStore, node: int):
+        self.store = store
+        self.id = node
+        self.position = None  # Index among the parent's subprojects when last detached or inserted, None if appended
+
+    def __setstate__(self, state: tuple) -> None:
+        # The top branch is pickled with the store, it has to be the one the store hands out for its id.
+        for name, value in state[1].items():
+            setattr(self, name, value)
+        self.store.branches[self.id] = self
+
+    # Reading is shared with Project, it only goes through the attributes below.
+    get_id = tn.Project.get_id
+    get_title = tn.Project.get_title
+    get_layer = tn.Project.get_layer
+    get_description = tn.Project.get_description
+    get_parent = tn.Project.get_parent
+    get_subprojects = tn.Project.get_subprojects
+    get_priority = tn.Project.get_priority
+    get_tags = tn.Project.get_tags
+    get_date = tn.Project.get_date
+    get_totals = tn.Project.get_totals
+    get_priority_text_color = tn.Project.get_priority_text_color
+    get_layer_prefix = tn.Project.get_layer_prefix
+    get_layer_description_spacing = tn.Project.get_layer_description_spacing
+    walk_tree = tn.Project.walk_tree
+    do_recursive = tn.Project.do_recursive
+    __str_subprojects__ = tn.Project.__str_subprojects__
+    __str_tree__ = tn.Project.__str_tree__
+    __str_f__ = tn.Project.__str_f__
+    __str__ = tn.Project.__str__
+
+    @property
+    def notebook(self) -> tn.Notebook:
+        return self.store.notebook
+
+    @property
+    def title(self) -> str:
+        return self.store.strings[self.store.title[self.id]]
+
+    @property
+    def layer(self) -> int:
+        return self.store.layer[self.id]
+
+    @layer.setter
+    def layer(self, layer: int) -> None:
+        self.store.layer[self.id] = layer
+
+    @property
+    def parent(self) -> 'StoredProject':
+        return self.store.branch(self.store.parent[self.id])
+
+    @property
+    def subprojects(self) -> list:
+        """A new list of the subprojects, changing the list does not change the tree."""
+        return [self.store.branch(child) for child in self.store.children(self.id)]
+
+    @property
+    def description(self) -> str:
+        return self.store.strings[self.store.description[self.id]]
+
+    @description.setter
+    def description(self, description: str) -> None:
+        self.store.set_string(self.store.description, self.id, description)
+
+    @property
+    def tag_mask(self) -> int:
+        return self.store.node_tags.get(self.id, 0)
+
+    @property
+    def tags(self) -> set:
+        """A new set of the tag names, use set_tag and unset_tag to change them."""
+        return self.notebook.tag_table.names_of(self.tag_mask)
+
+    @tags.setter
+    def tags(self, tags) -> None:
+        """Sets the tags from a set of names, or from a mask."""
+        mask = self.notebook.tag_mask(tags)
+        if mask == 0:
+            self.store.node_tags.pop(self.id, None)
+        else:
+            self.store.node_tags[self.id] = mask
+
+    @property
+    def date(self) -> datetime.date:
+        ordinal = self.store.date[self.id]
+        if ordinal == 0:
+            return None
+        return datetime.date.fromordinal(ordinal)
+
+    @date.setter
+    def date(self, date: datetime.date) -> None:
+        self.store.date[self.id] = 0 if date is None else date.toordinal()
+
+    @property
+    def priority(self) -> str:
+        priority = self.store.priority[self.id]
+        return PRIORITIES[priority] if 0 <= priority < len(PRIORITIES) else str(priority)
+
+    @priority.setter
+    def priority(self, priority: str) -> None:
+        self.store.priority[self.id] = int(priority)
+
+    def set_description(self, description: str) -> None:
+        self.notebook.remember(self)
+        if len(description) == 0:
+            # No spacing either, like Project.set_description, so undoing a description leaves the branch as it was.
+            self.description = description
+        else:
+            self.description = str().join([" "] * (self.layer * 4)) + description
+        self.notebook.notify("set_description", self, description)
+
+    restore_description = tn.Project.restore_description
+
+    def set_tag(self, tag) -> None:
+        tag_id = self.notebook.intern_tag(tag)
+        self.notebook.remember(self)
+        self.store.node_tags[self.id] = self.tag_mask | 1 << tag_id
+        self.notebook.notify("set_tag", self, tag_id)
+
+    def unset_tag(self, tag) -> None:
+        tag_id = self.notebook.tag_table.lookup(tag) if type(tag) is str else tag
+        if tag_id is not None and self.tag_mask >> tag_id & 1:
+            self.notebook.remember(self)
+            self.tags = self.tag_mask & ~(1 << tag_id)
+            self.notebook.notify("unset_tag", self, tag_id)
+
+    # A store keeps no rules, so what a rule would set is stamped on every branch below.
+    tag_rules = None
+    priority_rule = None
+
+    def get_own_tags(self) -> int:
+        return self.tag_mask
+
+    def get_stamps(self) -> tuple:
+        return None
+
+    def _load_stamps(self, stamps: tuple) -> None:
+        pass
+
+    def get_marks(self) -> tuple:
+        return self.tag_mask, self.priority, None
+
+    def set_marks(self, tags: int, priority: str, stamps: tuple) -> None:
+        self.notebook.remember(self)
+        self.tags = tags
+        self.priority = priority
+        self.notebook.notify("set_marks", self, tags, priority, stamps)
+
+    def _merge_tag(self, tag: int, into: int) -> None:
+        mask = self.tag_mask
+        if mask >> tag & 1:
+            self.tags = mask & ~(1 << tag) | 1 << into
+
+    def set_tag_below(self, tag) -> None:
+        for branch in TreeWalk.pre_order(self):
+            branch.set_tag(tag)
+
+    def unset_tag_below(self, tag) -> None:
+        for branch in TreeWalk.pre_order(self):
+            branch.unset_tag(tag)
+
+    def set_date(self, date) -> None:
+        if isinstance(date, str):
+            date = TreeDate.parse_date(date)
+        self.notebook.remember(self)
+        self.date = date
+        self.notebook.notify("set_date", self, date)
+
+    def set_priority(self, priority: str) -> None:
+        priority = tn.clamp_priority(priority)
+        self.notebook.remember(self)
+        self.priority = priority
+        self.notebook.notify("set_priority", self, priority)
+
+    def set_priority_below(self, priority: str) -> None:
+        for branch in TreeWalk.pre_order(self):
+            branch.set_priority(priority)
+
+    def clear_project(self) -> 'StoredProject':
+        parent_project = self.parent
+        self._detach()
+        self.notebook.notify("clear_project", self, parent_project)
+        return parent_project
+
+    def _position(self) -> int:
+        """Returns the index of the branch among its parent's subprojects, counting the siblings before it."""
+        store = self.store
+        position = 0
+        sibling = store.prev_sibling[self.id]
+        while sibling != NONE:
+            position += 1
+            sibling = store.prev_sibling[sibling]
+        return position
+
+    def _detach(self) -> int:
+        """Removes the branch from its parent's subprojects without notifying observers, returns its old position."""
+        self.position = self._position()
+        self.store.unlink(self.id)
+        return self.position
+
+    def _insert_into(self, parent: 'StoredProject', position: int) -> None:
+        store = self.store
+        after = NONE
+        for after in itertools.islice(store.children(parent.id), position):
+            pass
+        store.link(parent.id, self.id, after)
+        self.position = position
+
+    def _new_subproject(self, title: str, prj_id: int = None) -> 'StoredProject':
+        return self.store.branch(self.store.new_node(self.id, title, prj_id))
+
+    def def_subproject(self, title: str) -> 'StoredProject':
+        sub_project = self._new_subproject(title.title())
+        self.notebook.notify("def_subproject", self, sub_project)
+        return sub_project
+
+    def paste_subproject(self, prj, position: int = None) -> 'StoredProject':
+        """:
+            Nests a branch below this one. A branch of another tree, StoredProject or Project, is copied into this store.
+
+            Args:
+                prj (Project): The branch to paste.
+                position (int, optional): Index among the subprojects to paste it at, None for after the last one.
+
+            Returns:
+                StoredProject: The pasted branch.
+            """
+        store = self.store
+        if isinstance(prj, StoredProject) and prj.store is store:
+            layer_shift = self.layer + 1 - prj.layer
+            merged = self.notebook.tag_table.merged
+            for node in store.subtree(prj.id):
+                store.layer[node] += layer_shift
+                for tag, into in merged.items():
+                    store.branch(node)._merge_tag(tag, into)
+            store.link(self.id, prj.id, store.last_child[self.id])
+        else:
+            prj = copy_subtree(prj, self)
+        if position is None:
+            prj.position = None
+        else:
+            # Appended above, then moved to its place.
+            store.unlink(prj.id)
+            prj._insert_into(self, position)
+        self.notebook.notify("paste_subproject", self, prj)
+        return prj
+
+    def move_laterally(self, direction: int) -> 'StoredProject':
+        """:
+            Swaps a branch with its previous (direction < 0) or next (direction > 0) sibling.
+
+            Returns:
+                StoredProject: The parent of the branch that has been moved.
+            """
+        if direction == 0:
+            return
+        direction = int(abs(direction) / direction)
+        store = self.store
+        if store.parent[self.id] == NONE:
+            return
+        if direction < 0:
+            anchor = store.prev_sibling[self.id]
+            if anchor == NONE:
+                return self.parent
+            after = store.prev_sibling[anchor]
+        else:
+            after = store.next_sibling[self.id]
+            if after == NONE:
+                return self.parent
+        if self.notebook.history is not None:
+            # Counting the siblings before it is left out when there is nothing to undo.
+            self.notebook.remember(self, self._position())
+        store.unlink(self.id)
+        store.link(store.parent[self.id], self.id, after)
+        self.notebook.notify("move_laterally", self, direction)
+        return self.parent
+
+    def move_vertically(self, direction: int) -> None:
+        if direction == 0:
+            return
+        direction = int(abs(direction) / direction)
+        store = self.store
+        if direction > 0 and (self.parent is None or self.parent.parent is None):
+            return
+        elif direction < 0 and self.parent is None:
+            return
+        parent = {1: self.parent.parent, -1: self.parent}.get(direction)
+        blank_branch = parent._new_subproject("")
+        store.unlink(self.id)
+        store.link(blank_branch.id, self.id, NONE)
+        self.notebook.notify("move_vertically", self, direction)
+
+    def __eq__(self, o: object) -> bool:
+        return isinstance(o, StoredProject) and o.store is self.store and o.id == self.id
+
+    def __hash__(self) -> int:
+        return hash((id(self.store), self.id))
+
+
+def copy_subtree(prj, parent: StoredProject) -> StoredProject:
+    """:
+        Copies a subtree of any Project-like branches below a branch of a store, without notifying observers.
+
+        Returns:
+            StoredProject: The copy of prj.
+        """
+    store = parent.store
+    copies = dict()
+    top = None
+    for branch in TreeWalk.pre_order(prj):
+        owner = parent.id if top is None else copies[branch.parent.id]
+        node = store.new_node(owner, branch.title)
+        copies[branch.id] = node
+        copy = store.branch(node)
+        copy.description = branch.description
+        copy.tags = branch.tags
+        copy.date = branch.date
+        copy.priority = branch.priority
+        if top is None:
+            top = copy
+    return top
+
+
+def main() -> StoredProject:
+    """Same as TreeNote.main() but the returned top branch is kept in a TreeStore."""
+    tn.init()
+    return new_tree("Notes", -1)
+
+
+def new_tree(title: str, layer: int) -> StoredProject:
+    store = TreeStore()
+    top = store.branch(store.new_node(NONE, title))
+    top.layer = layer
+    store.notebook.set_top(top)
+    return top
+
+
+def from_project(prj) -> StoredProject:
+    """Copies a tree of Project objects into a new TreeStore and returns its top branch."""
+    top = new_tree(prj.title, prj.layer)
+    top.description = prj.description
+    top.tags = prj.tags
+    top.date = prj.date
+    top.priority = prj.priority
+    for subproject in prj.subprojects:
+        copy_subtree(subproject, top)
+    return top
+
+
+def compare_memory(branch_count: int = 100000, fan_out: int = 8) -> dict:
+    """:
+        Builds the same tree as Project objects and as a TreeStore and measures the memory both hold. The store is
+        measured again once every index was built, as they are by the first queries.
+
+        Args:
+            branch_count (int, optional): Number of branches in the tree. Defaults to 100000.
+            fan_out (int, optional): Number of subprojects per branch. Defaults to 8.
+
+        Returns:
+            dict: Bytes held by "project", "store" and "indexed store", as reported by tracemalloc.
+        """
+    def build(top):
+        branches = [top]
+        for i in range(1, branch_count):
+            branch = branches[(i - 1) // fan_out].def_subproject("branch " + str(i))
+            branch.set_description("description of branch " + str(i))
+            if i % 3 == 0:
+                branch.set_tag("tag" + str(i % 10))
+            branches.append(branch)
+        return top
+
+    result = dict()
+    for name, new_top in (("project", lambda: tn.Project("Notes", -1, None)), ("store", lambda: new_tree("Notes", -1))):
+        tracemalloc.start()
+        top = build(new_top())
+        result[name] = tracemalloc.get_traced_memory()[0]
+        if name == "store":
+            for index_name in top.notebook.indexes:
+                top.notebook.get_index(index_name)
+            result["indexed store"] = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del top
+    return result
+
+
+if __name__ == "__main__":
+    for size in (1000, 10000, 100000):
+        memory = compare_memory(size)
+        print(size, "branches:",
+              "project", memory["project"] // 1024, "KiB,",
+              "store", memory["store"] // 1024, "KiB,",
+              "ratio", round(memory["project"] / memory["store"], 1), "-",
+              "indexed store", memory["indexed store"] // 1024, "KiB")
@@ -0,0 +1,86 @@
+def bits(mask: int):
+    """Yields the tag ids set in a mask, lowest first, one step per set bit rather than per bit of the mask."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class TagTable:
+    """:
+        The tag names of a notebook, each interned once as a small int id. A branch keeps its tags as an int mask with
+        bit 1 << id set for each of them, so testing, combining and counting tags are bitwise operations and a branch
+        holds no set of strings. Renaming a tag changes one name here, the masks stay as they are.
+        """
+
+    def __init__(self, names: list = None):
+        self.names = list() if names is None else list(names)  # id -> name, None for the id of a tag merged away
+        self.ids = {name: tag_id for tag_id, name in enumerate(self.names) if name is not None}
+        self.joined = dict()  # mask -> its names as get_tags() prints them
+        self.merged = dict()  # id of a tag merged away -> id of the tag it was merged into
+
+    def __getstate__(self) -> dict:
+        # ids and the joined strings are worked out again from the names.
+        return {"names": self.names, "merged": self.merged}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state["names"])
+        self.merged = state.get("merged", dict())
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def lookup(self, name: str) -> int:
+        """Returns the id of a tag name, None if no branch was ever given the tag."""
+        return self.ids.get(name)
+
+    def add(self, name: str) -> int:
+        """Interns a new tag name and returns its id, see Notebook.intern_tag()."""
+        tag_id = len(self.names)
+        self.names.append(name)
+        self.ids[name] = tag_id
+        return tag_id
+
+    def name(self, tag_id: int) -> str:
+        return self.names[tag_id]
+
+    def names_of(self, mask: int) -> set:
+        """Returns a new set of the names of the tags in a mask."""
+        names = self.names
+        return {names[tag_id] for tag_id in bits(mask)}
+
+    def mask(self, names) -> int:
+        """Returns the mask of the tag names that are interned, leaving out the ones that are not."""
+        mask = 0
+        for name in names:
+            tag_id = self.ids.get(name)
+            if tag_id is not None:
+                mask |= 1 << tag_id
+        return mask
+
+    def join(self, mask: int) -> str:
+        """Returns the names of the tags in a mask, sorted and joined by commas, made once per different mask."""
+        joined = self.joined.get(mask)
+        if joined is None:
+            joined = self.joined[mask] = ", ".join(sorted(self.names_of(mask)))
+        return joined
+
+    def rename(self, tag_id: int, name: str) -> None:
+        """Gives a tag a name no other tag has."""
+        del self.ids[self.names[tag_id]]
+        self.names[tag_id] = name
+        self.ids[name] = tag_id
+        self.joined = dict()
+
+    def merge(self, tag_id: int, into: int) -> None:
+        """:
+            Drops a tag whose branches were given another one instead, its id is not handed out again.
+            Branches that were cut from the tree at the time still carry it, they are given the other tag when pasted.
+            """
+        del self.ids[self.names[tag_id]]
+        self.names[tag_id] = None
+        for merged, target in self.merged.items():
+            if target == tag_id:
+                self.merged[merged] = into
+        self.merged[tag_id] = into
+        self.joined = dict()
@@ -0,0 +1,189 @@
+from collections import deque
+import TreeIndex
+import TreeWalk
+
+
+# Number of steps kept to undo, and number of records they may hold together; the oldest steps are dropped first.
+UNDO_STEPS = 100
+UNDO_RECORDS = 100000
+
+
+class History(TreeIndex.Observer):
+    """:
+        Undo and redo stacks of the edits made to a notebook, as records of how to reverse each edit rather than
+        copies of the tree. Undoing a step costs time in the size of its edits.
+
+        Records:
+            ("cut", prj) - reverses a new or pasted branch.
+            ("paste", parent, prj, position) - reverses a cleared branch, which is held on to instead of copied.
+            ("fields", prj, description, marks, date) - reverses a setter, saved by Notebook.remember. marks are
+                the own tags and priority and the rules of the branch, see Project.get_marks().
+            ("moved", prj, position) - reverses move_laterally, saved by Notebook.remember.
+            ("marks", prj, [(branch, marks), ...]) - reverses the marks a cut or pasted subtree was given to keep,
+                saved by Notebook.remember_marks. Put back silently while the subtree is cut, the indexes do not
+                hold it then.
+            ("renamed", top, tag id, name) - reverses Notebook.rename_tag.
+
+        The records of one step are made between begin() and end(), e.g. by one CLI command. Undoing a step applies
+        its records last first through the ordinary Project methods, so observers like the journal and the indexes
+        follow, and the records those calls make become the step to redo.
+        """
+
+    def __init__(self):
+        self.undo_steps = deque()
+        self.redo_steps = deque()
+        self.records = 0  # Number of records in undo_steps
+        self.step = None  # Records of the step being made, None outside begin() and end()
+        self.replaying = False
+
+    def begin(self) -> None:
+        self.step = list()
+
+    def end(self) -> None:
+        step = self.step
+        self.step = None
+        if step is None or len(step) == 0:
+            return
+        self.redo_steps.clear()
+        self.__push(step)
+
+    def clear(self) -> None:
+        self.__init__()
+
+    def can_undo(self) -> bool:
+        return len(self.undo_steps) != 0
+
+    def can_redo(self) -> bool:
+        return len(self.redo_steps) != 0
+
+    def undo(self):
+        """:
+            Reverses the last step.
+
+            Returns:
+                Project: The branch the first edit of the step was made on, None if there is nothing to undo.
+            """
+        if not self.can_undo():
+            return None
+        step = self.undo_steps.pop()
+        self.records -= len(step)
+        branch, reverse = self.__replay(step)
+        self.redo_steps.append(reverse)
+        return branch
+
+    def redo(self):
+        """:
+            Makes the last undone step again.
+
+            Returns:
+                Project: The branch the first edit of the step was made on, None if there is nothing to redo.
+            """
+        if not self.can_redo():
+            return None
+        step = self.redo_steps.pop()
+        branch, reverse = self.__replay(step)
+        self.__push(reverse)
+        return branch
+
+    def remember(self, prj, position: int = None) -> None:
+        """Saves what a branch is like before a setter, or move_laterally if position is given, changes it."""
+        if position is not None:
+            self.__record(("moved", prj, position))
+        else:
+            self.__record(("fields", prj, prj.description, prj.get_marks(), prj.date))
+
+    def remember_marks(self, prj) -> None:
+        """Saves the marks of a subtree before Project._keep_marks() changes them."""
+        self.__record(("marks", prj, [(branch, branch.get_marks()) for branch in TreeWalk.pre_order(prj)]))
+
+    def notify(self, event: str, prj, *args) -> None:
+        if event == "def_subproject" or event == "paste_subproject":
+            self.__record(("cut", args[0]))
+        elif event == "clear_project":
+            # _detach left the index the branch had among its siblings in its position attribute.
+            self.__record(("paste", args[0], prj, prj.position))
+        elif event == "rename_tag":
+            tag_id, old = args[0: 2]
+            if prj.notebook.tag_table.name(tag_id) is None:
+                # Merged into another tag, which branches had which of the two is not kept.
+                self.clear()
+            else:
+                self.__record(("renamed", prj, tag_id, old))
+        elif event == "move_vertically":
+            # Not reversible yet: what came before cannot be undone past it.
+            self.clear()
+
+    def __record(self, record: tuple) -> None:
+        if self.step is not None:
+            self.step.append(record)
+        elif not self.replaying:
+            self.redo_steps.clear()
+            self.__push([record])
+
+    def __push(self, step: list) -> None:
+        self.undo_steps.append(step)
+        self.records += len(step)
+        while len(self.undo_steps) > 1 and (len(self.undo_steps) > UNDO_STEPS or self.records > UNDO_RECORDS):
+            self.records -= len(self.undo_steps.popleft())
+
+    def __replay(self, step: list) -> tuple:
+        """Applies the records of a step last first, returns the branch of the first one and the reversing step."""
+        outer = self.step
+        self.step = list()
+        self.replaying = True
+        branch = None
+        try:
+            for record in reversed(step):
+                branch = self.__apply(record)
+        finally:
+            reverse = self.step
+            self.step = outer
+            self.replaying = False
+        return branch, reverse
+
+    def __apply(self, record: tuple):
+        kind, prj = record[0], record[1]
+        if kind == "cut":
+            return prj.clear_project()
+        if kind == "paste":
+            parent, pasted, position = record[1:]
+            return parent.paste_subproject(pasted, position)
+        if kind == "fields":
+            description, marks, date = record[2:]
+            if prj.description != description:
+                # As it was saved, the spacing stays that of the layer the description was set at.
+                prj.restore_description(description)
+            if prj.get_marks() != marks:
+                prj.set_marks(*marks)
+            if prj.date != date:
+                prj.set_date(date)
+            return prj
+        if kind == "renamed":
+            prj.notebook.rename_tag(*record[2:])
+            return prj
+        if kind == "marks":
+            return self.__restore_marks(prj, record[2])
+        position = record[2]
+        current = prj._position()
+        if abs(current - position) == 1:
+            prj.move_laterally(position - current)
+        elif current != position:
+            parent = prj.clear_project()
+            parent.paste_subproject(prj, position)
+        return prj
+
+    def __restore_marks(self, prj, saved: list):
+        parent = prj.parent
+        cut = parent is None or not any(sibling is prj for sibling in parent.subprojects)
+        if cut:
+            # set_marks() saves what it changes, silently put back marks have to be saved here.
+            self.remember_marks(prj)
+        for branch, marks in saved:
+            if branch.get_marks() == marks:
+                continue
+            if not cut:
+                branch.set_marks(*marks)
+                continue
+            branch.tags, branch.priority = marks[0: 2]
+            branch._load_stamps(marks[2])
+        return prj
@@ -0,0 +1,126 @@
+import itertools
+import re
+import sys
+from collections import deque
+import TreeWalk
+
+
+# Terminal rows left free below the tree for the prompt and a line of command output.
+PROMPT_ROWS = 2
+ANSI_CODE = re.compile(r"(\x1b\[[0-9;?]*[A-Za-z])")
+RESET = "\x1b[0m"
+
+
+def clip(row: str, width: int) -> str:
+    """Cuts a row to the width of the terminal, not counting its ANSI codes, so it never wraps onto a second row."""
+    visible = 0
+    clipped = list()
+    for part in ANSI_CODE.split(row):
+        if ANSI_CODE.fullmatch(part):
+            clipped.append(part)
+        elif visible + len(part) > width:
+            clipped.append(part[0: width - visible] + RESET)
+            return str().join(clipped)
+        else:
+            clipped.append(part)
+            visible += len(part)
+    return str().join(clipped)
+
+
+def tree_rows(root, current, **kwargs):
+    """:
+        Lazily yields the terminal rows of the printed tree, see Project.__str_f__ for the kwargs.
+        The current branch is highlighted when it is not the root.
+
+        Yields:
+            tuple: (row, True if the row is the first one of the current branch)
+        """
+    for branch in TreeWalk.pre_order(root):
+        is_current = branch is current and branch is not root
+        text = branch.__str_f__(**dict(kwargs, highlight=is_current or kwargs.get("highlight", False)))
+        for number, row in enumerate(text.split("\n")):
+            yield row, is_current and number == 0
+
+
+class Viewport:
+    """:
+        Redraws only the part of the tree that fits the terminal, around the current branch.
+        The window scrolls as the current branch moves out of it and only the rows that changed since the last draw
+        are rewritten, using ANSI cursor movement instead of clearing the screen.
+        """
+
+    def __init__(self, stream=None):
+        self.stream = stream if stream is not None else sys.stdout
+        self.rows = None  # What is on the screen, None if unknown
+        self.offset = 0
+        self.root_id = None
+
+    def invalidate(self) -> None:
+        """Forgets what is on the screen, so the next draw repaints all of it. Call after printing anything else."""
+        self.rows = None
+
+    def draw(self, root, current, **kwargs) -> None:
+        """:
+            Draws the tree below root, scrolled so the current branch is visible.
+
+            Args:
+                root (Project): The branch the tree is printed from.
+                current (Project): The branch to keep in view.
+            """
+        # Imported on the first draw, the prompt starts without it.
+        import shutil
+        size = shutil.get_terminal_size()
+        height = max(1, size.lines - PROMPT_ROWS)
+        if root.id != self.root_id:
+            self.root_id = root.id
+            self.offset = 0
+        rows = [clip(row, size.columns) for row in self.__window(root, current, height, **kwargs)]
+        self.__write(rows)
+
+    def __window(self, root, current, height: int, **kwargs) -> list:
+        if current is root:
+            self.offset = 0
+            return [row for row, is_current in itertools.islice(tree_rows(root, current, **kwargs), height)]
+        before = deque(maxlen=height)  # The rows leading up to the current branch
+        window = list()  # The rows of the window at the last offset
+        rows = tree_rows(root, current, **kwargs)
+        current_row = 0
+        for number, (row, is_current) in enumerate(rows):
+            if is_current:
+                current_row = number
+                break
+            before.append(row)
+            if self.offset <= number < self.offset + height:
+                window.append(row)
+        else:
+            # The current branch is not below root: keep the window where it was.
+            return window
+        if current_row < self.offset:
+            self.offset = current_row
+            window = [row]
+        elif current_row >= self.offset + height:
+            self.offset = current_row - height + 1
+            before.append(row)
+            return list(before)[-height:]
+        else:
+            window.append(row)
+        for row, is_current in rows:
+            if len(window) == height:
+                break
+            window.append(row)
+        return window
+
+    def __write(self, rows: list) -> None:
+        previous = self.rows
+        out = list()
+        if previous is None:
+            out.append("\x1b[H\x1b[2J")
+            previous = list()
+        for number, row in enumerate(rows):
+            if number >= len(previous) or previous[number] != row:
+                out.append("\x1b[" + str(number + 1) + ";1H" + row + "\x1b[K")
+        # Clears what is left below the tree, like the last prompt, and leaves the cursor there for the next one.
+        out.append("\x1b[" + str(len(rows) + 1) + ";1H\x1b[J")
+        self.stream.write(str().join(out))
+        self.stream.flush()
+        self.rows = rows
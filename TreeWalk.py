@@ -0,0 +1,81 @@
+from collections import deque
+
+
+def pre_order(prj, max_depth: int = None, prune=None):
+    """:
+        Lazily yields a branch and every branch below it, parents before their subprojects.
+        Uses an explicit stack, so the depth of the tree is not limited by the interpreter's recursion limit.
+
+        Args:
+            prj (Project): The branch to start from.
+            max_depth (int, optional): Number of layers below prj to visit, None for all of them. Defaults to None.
+            prune (function, optional): Takes a Project, branches for which it returns True are skipped along with
+                their subprojects. Defaults to None.
+
+        Yields:
+            Project: The branches of the subtree.
+        """
+    stack = [(prj, 0)]
+    while len(stack) != 0:
+        branch, depth = stack.pop()
+        if prune is not None and prune(branch):
+            continue
+        yield branch
+        if max_depth is None or depth < max_depth:
+            # Subprojects are read after the branch was yielded, so changes made to them by the caller are followed.
+            stack.extend((subproject, depth + 1) for subproject in reversed(branch.subprojects))
+
+
+def post_order(prj, max_depth: int = None, prune=None):
+    """:
+        Lazily yields a branch and every branch below it, subprojects before their parents.
+
+        Args:
+            prj (Project): The branch to start from.
+            max_depth (int, optional): Number of layers below prj to visit, None for all of them. Defaults to None.
+            prune (function, optional): Takes a Project, branches for which it returns True are skipped along with
+                their subprojects. Defaults to None.
+
+        Yields:
+            Project: The branches of the subtree.
+        """
+    if prune is not None and prune(prj):
+        return
+    stack = [(prj, 0, iter(prj.subprojects))]
+    while len(stack) != 0:
+        branch, depth, subprojects = stack[-1]
+        subproject = None
+        if max_depth is None or depth < max_depth:
+            for subproject in subprojects:
+                if prune is None or not prune(subproject):
+                    break
+            else:
+                subproject = None
+        if subproject is None:
+            stack.pop()
+            yield branch
+        else:
+            stack.append((subproject, depth + 1, iter(subproject.subprojects)))
+
+
+def breadth_first(prj, max_depth: int = None, prune=None):
+    """:
+        Lazily yields a branch and every branch below it, one layer at a time.
+
+        Args:
+            prj (Project): The branch to start from.
+            max_depth (int, optional): Number of layers below prj to visit, None for all of them. Defaults to None.
+            prune (function, optional): Takes a Project, branches for which it returns True are skipped along with
+                their subprojects. Defaults to None.
+
+        Yields:
+            Project: The branches of the subtree.
+        """
+    queue = deque([(prj, 0)])
+    while len(queue) != 0:
+        branch, depth = queue.popleft()
+        if prune is not None and prune(branch):
+            continue
+        yield branch
+        if max_depth is None or depth < max_depth:
+            queue.extend((subproject, depth + 1) for subproject in branch.subprojects)
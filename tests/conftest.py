@@ -0,0 +1,23 @@
+import os
+import sys
+
+import pytest
+
+# The modules sit at the top of the repository, next to this directory.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import TreeLazy  # noqa: E402
+import TreeWalk  # noqa: E402
+
+
+def dump(top) -> list:
+    """Returns what a tree holds, branch by branch in pre-order, for comparing two trees."""
+    return [(prj.id, prj.parent.id if prj.parent is not None else None, prj.title, prj.description,
+             sorted(prj.tags), prj.priority, prj.date, prj.layer) for prj in TreeWalk.pre_order(top)]
+
+
+@pytest.fixture
+def paged(monkeypatch):
+    """Saves trees of a few dozen branches in the paged format and keeps only a few of them in memory."""
+    monkeypatch.setattr(TreeLazy, "PAGED_MIN_BRANCHES", 50)
+    monkeypatch.setattr(TreeLazy, "MAX_RESIDENT", 4)
@@ -0,0 +1,38 @@
+import io
+
+import pytest
+
+import TreeNote as tn
+import TreeNoteCLI
+
+
+@pytest.fixture(autouse=True)
+def in_tmp_path(tmp_path, monkeypatch):
+    """Runs every batch in a directory of its own, where it would write tree.conf."""
+    tn.init()
+    monkeypatch.chdir(tmp_path)
+
+
+def run(script: str, notebook: str = None) -> int:
+    cli = TreeNoteCLI.PrjCmd(batch=True)
+    if notebook is not None:
+        cli.open_notebook(notebook)
+    return cli.run_batch(io.StringIO(script))
+
+
+def test_batch_saves_to_the_notebook_at_the_end(tmp_path):
+    assert run("new Work\nin Work\nnew Report\nsave\nquit\n", "notes.pkl") == 0
+    assert [prj.title for prj in tn.load(str(tmp_path / "notes.pkl")).subprojects] == ["Work"]
+    assert not (tmp_path / TreeNoteCLI.CONFIG_FILE_NAME).exists()
+
+
+def test_batch_save_without_a_file_fails(tmp_path, capsys):
+    assert run("new Work\nsave\n") == 1
+    assert "no file to save to" in capsys.readouterr().err
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_batch_that_cannot_save_fails(tmp_path, capsys):
+    (tmp_path / "notes").mkdir()
+    assert run("new Work\nsave notes\n") == 1
+    assert "saving" in capsys.readouterr().err
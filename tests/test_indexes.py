@@ -0,0 +1,120 @@
+import datetime
+import gc
+import random
+
+import pytest
+
+import TreeIndex
+import TreeNote as tn
+import TreeStore
+import TreeWalk
+
+
+def random_edits(top, steps: int, seed: int) -> None:
+    """Edits a tree at random, cut branches are pasted back later."""
+    rng = random.Random(seed)
+    cut = list()
+    for step in range(steps):
+        prj = rng.choice(list(TreeWalk.pre_order(top)))
+        choice = rng.random()
+        if choice < 0.35:
+            prj.def_subproject(rng.choice(("alpha", "beta", "Alpha"))).set_description("word" + str(step % 7))
+        elif choice < 0.45:
+            prj.set_tag(rng.choice("abc"))
+        elif choice < 0.5:
+            prj.unset_tag(rng.choice("abc"))
+        elif choice < 0.55:
+            prj.set_tag_below(rng.choice("ab"))
+        elif choice < 0.6:
+            prj.set_priority(str(rng.randrange(5)))
+        elif choice < 0.65:
+            prj.set_date(datetime.date(2026, 1, 1) + datetime.timedelta(days=rng.randrange(60)))
+        elif choice < 0.72 and prj.parent is not None:
+            prj.clear_project()
+            cut.append(prj)
+        elif choice < 0.8 and len(cut) != 0:
+            prj.paste_subproject(cut.pop(rng.randrange(len(cut))))
+        elif choice < 0.85 and prj.parent is not None:
+            prj.move_vertically(rng.choice((1, -1)))
+        elif prj.parent is not None:
+            prj.move_laterally(rng.choice((1, -1)))
+
+
+def assert_indexes_match(top) -> None:
+    """Checks every index of a notebook against a walk over its tree."""
+    notebook = top.notebook
+    branches = list(TreeWalk.pre_order(top))
+    ids = notebook.get_index("ids")
+    for prj in branches:
+        assert ids.find(prj.id) is prj
+        for title in ("alpha", "beta"):
+            matches = [sub for sub in prj.subprojects if sub.title.lower() == title]
+            assert (ids.resolve(title, prj) is None) == (len(matches) == 0)
+    for tag in ("a", "b", "c"):
+        found = notebook.get_index("tags").query([tag], top)
+        assert sorted(prj.id for prj in found) == sorted(prj.id for prj in branches if tag in prj.tags)
+    for word in ("word3", "alp"):
+        found = notebook.get_index("text").query([word])
+        matching = [prj for prj in branches
+                    if any(token.startswith(word) for token in TreeIndex.tokenize(prj.title + " " + prj.description))]
+        assert sorted(prj.id for prj in found) == sorted(prj.id for prj in matching)
+    start, end = datetime.date(2026, 1, 10), datetime.date(2026, 2, 1)
+    due = notebook.get_index("dates").between(start, end)
+    assert sorted(prj.id for prj in due) == sorted(
+        prj.id for prj in branches if prj.date is not None and start <= prj.date < end)
+    totals = notebook.get_index("totals")
+    for prj in branches:
+        below = [branch for branch in TreeWalk.pre_order(prj) if branch is not prj]
+        assert totals.get(prj).count == len(below)
+        dates = [branch.date for branch in below if branch.date is not None]
+        assert totals.get(prj).earliest == (min(dates) if len(dates) != 0 else None)
+
+
+@pytest.mark.parametrize("new_tree", [lambda: tn.Project("Notes", -1, None), lambda: TreeStore.new_tree("Notes", -1)],
+                         ids=["project", "store"])
+def test_indexes_follow_edits(new_tree):
+    top = new_tree()
+    top.get_totals()
+    for seed in range(3):
+        random_edits(top, 150, seed)
+        assert_indexes_match(top)
+
+
+def test_indexes_of_a_paged_tree_follow_edits(tmp_path, paged):
+    path = str(tmp_path / "notes.pkl")
+    top = tn.Project("Notes", -1, None)
+    random_edits(top, 300, 0)
+    tn.save(top, path)
+    top = tn.load(path)
+    assert top.notebook.paged
+    assert_indexes_match(top)
+    random_edits(top, 150, 1)
+    assert_indexes_match(top)
+    tn.save(top, path)
+    assert_indexes_match(tn.load(path))
+
+
+def test_indexes_of_a_store_keep_ids():
+    top = TreeStore.new_tree("Notes", -1)
+    random_edits(top, 150, 0)
+    for name in top.notebook.indexes:
+        top.notebook.get_index(name)
+    gc.collect()
+    # Only the top branch, which the notebook holds, is left of the StoredProjects the edits and builds made.
+    assert list(top.store.branches.values()) == [top]
+    assert_indexes_match(top)
+
+
+@pytest.mark.parametrize("new_tree", [lambda: tn.Project("Notes", -1, None), lambda: TreeStore.new_tree("Notes", -1)],
+                         ids=["project", "store"])
+def test_priorities_are_clamped_integers(new_tree):
+    top = new_tree()
+    prj = top.def_subproject("Work")
+    for priority, expected in (("10", "6"), ("-2", "0"), (4, "4")):
+        prj.set_priority(priority)
+        assert prj.priority == expected
+    for priority in ("1.5", "high", ""):
+        with pytest.raises(ValueError):
+            prj.set_priority(priority)
+        assert prj.priority == "4"
+    assert top.notebook.get_index("totals").get(top).max_priority() == "4"
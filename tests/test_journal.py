@@ -0,0 +1,122 @@
+import datetime
+import os
+
+import TreeIndex
+import TreeJournal
+import TreeNote as tn
+import TreeStore
+from conftest import dump
+
+
+def sample_tree(top, branches: int = 20):
+    """Fills a tree with branches a few layers deep, with descriptions, tags, dates and a rule."""
+    parents = [top]
+    for i in range(branches):
+        prj = parents[i // 3].def_subproject("branch " + str(i))
+        prj.set_description("words of branch " + str(i))
+        if i % 4 == 0:
+            prj.set_tag("even")
+        if i % 5 == 0:
+            prj.set_date(datetime.date(2026, 1, 1) + datetime.timedelta(days=i))
+        parents.append(prj)
+    parents[1].set_tag_below("below")
+    parents[2].set_priority_below("3")
+    return top
+
+
+def edit(top) -> None:
+    """Makes one edit of every kind the journal records."""
+    first, second = top.subprojects[0:2]
+    first.def_subproject("new").set_description("added after the save")
+    second.set_tag("late")
+    second.unset_tag("even")
+    second.set_date(datetime.date(2027, 5, 4))
+    second.set_priority("5")
+    first.move_laterally(1)
+    cut = first.subprojects[0]
+    cut.clear_project()
+    second.paste_subproject(cut)
+    cut.subprojects[-1].move_vertically(-1)
+    top.notebook.rename_tag("below", "under")
+
+
+def test_save_appends_edits_and_load_replays_them(tmp_path):
+    path = str(tmp_path / "notes.pkl")
+    top = sample_tree(tn.Project("Notes", -1, None))
+    tn.save(top, path)
+    snapshot_bytes = os.path.getsize(path)
+    edit(top)
+    tn.save(top, path)
+    assert os.path.getsize(path) == snapshot_bytes
+    assert os.path.getsize(TreeJournal.journal_path(path)) > 0
+    assert dump(tn.load(path)) == dump(top)
+
+
+def test_compaction_writes_the_edits_into_the_snapshot(tmp_path, monkeypatch):
+    monkeypatch.setattr(TreeJournal, "COMPACT_MIN_BYTES", 0)
+    monkeypatch.setattr(TreeJournal, "COMPACT_RATIO", 0)
+    path = str(tmp_path / "notes.pkl")
+    top = sample_tree(tn.Project("Notes", -1, None))
+    tn.save(top, path)
+    journal_bytes = os.path.getsize(TreeJournal.journal_path(path))
+    edit(top)
+    tn.save(top, path)
+    assert os.path.getsize(TreeJournal.journal_path(path)) == journal_bytes
+    assert dump(tn.load(path)) == dump(top)
+
+
+def test_text_index_is_loaded_with_the_snapshot(tmp_path, monkeypatch):
+    path = str(tmp_path / "notes.pkl")
+    top = sample_tree(tn.Project("Notes", -1, None))
+    top.notebook.get_index("text")
+    tn.save(top, path)
+    edit(top)
+    tn.save(top, path)
+    build = TreeIndex.TextIndex.build
+
+    def build_top_only(index, prj):
+        assert len(prj.subprojects) == 0, "the text index was built again"
+        build(index, prj)
+    monkeypatch.setattr(TreeIndex.TextIndex, "build", build_top_only)
+    loaded = tn.load(path)
+    assert "text" not in loaded.notebook.stale_indexes
+    found = loaded.notebook.get_index("text").query(["words"])
+    assert [prj.id for prj in found] == [prj.id for prj in top.notebook.get_index("text").query(["words"])]
+    assert all(prj is loaded.notebook.get_index("ids").find(prj.id) for prj in found)
+
+
+def test_deep_tree_round_trip(tmp_path):
+    path = str(tmp_path / "notes.pkl")
+    top = tn.Project("Notes", -1, None)
+    prj = top
+    for i in range(3000):
+        prj = prj.def_subproject("layer " + str(i))
+    prj.set_tag("bottom")
+    tn.save(top, path)
+    loaded = tn.load(path)
+    assert dump(loaded) == dump(top)
+    assert loaded.get_totals() == top.get_totals()
+
+
+def test_paged_round_trip(tmp_path, paged):
+    path = str(tmp_path / "notes.pkl")
+    top = sample_tree(tn.Project("Notes", -1, None), 200)
+    tn.save(top, path)
+    loaded = tn.load(path)
+    assert loaded.notebook.paged
+    assert dump(loaded) == dump(top)
+    edit(loaded)
+    edit(top)
+    tn.save(loaded, path)
+    assert dump(tn.load(path)) == dump(top)
+
+
+def test_store_round_trip(tmp_path):
+    path = str(tmp_path / "notes.pkl")
+    top = sample_tree(TreeStore.new_tree("Notes", -1))
+    tn.save(top, path)
+    edit(top)
+    tn.save(top, path)
+    loaded = tn.load(path)
+    assert type(loaded) is TreeStore.StoredProject
+    assert dump(loaded) == dump(top)
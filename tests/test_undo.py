@@ -0,0 +1,111 @@
+import pytest
+
+import TreeNote as tn
+import TreeStore
+from conftest import dump
+
+NEW_TREES = [lambda: tn.Project("Notes", -1, None), lambda: TreeStore.new_tree("Notes", -1)]
+
+
+def step(history, edit) -> None:
+    """Makes one undoable step, as one CLI command does."""
+    history.begin()
+    edit()
+    history.end()
+
+
+@pytest.fixture(params=NEW_TREES, ids=["project", "store"])
+def top(request):
+    top = request.param()
+    work = top.def_subproject("Work")
+    report = work.def_subproject("Report")
+    report.set_description("due friday")
+    report.set_tag("urgent")
+    report.def_subproject("Draft").set_tag("wip")
+    work.def_subproject("Meeting")
+    top.def_subproject("Home").set_tag_below("home")
+    return top
+
+
+def test_undo_and_redo_cut_and_paste(top):
+    history = top.notebook.start_history()
+    work, home = top.subprojects
+    report = work.subprojects[0]
+    states = [dump(top)]
+    step(history, report.clear_project)
+    states.append(dump(top))
+    step(history, lambda: home.paste_subproject(report))
+    states.append(dump(top))
+    step(history, lambda: report.set_tag("moved"))
+    states.append(dump(top))
+
+    for state in reversed(states[:-1]):
+        history.undo()
+        assert dump(top) == state
+    assert not history.can_undo()
+    for state in states[1:]:
+        history.redo()
+        assert dump(top) == state
+    assert not history.can_redo()
+
+
+def test_undo_puts_a_cut_branch_back_where_it_was(top):
+    history = top.notebook.start_history()
+    work = top.subprojects[0]
+    before = dump(top)
+    step(history, work.subprojects[0].clear_project)
+    assert [prj.title for prj in work.subprojects] == ["Meeting"]
+    history.undo()
+    assert dump(top) == before
+    assert [prj.title for prj in work.subprojects] == ["Report", "Meeting"]
+
+
+def test_undo_of_a_paste_between_siblings(top):
+    history = top.notebook.start_history()
+    work, home = top.subprojects
+    home.def_subproject("Garden")
+    home.def_subproject("Kitchen")
+    meeting = work.subprojects[1]
+    before = dump(top)
+    step(history, meeting.clear_project)
+    step(history, lambda: home.paste_subproject(meeting, 1))
+    assert [prj.title for prj in home.subprojects] == ["Garden", "Meeting", "Kitchen"]
+    history.undo()
+    history.undo()
+    assert dump(top) == before
+
+
+@pytest.mark.parametrize("rule", [lambda prj: prj.set_tag_below("t"), lambda prj: prj.set_priority_below("4")],
+                         ids=["tag", "priority"])
+def test_undo_of_a_cut_takes_back_the_marks_the_branch_kept(rule):
+    top = tn.Project("Notes", -1, None)
+    history = top.notebook.start_history()
+    parent = top.def_subproject("Work")
+    branch = parent.def_subproject("Report")
+    before = dump(top)
+    step(history, lambda: rule(parent))
+    step(history, branch.clear_project)
+    step(history, lambda: top.paste_subproject(branch))
+    history.undo()
+    history.undo()
+    history.undo()
+    assert dump(top) == before
+    assert sorted(branch.tags) == [] and branch.priority == "0"
+    assert top.notebook.get_index("tags").query(["t"], top) == list()
+
+
+def test_undo_of_a_description_set_on_another_layer(top):
+    history = top.notebook.start_history()
+    work, home = top.subprojects
+    report = work.subprojects[0]
+    garden = home.def_subproject("Garden")
+    # Set a layer higher, the description keeps that layer's spacing after the paste.
+    step(history, report.clear_project)
+    step(history, lambda: garden.paste_subproject(report))
+    assert report.layer == 2
+    description = report.description
+    step(history, lambda: report.set_description("due monday"))
+    history.undo()
+    assert report.description == description
+    history.redo()
+    assert report.description == report.get_layer_description_spacing() + "due monday"